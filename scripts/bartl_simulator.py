@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Bartl Controller Simulator
+
+This script runs a local Modbus TCP server that stands in for the Bartl heat
+pump controller. The register space is built from a modbus4mqtt YAML
+configuration file and filled by value generators per topic family.
+
+Usage:
+    python bartl_simulator.py --config config/modbus4mqtt/Bartl-WP.yml --port 5020 --latency 0.02 --max-registers 32
+    python bartl_simulator.py --config config/modbus4mqtt/Bartl-WP.yml --max-registers 16 --busy-gap 0.01
+
+Features:
+- Register space generated from bartl_full.yml, Bartl-WP.yml or any modbus4mqtt config
+- Temperatures drift, value_map states cycle, operating hours and energy counters increase
+- Writable parameters keep the values written to them
+- Configurable per-request latency and device processing time
+- Maximum registers per request and optional rejection of unconfigured addresses
+- Optional busy exception for requests that follow the previous one too closely
+- Pipelined requests are answered as they finish, --max-in-flight rejects pipelining
+- Optional start times of request bursts (poll cycles) for timing pollers from the outside
+- Deterministic values for a given --seed
+"""
+
+import asyncio
+import argparse
+import bisect
+import math
+import random
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from modbus_mqtt_bridge import Register, load_registers
+from modbus_tcp import (ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE, ILLEGAL_FUNCTION, MBAP_HEADER,
+                        MAX_READ_REGISTERS, READ_FUNCTIONS, SERVER_DEVICE_BUSY, WRITE_MULTIPLE_REGISTERS,
+                        WRITE_SINGLE_REGISTER)
+from register_model import load_config
+
+TABLES_BY_FUNCTION = {function: table for table, function in READ_FUNCTIONS.items()}
+
+# Base temperatures in °C per topic keyword, first match wins
+TEMPERATURE_BASES = [
+    ('aussen', 8.0),
+    ('quellen', 6.0),
+    ('heisgas', 70.0),
+    ('raum', 21.0),
+    ('warmwasser', 48.0),
+    ('puffer', 35.0),
+    ('ruecklauf', 30.0),
+    ('vorlauf', 35.0),
+]
+
+COUNTER_KEYWORDS = ('betriebsstunden', 'verbrauch', 'energie', '_kwh')
+
+
+class DriftGenerator:
+    """Slow sine drift around a base value plus a little noise"""
+
+    def __init__(self, rng: random.Random, base: float, amplitude: float = 2.0, period: float = 600.0):
+        self.rng = rng
+        self.base = base
+        self.amplitude = amplitude
+        self.period = period
+        self.phase = rng.uniform(0, 2 * math.pi)
+
+    def __call__(self, t: float) -> str:
+        value = self.base + self.amplitude * math.sin(2 * math.pi * t / self.period + self.phase)
+        return str(round(value + self.rng.uniform(-0.1, 0.1), 1))
+
+
+class CycleGenerator:
+    """Step through the states of a value_map"""
+
+    def __init__(self, rng: random.Random, states: List[str], period: float = 60.0):
+        self.states = states
+        self.period = period
+        self.offset = rng.randrange(len(states))
+
+    def __call__(self, t: float) -> str:
+        return self.states[(int(t / self.period) + self.offset) % len(self.states)]
+
+
+class CounterGenerator:
+    """Monotonically increasing counter"""
+
+    def __init__(self, rng: random.Random, rate: float):
+        self.start = rng.randint(1000, 20000)
+        self.rate = rate
+
+    def __call__(self, t: float) -> str:
+        return str(int(self.start + self.rate * t))
+
+
+class ConstantGenerator:
+    def __init__(self, value: str):
+        self.value = value
+
+    def __call__(self, t: float) -> str:
+        return self.value
+
+
+def create_generator(register: Register, rng: random.Random):
+    """Pick a value generator for a register based on its topic"""
+    topic = register.pub_topic.lower()
+    if register.value_map:
+        if register.set_topic:
+            return ConstantGenerator(next(iter(register.value_map)))
+        return CycleGenerator(rng, list(register.value_map))
+    if register.set_topic:
+        if 'temperatur' in topic:
+            return ConstantGenerator('20.0')
+        return ConstantGenerator(str(rng.randint(0, 1)))
+    if any(keyword in topic for keyword in COUNTER_KEYWORDS):
+        return CounterGenerator(rng, rate=1 / 60)
+    if 'temperatur' in topic:
+        base = next((base for keyword, base in TEMPERATURE_BASES if keyword in topic), 30.0)
+        return DriftGenerator(rng, base)
+    if 'prozent' in topic or 'percent' in topic or 'drehzahl' in topic:
+        return DriftGenerator(rng, 50.0, amplitude=30.0, period=300.0)
+    return ConstantGenerator(str(rng.randint(0, 10)))
+
+
+class BartlSimulator:
+    def __init__(self, config: Dict[str, Any], latency: float = 0.0, processing_time: float = 0.0,
+                 max_registers: int = MAX_READ_REGISTERS, strict_addresses: bool = False, seed: int = 0,
+                 busy_gap: float = 0.0, max_in_flight: int = 0, burst_gap: float = 0.0):
+        self.latency = latency
+        self.processing_time = processing_time
+        self.max_registers = max_registers
+        self.strict_addresses = strict_addresses
+        self.busy_gap = busy_gap
+        self.max_in_flight = max_in_flight
+        # A request after a pause of at least burst_gap starts a new burst, one per poll cycle
+        self.burst_gap = burst_gap
+        self.burst_starts: List[float] = []
+        self._last_request = None
+
+        rng = random.Random(seed)
+        # table -> sorted head addresses and their (register, generator)
+        self._generated: Dict[str, List[Tuple[int, Register, Any]]] = {}
+        self._heads: Dict[str, List[int]] = {}
+        self._written: Dict[Tuple[str, int], int] = {}
+        self._known: Dict[str, set] = {}
+        for register in load_registers(config):
+            entries = self._generated.setdefault(register.table, [])
+            if any(address == register.address for address, _, _ in entries):
+                continue  # duplicated address, the first register drives the value
+            entries.append((register.address, register, create_generator(register, rng)))
+            self._known.setdefault(register.table, set()).update(
+                range(register.address, register.address + register.width))
+        for table, entries in self._generated.items():
+            entries.sort(key=lambda entry: entry[0])
+            self._heads[table] = [address for address, _, _ in entries]
+
+        self._device_lock = None
+        self._server = None
+        self._started = 0.0
+        self._last_processed = None
+        self.requests = 0
+        self.registers_read = 0
+        self.exceptions = 0
+        self.writes = 0
+        self.registers_written = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the request counters"""
+        return {
+            'requests': self.requests,
+            'registers_read': self.registers_read,
+            'writes': self.writes,
+            'registers_written': self.registers_written,
+            'exceptions': self.exceptions,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent,
+        }
+
+    def read(self, table: str, address: int, count: int, t: float) -> List[int]:
+        """Return count register words starting at address"""
+        words = {}
+        heads = self._heads.get(table, [])
+        entries = self._generated.get(table, [])
+        # Include a multi-register value that starts just before the range
+        first = max(0, bisect.bisect_left(heads, address) - 1)
+        for head, register, generator in entries[first:bisect.bisect_left(heads, address + count)]:
+            for index, word in enumerate(register.encode(generator(t))):
+                words[head + index] = word
+        words.update({a: value for (tbl, a), value in self._written.items()
+                      if tbl == table and address <= a < address + count})
+        return [words.get(a, 0) for a in range(address, address + count)]
+
+    def write(self, address: int, values: List[int]):
+        """Store written holding register values, they override the generators"""
+        self.writes += 1
+        self.registers_written += len(values)
+        for index, value in enumerate(values):
+            self._written[('holding', address + index)] = value
+
+    def _exception(self, function: int, code: int) -> bytes:
+        self.exceptions += 1
+        return struct.pack('>BB', function | 0x80, code)
+
+    def process(self, pdu: bytes, t: float) -> bytes:
+        """Process a request PDU and return the response PDU"""
+        function = pdu[0]
+        if function in TABLES_BY_FUNCTION:
+            address, count = struct.unpack('>HH', pdu[1:5])
+            table = TABLES_BY_FUNCTION[function]
+            if not 1 <= count <= self.max_registers:
+                return self._exception(function, ILLEGAL_DATA_VALUE)
+            if self.strict_addresses and not set(range(address, address + count)) <= self._known.get(table, set()):
+                return self._exception(function, ILLEGAL_DATA_ADDRESS)
+            self.registers_read += count
+            values = self.read(table, address, count, t)
+            return struct.pack(f'>BB{count}H', function, 2 * count, *values)
+        if function == WRITE_SINGLE_REGISTER:
+            address, value = struct.unpack('>HH', pdu[1:5])
+            self.write(address, [value])
+            return pdu[:5]
+        if function == WRITE_MULTIPLE_REGISTERS:
+            address, count = struct.unpack('>HH', pdu[1:5])
+            self.write(address, list(struct.unpack(f'>{count}H', pdu[6:6 + 2 * count])))
+            return pdu[:5]
+        return self._exception(function, ILLEGAL_FUNCTION)
+
+    async def _respond(self, writer: asyncio.StreamWriter, transaction_id: int, unit: int, pdu: bytes):
+        # Link latency overlaps between requests, device processing does not
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        async with self._device_lock:
+            if self.processing_time:
+                await asyncio.sleep(self.processing_time)
+            t = asyncio.get_running_loop().time() - self._started
+            if self.busy_gap and self._last_processed is not None and t - self._last_processed < self.busy_gap:
+                # Still busy with the previous request
+                response = self._exception(pdu[0], SERVER_DEVICE_BUSY)
+            else:
+                response = self.process(pdu, t)
+            self._last_processed = t
+        if not writer.is_closing():
+            writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response)
+            self.bytes_sent += MBAP_HEADER.size + len(response)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, _, length, unit = MBAP_HEADER.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                self.bytes_received += MBAP_HEADER.size + len(pdu)
+                if self.burst_gap:
+                    now = time.monotonic()
+                    if self._last_request is None or now - self._last_request >= self.burst_gap:
+                        self.burst_starts.append(now)
+                    self._last_request = now
+                if self.max_in_flight and len(tasks) >= self.max_in_flight:
+                    # No buffer for another request on this connection
+                    response = self._exception(pdu[0], SERVER_DEVICE_BUSY)
+                    writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response)
+                    self.bytes_sent += MBAP_HEADER.size + len(response)
+                    continue
+                task = asyncio.get_running_loop().create_task(self._respond(writer, transaction_id, unit, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 5020) -> int:
+        """Start serving and return the bound port"""
+        self._started = asyncio.get_running_loop().time()
+        self._device_lock = asyncio.Lock()
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def serve(simulator: BartlSimulator, host: str, port: int):
+    port = await simulator.start(host, port)
+    print(f"🔌 Simulating Bartl controller on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a Bartl heat pump controller as Modbus TCP server')
+    parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=5020, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay in seconds before each response')
+    parser.add_argument('--processing-time', type=float, default=0.0,
+                        help='Time in seconds the device needs per request, requests are processed one at a time')
+    parser.add_argument('--max-registers', type=int, default=MAX_READ_REGISTERS,
+                        help='Maximum registers per read request')
+    parser.add_argument('--strict-addresses', action='store_true',
+                        help='Reject reads that touch addresses not in the config')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the value generators')
+    parser.add_argument('--busy-gap', type=float, default=0.0,
+                        help='Answer busy to requests less than this many seconds after the previous one')
+    parser.add_argument('--max-in-flight', type=int, default=0,
+                        help='Answer busy to requests beyond this many unanswered ones on a connection (0: no limit)')
+
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print(f"Config file not found: {args.config}")
+        sys.exit(1)
+
+    config = load_config(args.config)
+
+    simulator = BartlSimulator(config, args.latency, args.processing_time, args.max_registers,
+                               args.strict_addresses, args.seed, args.busy_gap, args.max_in_flight)
+    try:
+        asyncio.run(serve(simulator, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n📊 Served {simulator.requests} requests, {simulator.registers_read} registers, "
+              f"{simulator.exceptions} exceptions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Discovery generation benchmark
+
+This script times HADiscoveryGenerator on the real register maps and on
+synthetic maps of growing size. The time per register should stay flat as
+the maps grow, a rising value points at work that scales with the number of
+registers or keyword rules.
+
+Usage:
+    python benchmark_discovery.py
+    python benchmark_discovery.py --maps Bartl-WP synthetic-1000 synthetic-10000 --repeat 5 --output discovery_benchmark.json
+
+Features:
+- Runs Bartl-WP.yml, bartl_full.yml and synthetic maps of any size (synthetic-<count>)
+- Topic classification timed on its own, with a cold and a warm cache
+- Full generation timed with a fresh generator per run, best of --repeat
+- Retained payload bytes of the full and the compact discovery set
+- Config loading: pure Python YAML, libyaml and the register model cache, and
+  the generator's process startup with a cold and a warm cache
+- value_map templates: size and render cost of the generator's if/elif chains
+  against dictionary lookups (render cost needs jinja2, as used by Home Assistant)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+from unittest.mock import patch
+
+import yaml
+
+from benchmark_poll_cycle import load_map
+from discovery_manifest import payload_bytes
+from generate_ha_discovery import HADiscoveryGenerator
+from register_model import load_register_map
+
+DEFAULT_MAPS = ['Bartl-WP', 'bartl_full', 'synthetic-1000', 'synthetic-5000', 'synthetic-10000']
+DEFAULT_TEMPLATE_MAPS = ['Bartl-WP']
+RENDER_ROUNDS = 100
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+def chain_templates(value_map: Dict[str, Any]):
+    """The if/elif chain templates the generator emits"""
+    value_conditions = [f"value == '{value}' %}}{state}" for state, value in value_map.items()]
+    command_conditions = [f"value == '{state}' %}}{value}" for state, value in value_map.items()]
+    return ("{% if " + "{% elif ".join(value_conditions) + "{% else %}{{ value }}{% endif %}",
+            "{% if " + "{% elif ".join(command_conditions) + "{% else %}{{ value }}{% endif %}")
+
+
+def lookup_templates(value_map: Dict[str, Any]):
+    """Dictionary lookup templates with the raw value as fallback
+
+    Smaller than the chains but not faster to render, Jinja rebuilds the dict
+    literal on every render.
+    """
+    to_state, to_value = {}, {}
+    for state, value in value_map.items():
+        # First entry wins, like the if/elif chains
+        to_state.setdefault(str(value), str(state))
+        to_value.setdefault(str(state), str(value))
+    return (f"{{{{ {json.dumps(to_state, ensure_ascii=False)}[value] | default(value) }}}}",
+            f"{{{{ {json.dumps(to_value, ensure_ascii=False)}[value] | default(value) }}}}")
+
+
+def best_of(repeat: int, run, setup=None) -> float:
+    """Return the fastest of repeat runs in seconds, setup runs untimed before each"""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark_map(name: str, repeat: int, mqtt_prefix: str) -> Dict[str, Any]:
+    config = load_map(name)
+    topics = [register['pub_topic'] for register in config['registers'] if 'pub_topic' in register]
+    count = len(topics)
+
+    def classify_cold():
+        generator = HADiscoveryGenerator(mqtt_prefix)
+        for topic in topics:
+            generator.classify_topic(topic)
+
+    warm = HADiscoveryGenerator(mqtt_prefix)
+    for topic in topics:
+        warm.classify_topic(topic)
+
+    def classify_warm():
+        for topic in topics:
+            warm.classify_topic(topic)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False, encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+        config_file = f.name
+
+    # Generation including the YAML parse, without the register model cache
+    try:
+        # patch.dict restores a REGISTER_MODEL_CACHE set by the caller
+        with patch.dict(os.environ, REGISTER_MODEL_CACHE=''):
+            load = best_of(repeat, lambda: load_register_map(config_file, cache_dir=None))
+            generate = best_of(repeat, lambda: HADiscoveryGenerator(mqtt_prefix).generate_discovery_configs(config_file))
+            generator = HADiscoveryGenerator(mqtt_prefix)
+            discovery_configs = generator.generate_discovery_configs(config_file)
+            compact_configs = generator.compact_discovery_configs(discovery_configs)
+    finally:
+        os.unlink(config_file)
+
+    cold = best_of(repeat, classify_cold)
+    hot = best_of(repeat, classify_warm)
+    return {
+        'map': name,
+        'registers': count,
+        'classify_cold_us_per_register': round(1e6 * cold / count, 2),
+        'classify_warm_us_per_register': round(1e6 * hot / count, 2),
+        'yaml_load_ms': round(1000 * load, 1),
+        'generate_ms': round(1000 * generate, 1),
+        'generate_us_per_register': round(1e6 * generate / count, 1),
+        'generate_without_yaml_us_per_register': round(1e6 * max(generate - load, 0.0) / count, 1),
+        'payload_bytes': payload_bytes(discovery_configs),
+        'compact_payload_bytes': payload_bytes(compact_configs),
+    }
+
+
+def benchmark_loading(name: str, repeat: int, mqtt_prefix: str) -> Dict[str, Any]:
+    """Config loading and generator startup, cold and warm register model cache"""
+    config = load_map(name)
+    work_dir = Path(tempfile.mkdtemp(prefix='discovery-benchmark-'))
+    config_file = work_dir / 'config.yml'
+    cache_dir = work_dir / 'cache'
+    with open(config_file, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+
+    def read_python():
+        with open(config_file, 'r', encoding='utf-8') as f:
+            yaml.load(f, Loader=yaml.SafeLoader)
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    command = [sys.executable, str(SCRIPT_DIR / 'generate_ha_discovery.py'), '--config', str(config_file),
+               '--mqtt-prefix', mqtt_prefix, '--output', str(work_dir / 'discovery.json')]
+    env = dict(os.environ, REGISTER_MODEL_CACHE=str(cache_dir))
+
+    def startup():
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    try:
+        python_yaml = best_of(repeat, read_python)
+        libyaml = best_of(repeat, lambda: load_register_map(str(config_file), cache_dir=None))
+        load_register_map(str(config_file), cache_dir)
+        cached = best_of(repeat, lambda: load_register_map(str(config_file), cache_dir))
+        startup_cold = best_of(repeat, startup, clear_cache)
+        startup()
+        startup_warm = best_of(repeat, startup)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'map': name,
+        'config_bytes': len(yaml.safe_dump(config, allow_unicode=True).encode('utf-8')),
+        'yaml_python_ms': round(1000 * python_yaml, 2),
+        'yaml_libyaml_ms': round(1000 * libyaml, 2),
+        'model_cache_ms': round(1000 * cached, 2),
+        'startup_cold_ms': round(1000 * startup_cold, 1),
+        'startup_warm_ms': round(1000 * startup_warm, 1),
+    }
+
+
+def print_loading_summary(results: List[Dict[str, Any]]):
+    print(f"\n{'Map':<18} {'Config KB':>9} {'Python YAML':>12} {'libyaml':>9} {'cache':>8} "
+          f"{'Startup cold':>13} {'warm':>9}")
+    for result in results:
+        print(f"{result['map']:<18} {result['config_bytes'] / 1024:>9.1f} {result['yaml_python_ms']:>9.2f} ms "
+              f"{result['yaml_libyaml_ms']:>9.2f} {result['model_cache_ms']:>8.2f} "
+              f"{result['startup_cold_ms']:>10.1f} ms {result['startup_warm_ms']:>9.1f}")
+
+
+def benchmark_templates(name: str) -> Dict[str, Any]:
+    """Compare if/elif and lookup templates for every value_map register of a map"""
+    config = load_map(name)
+    value_maps = [register['value_map'] for register in config['registers'] if register.get('value_map')]
+    variants = {'chain': [chain_templates(value_map) for value_map in value_maps],
+                'lookup': [lookup_templates(value_map) for value_map in value_maps]}
+    result = {'map': name, 'mapped_registers': len(value_maps)}
+    for variant, templates in variants.items():
+        result[variant] = {
+            'bytes': sum(len(value.encode('utf-8')) + len(command.encode('utf-8')) for value, command in templates),
+            'distinct': len(set(templates)),
+        }
+
+    try:
+        from jinja2.sandbox import ImmutableSandboxedEnvironment
+    except ImportError:
+        print("jinja2 not installed, skipping template render timing. Install with: pip install jinja2")
+        return result
+
+    env = ImmutableSandboxedEnvironment()
+    for variant, templates in variants.items():
+        # Home Assistant compiles a template once and renders it per state message
+        cases = []
+        for (value_template, command_template), value_map in zip(templates, value_maps):
+            compiled = env.from_string(value_template), env.from_string(command_template)
+            inputs = [(str(value), str(state)) for state, value in value_map.items()] + [('99', 'unknown')]
+            cases.append((compiled, inputs))
+        renders = RENDER_ROUNDS * 2 * sum(len(inputs) for _, inputs in cases)
+
+        def render_all():
+            for _ in range(RENDER_ROUNDS):
+                for (value_template, command_template), inputs in cases:
+                    for raw, state in inputs:
+                        value_template.render(value=raw)
+                        command_template.render(value=state)
+
+        result[variant]['render_us'] = round(1e6 * best_of(5, render_all) / renders, 2)
+
+    # Both variants must map every input the same way
+    for (chain, lookup), value_map in zip(zip(variants['chain'], variants['lookup']), value_maps):
+        for raw, state in [(str(value), str(state)) for state, value in value_map.items()] + [('99', 'unknown')]:
+            assert env.from_string(chain[0]).render(value=raw) == env.from_string(lookup[0]).render(value=raw)
+            assert env.from_string(chain[1]).render(value=state) == env.from_string(lookup[1]).render(value=state)
+    return result
+
+
+def print_template_summary(results: List[Dict[str, Any]]):
+    print(f"\n{'Map':<18} {'Mapped':>7} {'Template':>9} {'Bytes':>8} {'Distinct':>9} {'Render µs':>10}")
+    for result in results:
+        for variant in ('chain', 'lookup'):
+            stats = result[variant]
+            render = f"{stats['render_us']:>10.2f}" if 'render_us' in stats else f"{'-':>10}"
+            print(f"{result['map']:<18} {result['mapped_registers']:>7} {variant:>9} {stats['bytes']:>8} "
+                  f"{stats['distinct']:>9} {render}")
+
+
+def print_summary(results: List[Dict[str, Any]]):
+    print(f"\n{'Map':<18} {'Registers':>9} {'Classify cold':>14} {'warm':>7} {'Generate':>10} "
+          f"{'µs/reg':>8} {'µs/reg w/o YAML':>16} {'Bytes':>9} {'compact':>9}")
+    for result in results:
+        print(f"{result['map']:<18} {result['registers']:>9} "
+              f"{result['classify_cold_us_per_register']:>11.2f} µs {result['classify_warm_us_per_register']:>7.2f} "
+              f"{result['generate_ms']:>7.1f} ms {result['generate_us_per_register']:>8.1f} "
+              f"{result['generate_without_yaml_us_per_register']:>16.1f} "
+              f"{result['payload_bytes']:>9} {result['compact_payload_bytes']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Home Assistant discovery generation')
+    parser.add_argument('--maps', nargs='+', default=DEFAULT_MAPS,
+                        help='Register maps: config names, YAML paths or synthetic-<count>')
+    parser.add_argument('--template-maps', nargs='+', default=DEFAULT_TEMPLATE_MAPS,
+                        help='Register maps for the value_map template comparison')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest counts')
+    parser.add_argument('--mqtt-prefix', default='bartl_wp', help='MQTT topic prefix')
+    parser.add_argument('--output', help='Optional output JSON file for the results')
+
+    args = parser.parse_args()
+
+    results = [benchmark_map(name, args.repeat, args.mqtt_prefix) for name in args.maps]
+    print_summary(results)
+    loading_results = [benchmark_loading(name, args.repeat, args.mqtt_prefix) for name in args.maps]
+    print_loading_summary(loading_results)
+    template_results = [benchmark_templates(name) for name in args.template_maps]
+    print_template_summary(template_results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), 'results': results, 'loading': loading_results,
+                       'templates': template_results}, f, indent=2)
+        print(f"\nSaved benchmark results to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
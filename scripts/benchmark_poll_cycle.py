@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+End-to-end poll cycle benchmark
+
+This script runs the full pipeline against local stand-ins: Modbus read via
+the bridge from bartl_simulator.py, decode/scale/value_map, MQTT publish to
+mqtt_standin.py and Home Assistant discovery generation and publishing. The
+stand-ins run in a child process so the CPU time measured is the bridge's own.
+
+Usage:
+    python benchmark_poll_cycle.py --cycles 20 --output benchmark_results.json
+    python benchmark_poll_cycle.py --maps Bartl-WP synthetic-5000 --latency 0.005 --compare benchmark_results.json
+    python benchmark_poll_cycle.py --maps Bartl-WP --latency 0.02 --pipeline-depth 8
+    python benchmark_poll_cycle.py --maps Bartl-WP bartl_full --baseline-modbus4mqtt modbus4mqtt
+
+Features:
+- Runs Bartl-WP.yml, bartl_full.yml and synthetic maps of any size (synthetic-<count>)
+- Cycle latency percentiles, registers/s, MQTT messages/s, bytes on the wire and CPU per cycle
+- Discovery generation and publish timing for the same map
+- Optional InfluxDB line-protocol sink against influx_standin.py (--with-influx)
+- Optional per-cycle JSON snapshots (--with-snapshots)
+- Optional pipelined Modbus reads (--pipeline-depth), the simulator can reject them (--max-in-flight)
+- Optional baseline: the modbus4mqtt CLI against the same stand-ins (--baseline-modbus4mqtt)
+- Saves results as JSON and compares against a previous run
+"""
+
+import asyncio
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+
+import yaml
+
+from bartl_simulator import BartlSimulator
+from discovery_manifest import publish_incremental
+from generate_ha_discovery import HADiscoveryGenerator
+from influx_sink import InfluxLineSink
+from influx_standin import InfluxStandin
+from modbus_mqtt_bridge import ModbusMqttBridge
+from mqtt_publisher import FlowControlledPublisher, connect_client, disconnect_client
+from mqtt_standin import MqttBrokerStandin
+from register_model import load_yaml
+
+CONFIG_DIR = Path(__file__).resolve().parent.parent / 'config' / 'modbus4mqtt'
+DEFAULT_MAPS = ['Bartl-WP', 'bartl_full', 'synthetic-5000']
+DELIVERY_TIMEOUT = 30.0
+# modbus4mqtt sleeps update_rate between polls, the pause marks its cycles on the simulator
+BASELINE_UPDATE_RATE = 1.0
+
+SYNTHETIC_GROUPS = ['heizkreis', 'warmwasser', 'puffer', 'waermepumpe', 'photovoltaik']
+
+
+def synthetic_config(count: int, seed: int = 0) -> Dict[str, Any]:
+    """Create a modbus4mqtt config with count registers in dense address runs"""
+    rng = random.Random(seed)
+    registers = []
+    address = 1
+    while len(registers) < count:
+        for _ in range(rng.randint(10, 60)):
+            if len(registers) == count:
+                break
+            index = len(registers)
+            group = SYNTHETIC_GROUPS[index % len(SYNTHETIC_GROUPS)]
+            kind = rng.random()
+            if kind < 0.5:
+                entry = {'pub_topic': f"{group}/temperatur/sensor_{index}", 'scale': 0.1}
+            elif kind < 0.6:
+                entry = {'pub_topic': f"{group}/status_{index}", 'value_map': {'AUS': 0, 'AKTIV': 1}}
+            elif kind < 0.7:
+                entry = {'pub_topic': f"{group}/betriebsstunden/zaehler_{index}"}
+            else:
+                entry = {'pub_topic': f"{group}/parameter_{index}", 'set_topic': f"{group}/parameter_{index}/set"}
+            entry.update(address=address, pub_only_on_change=False)
+            registers.append(entry)
+            address += 1
+        address += rng.randint(5, 50)
+    return {'ip': '127.0.0.1', 'port': 502, 'update_rate': 5, 'address_offset': 0,
+            'scan_batching': 1, 'registers': registers}
+
+
+def load_map(name: str) -> Dict[str, Any]:
+    """Load a named register map, a synthetic-<count> map or a YAML file"""
+    if name.startswith('synthetic-'):
+        return synthetic_config(int(name.split('-', 1)[1]))
+    path = Path(name) if name.endswith(('.yml', '.yaml')) else CONFIG_DIR / f"{name}.yml"
+    with open(path, 'r', encoding='utf-8') as f:
+        return load_yaml(f.read())
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear interpolation percentile of a list of values"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def run_standins(config: Dict[str, Any], options: Dict[str, Any], conn):
+    """Child process: serve the Modbus simulator, the MQTT broker and the InfluxDB stand-ins"""
+    async def serve():
+        simulator = BartlSimulator(config, options['latency'], options['processing_time'],
+                                   options['max_registers'], max_in_flight=options['max_in_flight'],
+                                   burst_gap=options['burst_gap'])
+        broker = MqttBrokerStandin()
+        influx = InfluxStandin()
+        conn.send((await simulator.start('127.0.0.1', 0), await broker.start('127.0.0.1', 0),
+                   await influx.start('127.0.0.1', 0)))
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            conn.send({'simulator': simulator.stats(), 'broker': broker.stats(), 'influx': influx.stats(),
+                       'bursts': list(simulator.burst_starts)})
+            if command == 'stop':
+                break
+        await simulator.stop()
+        await broker.stop()
+        await influx.stop()
+
+    asyncio.run(serve())
+
+
+class Standins:
+    """Handle to the stand-in child process"""
+
+    def __init__(self, config: Dict[str, Any], options: Dict[str, Any]):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_standins, args=(config, options, child_conn), daemon=True)
+        self.process.start()
+        self.modbus_port, self.mqtt_port, self.influx_port = self.conn.recv()
+
+    def stats(self, command: str = 'stats') -> Dict[str, Dict[str, int]]:
+        self.conn.send(command)
+        return self.conn.recv()
+
+    def stop(self) -> Dict[str, Dict[str, int]]:
+        stats = self.stats('stop')
+        self.process.join(5)
+        return stats
+
+    async def wait_for_messages(self, target: int, timeout: float = DELIVERY_TIMEOUT) -> int:
+        """Wait until the broker received target messages, return the count"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            received = self.stats()['broker']['messages_received']
+            if received >= target or time.perf_counter() > deadline:
+                return received
+            await asyncio.sleep(0.01)
+
+
+def bridge_config(config: Dict[str, Any], modbus_port: int, args) -> Dict[str, Any]:
+    """Point a config at the simulator and apply the benchmark overrides"""
+    config = dict(config, ip='127.0.0.1', port=modbus_port)
+    if args.scan_batching:
+        config['scan_batching'] = args.scan_batching
+    if not args.with_filter:
+        # Measure the raw pipeline, every value is published every cycle
+        config.pop('publish_filter', None)
+        config['registers'] = [dict(entry, pub_only_on_change=False) for entry in config['registers']]
+    if args.with_snapshots:
+        config['snapshots'] = True
+    if args.pipeline_depth > 1:
+        config['pacing'] = dict(config.get('pacing') or {}, pipeline_depth=args.pipeline_depth)
+    return config
+
+
+async def benchmark_discovery(config: Dict[str, Any], standins: Standins, args) -> Dict[str, Any]:
+    """Generate discovery configs for a map and publish them to the stand-in"""
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+        config_path = f.name
+
+    generator = HADiscoveryGenerator(args.mqtt_prefix)
+    started = time.perf_counter()
+    discovery_configs = generator.generate_discovery_configs(config_path)
+    generate_seconds = time.perf_counter() - started
+    Path(config_path).unlink()
+
+    before = standins.stats()['broker']
+    started = time.perf_counter()
+    client = connect_client('127.0.0.1', standins.mqtt_port)
+    try:
+        counts = publish_incremental(FlowControlledPublisher(client), discovery_configs,
+                                     f"127.0.0.1:{standins.mqtt_port}")
+    finally:
+        disconnect_client(client)
+    publish_seconds = time.perf_counter() - started
+    after = standins.stats()['broker']
+
+    return {
+        'entities': len(discovery_configs),
+        'generate_ms': round(generate_seconds * 1000, 2),
+        'publish_ms': round(publish_seconds * 1000, 2),
+        'confirmed': counts['report'].confirmed,
+        'publish_messages_per_s': round(counts['report'].messages_per_s, 1),
+        'delivered': after['messages_received'] - before['messages_received'],
+        'mqtt_bytes': after['bytes_received'] - before['bytes_received'],
+    }
+
+
+async def benchmark_map(config: Dict[str, Any], standins: Standins, args) -> Dict[str, Any]:
+    """Run the poll cycle benchmark for one register map"""
+    influx = InfluxLineSink(f"http://127.0.0.1:{standins.influx_port}", bucket='benchmark') if args.with_influx else None
+    bridge = ModbusMqttBridge(bridge_config(config, standins.modbus_port, args), '127.0.0.1',
+                              standins.mqtt_port, topic_prefix=args.mqtt_prefix, influx=influx)
+    bridge.loop = asyncio.get_running_loop()
+    bridge.queue = asyncio.Queue()
+    bridge.start_mqtt()
+    deadline = time.perf_counter() + 5
+    while not bridge.mqtt.is_connected():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Bridge could not connect to the MQTT stand-in")
+        await asyncio.sleep(0.01)
+    publisher = bridge.loop.create_task(bridge.publish_loop())
+
+    plan = bridge.read_plan
+    registers = sum(len(span.registers) for span in plan)
+    try:
+        # Warm-up cycle, connects to the simulator and primes the filter
+        await bridge.poll_once(plan)
+        await bridge.queue.join()
+        expected = bridge.publish_filter.published + bridge.snapshots_published
+        await standins.wait_for_messages(expected)
+        if influx:
+            await influx.flush()
+        before = standins.stats()
+
+        durations = []
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        for _ in range(args.cycles):
+            cycle_started = time.perf_counter()
+            await bridge.poll_once(plan)
+            await bridge.queue.join()
+            durations.append(time.perf_counter() - cycle_started)
+        if influx:
+            # One write for all measured cycles, like a flush interval covering them
+            await influx.flush()
+        published = bridge.publish_filter.published + bridge.snapshots_published - expected
+        received = await standins.wait_for_messages(before['broker']['messages_received'] + published)
+        wall_seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+        after = standins.stats()
+    finally:
+        publisher.cancel()
+        bridge.mqtt.loop_stop()
+        bridge.mqtt.disconnect()
+        await bridge.modbus.close()
+
+    def delta(side: str, key: str) -> int:
+        return after[side][key] - before[side][key]
+
+    result = {
+        'registers': registers,
+        'requests_per_cycle': len(plan),
+        'cycles': args.cycles,
+        'cycle_latency_ms': {
+            'p50': round(percentile(durations, 50) * 1000, 3),
+            'p90': round(percentile(durations, 90) * 1000, 3),
+            'p99': round(percentile(durations, 99) * 1000, 3),
+            'max': round(max(durations) * 1000, 3),
+            'mean': round(sum(durations) / len(durations) * 1000, 3),
+        },
+        'registers_per_s': round(registers * args.cycles / sum(durations), 1),
+        'mqtt_messages': received - before['broker']['messages_received'],
+        'mqtt_messages_per_s': round((received - before['broker']['messages_received']) / wall_seconds, 1),
+        'mqtt_bytes': delta('broker', 'bytes_received'),
+        'modbus_requests': delta('simulator', 'requests'),
+        'modbus_bytes': delta('simulator', 'bytes_received') + delta('simulator', 'bytes_sent'),
+        'cpu_ms_per_cycle': round(cpu_seconds / args.cycles * 1000, 3),
+        'pipeline': bridge.modbus.pipeline_stats(),
+    }
+    if influx:
+        result['influx'] = {
+            'requests': delta('influx', 'requests'),
+            'points': delta('influx', 'points'),
+            'fields': delta('influx', 'fields'),
+            'bytes': delta('influx', 'bytes_received'),
+            'bytes_uncompressed': delta('influx', 'bytes_decoded'),
+        }
+    return result
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """User and system CPU time of a running process, read from /proc (Linux only)"""
+    with open(f"/proc/{pid}/stat", 'r', encoding='utf-8') as f:
+        # Fields after the command name, which may contain spaces, utime and stime are 14 and 15
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def wait_for_bursts(standins: Standins, process: subprocess.Popen, count: int):
+    """Wait until the simulator saw count request bursts, return the stand-in stats and the process CPU time"""
+    seen = 0
+    deadline = time.perf_counter() + DELIVERY_TIMEOUT
+    while True:
+        stats = standins.stats()
+        if len(stats['bursts']) >= count:
+            return stats, process_cpu_seconds(process.pid)
+        if process.poll() is not None:
+            raise RuntimeError(f"modbus4mqtt exited with {process.returncode}: "
+                               f"{process.stderr.read().decode('utf-8', 'replace')[-2000:]}")
+        if len(stats['bursts']) > seen:
+            seen = len(stats['bursts'])
+            deadline = time.perf_counter() + DELIVERY_TIMEOUT
+        elif time.perf_counter() > deadline:
+            raise RuntimeError(f"modbus4mqtt polled {seen} times, expected {count}")
+        await asyncio.sleep(0.005)
+
+
+async def benchmark_modbus4mqtt(config: Dict[str, Any], standins: Standins, args) -> Dict[str, Any]:
+    """Run the modbus4mqtt CLI against the same stand-ins, the baseline the bridge replaces
+
+    modbus4mqtt polls and publishes in one thread and then sleeps update_rate.
+    Its cycle is the time between the first requests of two polls minus that
+    sleep, taken from the simulator. Like the bridge's cycle it ends when the
+    last message was handed to paho, and it includes the 50 ms pause
+    modbus4mqtt makes after every read. modbus4mqtt ignores read_spans and
+    reads aligned windows of scan_batching registers.
+    """
+    baseline = dict(bridge_config(config, standins.modbus_port, args), update_rate=BASELINE_UPDATE_RATE)
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        yaml.safe_dump(baseline, f, allow_unicode=True)
+        config_path = f.name
+    command = shlex.split(args.baseline_modbus4mqtt) + [
+        '--hostname', '127.0.0.1', '--port', str(standins.mqtt_port), '--config', config_path,
+        '--mqtt_topic_prefix', args.mqtt_prefix]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        # The first poll connects, measure from the start of the second one
+        before, cpu_before = await wait_for_bursts(standins, process, 2)
+        after, cpu_after = await wait_for_bursts(standins, process, 2 + args.cycles)
+    finally:
+        process.terminate()
+        process.wait(5)
+        Path(config_path).unlink()
+
+    starts = after['bursts'][1:2 + args.cycles]
+    durations = [max(end - start - BASELINE_UPDATE_RATE, 0.0) for start, end in zip(starts, starts[1:])]
+    registers = sum(1 for entry in config['registers'] if 'pub_topic' in entry)
+
+    def delta(side: str, key: str) -> int:
+        return after[side][key] - before[side][key]
+
+    return {
+        'registers': registers,
+        'requests_per_cycle': delta('simulator', 'requests') // args.cycles,
+        'cycles': args.cycles,
+        'cycle_latency_ms': {
+            'p50': round(percentile(durations, 50) * 1000, 3),
+            'p90': round(percentile(durations, 90) * 1000, 3),
+            'p99': round(percentile(durations, 99) * 1000, 3),
+            'max': round(max(durations) * 1000, 3),
+            'mean': round(sum(durations) / len(durations) * 1000, 3),
+        },
+        'registers_per_s': round(registers * args.cycles / sum(durations), 1),
+        'mqtt_messages': delta('broker', 'messages_received'),
+        # Per second of polling, the sleeps between polls left out
+        'mqtt_messages_per_s': round(delta('broker', 'messages_received') / sum(durations), 1),
+        'mqtt_bytes': delta('broker', 'bytes_received'),
+        'modbus_requests': delta('simulator', 'requests'),
+        'modbus_bytes': delta('simulator', 'bytes_received') + delta('simulator', 'bytes_sent'),
+        'cpu_ms_per_cycle': round((cpu_after - cpu_before) / args.cycles * 1000, 3),
+    }
+
+
+async def run_benchmarks(args) -> Dict[str, Any]:
+    options = {'latency': args.latency, 'processing_time': args.processing_time,
+               'max_registers': args.max_registers, 'max_in_flight': args.max_in_flight,
+               'burst_gap': BASELINE_UPDATE_RATE / 2 if args.baseline_modbus4mqtt else 0.0}
+    results = {}
+    for name in args.maps:
+        config = load_map(name)
+        standins = Standins(config, options)
+        try:
+            print(f"⏱️  Benchmarking {name} ({len(config['registers'])} registers)...")
+            results[name] = await benchmark_map(config, standins, args)
+            results[name]['discovery'] = await benchmark_discovery(config, standins, args)
+            if args.baseline_modbus4mqtt:
+                print(f"⏱️  Benchmarking modbus4mqtt on {name}...")
+                results[name]['modbus4mqtt'] = await benchmark_modbus4mqtt(config, standins, args)
+        finally:
+            standins.stop()
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'options': dict(options, cycles=args.cycles, scan_batching=args.scan_batching, with_filter=args.with_filter,
+                        with_influx=args.with_influx, with_snapshots=args.with_snapshots,
+                        pipeline_depth=args.pipeline_depth, baseline_modbus4mqtt=args.baseline_modbus4mqtt),
+        'results': results,
+    }
+
+
+def print_summary(report: Dict[str, Any]):
+    print(f"\n{'map':<18} {'regs':>6} {'reqs':>6} {'p50 ms':>9} {'p99 ms':>9} {'regs/s':>10} "
+          f"{'msgs/s':>10} {'MQTT B/cyc':>11} {'CPU ms/cyc':>11} {'disc ms':>8} {'disc ok':>9}")
+    for name, result in report['results'].items():
+        discovery = result['discovery']
+        print(f"{name:<18} {result['registers']:>6} {result['requests_per_cycle']:>6} "
+              f"{result['cycle_latency_ms']['p50']:>9.2f} {result['cycle_latency_ms']['p99']:>9.2f} "
+              f"{result['registers_per_s']:>10.0f} {result['mqtt_messages_per_s']:>10.0f} "
+              f"{result['mqtt_bytes'] // max(result['cycles'], 1):>11} {result['cpu_ms_per_cycle']:>11.2f} "
+              f"{discovery['generate_ms'] + discovery['publish_ms']:>8.1f} "
+              f"{discovery['confirmed']:>4}/{discovery['entities']:<4}")
+
+    baselines = {name: result['modbus4mqtt'] for name, result in report['results'].items() if 'modbus4mqtt' in result}
+    if baselines:
+        print(f"\n{'map':<18} {'poller':<12} {'reqs':>6} {'p50 ms':>9} {'p99 ms':>9} {'CPU ms/cyc':>11} "
+              f"{'MQTT B/cyc':>11} {'Modbus B/cyc':>13}")
+        for name, baseline in baselines.items():
+            for poller, result in (('bridge', report['results'][name]), ('modbus4mqtt', baseline)):
+                cycles = max(result['cycles'], 1)
+                print(f"{name:<18} {poller:<12} {result['requests_per_cycle']:>6} "
+                      f"{result['cycle_latency_ms']['p50']:>9.2f} {result['cycle_latency_ms']['p99']:>9.2f} "
+                      f"{result['cpu_ms_per_cycle']:>11.2f} {result['mqtt_bytes'] // cycles:>11} "
+                      f"{result['modbus_bytes'] // cycles:>13}")
+
+    influx_results = {name: result['influx'] for name, result in report['results'].items() if 'influx' in result}
+    if influx_results:
+        print(f"\n{'map':<18} {'MQTT msgs/cyc':>14} {'MQTT B/cyc':>11} {'points/cyc':>11} {'fields/cyc':>11} "
+              f"{'gzip B/cyc':>11} {'raw B/cyc':>10}")
+        for name, influx in influx_results.items():
+            result = report['results'][name]
+            cycles = max(result['cycles'], 1)
+            print(f"{name:<18} {result['mqtt_messages'] // cycles:>14} {result['mqtt_bytes'] // cycles:>11} "
+                  f"{influx['points'] // cycles:>11} {influx['fields'] // cycles:>11} "
+                  f"{influx['bytes'] // cycles:>11} {influx['bytes_uncompressed'] // cycles:>10}")
+
+
+def print_comparison(report: Dict[str, Any], previous: Dict[str, Any]):
+    print(f"\nCompared to {previous.get('timestamp', 'previous run')}:")
+    metrics = [('p50 latency', lambda r: r['cycle_latency_ms']['p50']),
+               ('p99 latency', lambda r: r['cycle_latency_ms']['p99']),
+               ('registers/s', lambda r: r['registers_per_s']),
+               ('messages/s', lambda r: r['mqtt_messages_per_s']),
+               ('CPU/cycle', lambda r: r['cpu_ms_per_cycle'])]
+    for name, result in report['results'].items():
+        old = previous.get('results', {}).get(name)
+        if old is None:
+            continue
+        changes = []
+        for label, metric in metrics:
+            before, after = metric(old), metric(result)
+            change = (after - before) / before * 100 if before else 0.0
+            changes.append(f"{label} {change:+.1f}%")
+        print(f"  {name}: " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Modbus to MQTT poll cycle against local stand-ins')
+    parser.add_argument('--maps', nargs='+', default=DEFAULT_MAPS,
+                        help='Register maps: config names, YAML paths or synthetic-<count>')
+    parser.add_argument('--cycles', type=int, default=20, help='Measured poll cycles per map')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated Modbus latency per request in seconds')
+    parser.add_argument('--processing-time', type=float, default=0.0,
+                        help='Simulated device processing time per request in seconds')
+    parser.add_argument('--max-registers', type=int, default=125, help='Simulated max registers per request')
+    parser.add_argument('--scan-batching', type=int, help='Override scan_batching of every map')
+    parser.add_argument('--with-filter', action='store_true',
+                        help='Keep publish_filter and pub_only_on_change from the maps')
+    parser.add_argument('--with-influx', action='store_true',
+                        help='Also write every cycle to the InfluxDB stand-in through the line-protocol sink')
+    parser.add_argument('--with-snapshots', action='store_true',
+                        help='Also publish the per-group and full-device JSON snapshots every cycle')
+    parser.add_argument('--pipeline-depth', type=int, default=1, help='Modbus read requests in flight per connection')
+    parser.add_argument('--max-in-flight', type=int, default=0,
+                        help='Simulated device answers busy beyond this many requests in flight (0: no limit)')
+    parser.add_argument('--baseline-modbus4mqtt', metavar='COMMAND',
+                        help='Also run this modbus4mqtt command against the same stand-ins as baseline '
+                             '(slow on large maps, it pauses 50 ms after every read)')
+    parser.add_argument('--mqtt-prefix', default='bartl_wp', help='MQTT topic prefix')
+    parser.add_argument('--output', default='benchmark_results.json', help='Output JSON file for the results')
+    parser.add_argument('--compare', help='Previous results JSON file to compare against')
+
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        if not Path(args.compare).exists():
+            print(f"Results file not found: {args.compare}")
+            sys.exit(1)
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    report = asyncio.run(run_benchmarks(args))
+    print_summary(report)
+    if previous is not None:
+        print_comparison(report, previous)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved benchmark results to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Modbus read span and request pacing calibration
+
+This script probes the controller, or bartl_simulator.py, with growing read
+span sizes and then with growing gaps between requests. It measures the
+latency and the exception rate of every setting, picks the span size and gap
+with the highest throughput that ran without errors and writes them to the
+modbus4mqtt config: scan_batching and read_spans as planned by
+plan_read_spans.py, and a pacing section for the bridge.
+
+Usage:
+    python calibrate_modbus.py --config config/modbus4mqtt/Bartl-WP.yml --dry-run
+    python calibrate_modbus.py --config config/modbus4mqtt/Bartl-WP.yml --host 127.0.0.1 --port 5020
+
+Features:
+- Span sizes grow from 1 register up to --max-span, probing stops at the first size with errors
+- Gaps grow from 0 at the chosen span size until a probe runs clean at normal latency
+- Reads only the configured addresses plus gaps of up to --max-gap, like the planned read_spans
+- Per probe: requests, exceptions per code, timeouts, median and p95 latency, addresses/s
+- Writes the result into the config, comments and other sections stay untouched
+
+Configuration written (modbus4mqtt YAML):
+    scan_batching: 16
+    read_spans: ...
+    pacing:
+      request_gap: 0.01                 # seconds between a response and the next request
+      max_request_gap: 1.0              # limit of the bridge's runtime backoff
+      latency: 0.012                    # calibrated median latency, the bridge backs off when it doubles
+"""
+
+import asyncio
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from modbus_tcp import (AsyncModbusTcpClient, ModbusError, BUSY_EXCEPTIONS, DEFAULT_MAX_REQUEST_GAP,
+                        ILLEGAL_DATA_ADDRESS, LATENCY_FACTOR, LATENCY_SLACK, MAX_READ_REGISTERS, RequestPacer)
+from plan_read_spans import collect_addresses, plan_config, plan_spans, write_optimized_config
+from register_model import load_yaml
+
+DEFAULT_SPAN_SIZES = (1, 2, 4, 8, 16, 32, 64, 125)
+DEFAULT_GAPS = (0.0, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+# Gap between requests while the span sizes are probed
+DEFAULT_PROBE_GAP = 0.05
+DEFAULT_ROUNDS = 3
+DEFAULT_TIMEOUT = 1.0
+# Pause after a probe with errors so the device can recover before the next one
+RECOVERY_PAUSE = 1.0
+
+ProbeSpan = Tuple[str, int, int]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, None without values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def probe_spans(tables: Dict[str, List[int]], offset: int, max_gap: int, size: int) -> List[ProbeSpan]:
+    """(table, start, count) read requests for one poll of every configured address"""
+    return [(table, start + offset, count) for table, addresses in sorted(tables.items())
+            for start, count in plan_spans(addresses, max_gap, size)]
+
+
+async def probe(client: AsyncModbusTcpClient, spans: List[ProbeSpan], gap: float, rounds: int,
+                addresses: int) -> Dict[str, Any]:
+    """Read all spans rounds times with gap seconds between requests"""
+    loop = asyncio.get_running_loop()
+    latencies = []
+    exceptions: Dict[int, int] = {}
+    timeouts = 0
+    malformed = 0
+    started = loop.time()
+    for _ in range(rounds):
+        for table, start, count in spans:
+            if gap:
+                await asyncio.sleep(gap)
+            request_started = loop.time()
+            try:
+                await client.read_registers(start, count, table)
+            except ModbusError as e:
+                exceptions[e.code] = exceptions.get(e.code, 0) + 1
+                continue
+            except (OSError, asyncio.TimeoutError, EOFError):
+                timeouts += 1
+                continue
+            except ValueError:
+                malformed += 1
+                continue
+            latencies.append(loop.time() - request_started)
+    elapsed = loop.time() - started
+    requests = rounds * len(spans)
+    errors = sum(exceptions.values()) + timeouts + malformed
+    p50 = percentile(latencies, 0.5)
+    p95 = percentile(latencies, 0.95)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        'exceptions': exceptions,
+        'timeouts': timeouts,
+        'malformed': malformed,
+        'latency_p50_ms': round(1000 * p50, 2) if p50 is not None else None,
+        'latency_p95_ms': round(1000 * p95, 2) if p95 is not None else None,
+        'cycle_ms': round(1000 * elapsed / rounds, 1),
+        'addresses_per_s': round(addresses * rounds / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def format_result(label: str, result: Dict[str, Any]) -> str:
+    exceptions = ' '.join(f"{code}x{count}" for code, count in sorted(result['exceptions'].items())) or '-'
+    p50 = f"{result['latency_p50_ms']:>8.2f}" if result['latency_p50_ms'] is not None else f"{'-':>8}"
+    p95 = f"{result['latency_p95_ms']:>8.2f}" if result['latency_p95_ms'] is not None else f"{'-':>8}"
+    return (f"{label:<12} {result['requests']:>8} {100 * result['error_rate']:>6.1f}% {exceptions:>11} "
+            f"{result['timeouts']:>8} {p50} {p95} {result['cycle_ms']:>9.1f} {result['addresses_per_s']:>11.1f}")
+
+
+TABLE_HEADER = (f"{'':<12} {'Requests':>8} {'Errors':>7} {'Exceptions':>11} {'Timeouts':>8} "
+                f"{'p50 ms':>8} {'p95 ms':>8} {'Cycle ms':>9} {'Addresses/s':>11}")
+
+
+def is_clean(result: Dict[str, Any], max_error_rate: float) -> bool:
+    return result['error_rate'] <= max_error_rate and result['latency_p50_ms'] is not None
+
+
+async def calibrate(config: Dict[str, Any], host: str, port: int, unit: int, max_gap: int, max_span: int,
+                    rounds: int, probe_gap: float, max_error_rate: float, timeout: float) -> Optional[Dict[str, Any]]:
+    """Probe span sizes, then gaps, and return the chosen settings with all probe results"""
+    tables = collect_addresses(config)
+    offset = int(config.get('address_offset', 0))
+    addresses = sum(len(table) for table in tables.values())
+    # A fixed zero gap, the probes pace the requests themselves
+    client = AsyncModbusTcpClient(host, port, unit, timeout, pacer=RequestPacer(0.0, max_gap=0.0))
+    sizes = sorted({size for size in DEFAULT_SPAN_SIZES if size < max_span} | {max_span})
+
+    print(f"Probing {addresses} addresses on {host}:{port}, {rounds} rounds per setting")
+    print(f"\nSpan sizes, {1000 * probe_gap:g} ms between requests:")
+    print(TABLE_HEADER)
+    size_results: Dict[int, Dict[str, Any]] = {}
+    # Every probe, also those with errors that are not kept as a candidate
+    probes: List[Dict[str, Any]] = []
+    previous = None
+    try:
+        for size in sizes:
+            spans = probe_spans(tables, offset, max_gap, size)
+            if spans == previous:
+                continue  # No span was limited by the smaller size
+            previous = spans
+            result = await probe(client, spans, probe_gap, rounds, addresses)
+            probes.append(result)
+            print(format_result(f"{size} regs", result))
+            if not is_clean(result, max_error_rate):
+                if ILLEGAL_DATA_ADDRESS in result['exceptions'] and max_gap:
+                    print("  Illegal data address: the device rejects unconfigured addresses, try --max-gap 0")
+                await asyncio.sleep(RECOVERY_PAUSE)
+                break
+            size_results[size] = result
+
+        if not size_results:
+            print("\nNo span size ran without errors, try a larger --probe-gap or --timeout")
+            return None
+        size = max(size_results, key=lambda s: size_results[s]['addresses_per_s'])
+        reference = size_results[size]['latency_p50_ms'] / 1000
+
+        print(f"\nGaps between requests, {size} registers per span:")
+        print(TABLE_HEADER)
+        spans = probe_spans(tables, offset, max_gap, size)
+        gap_results: Dict[float, Dict[str, Any]] = {}
+        for gap in sorted(set(DEFAULT_GAPS) | {probe_gap}):
+            if gap > probe_gap:
+                break
+            result = await probe(client, spans, gap, rounds, addresses)
+            probes.append(result)
+            print(format_result(f"{1000 * gap:g} ms", result))
+            if not is_clean(result, max_error_rate):
+                await asyncio.sleep(RECOVERY_PAUSE)
+                continue
+            gap_results[gap] = result
+            # A larger gap only adds waiting once the device keeps up
+            if result['latency_p50_ms'] / 1000 <= LATENCY_FACTOR * reference + LATENCY_SLACK:
+                break
+    finally:
+        await client.close()
+
+    gap = max(gap_results, key=lambda g: gap_results[g]['addresses_per_s']) if gap_results else probe_gap
+    chosen = gap_results.get(gap, size_results[size])
+    return {
+        'span_size': size,
+        'request_gap': gap,
+        'latency': round(chosen['latency_p50_ms'] / 1000, 4),
+        'addresses_per_s': chosen['addresses_per_s'],
+        'busy': any(code in BUSY_EXCEPTIONS for result in probes for code in result['exceptions']),
+        'sizes': size_results,
+        'gaps': gap_results,
+    }
+
+
+def format_pacing(calibration: Dict[str, Any], source: str) -> str:
+    """Render the pacing section as YAML text"""
+    max_request_gap = max(DEFAULT_MAX_REQUEST_GAP, 4 * calibration['request_gap'])
+    return (f"# Calibrated by calibrate_modbus.py against {source} on {time.strftime('%Y-%m-%d')}\n"
+            f"pacing:\n"
+            f"  request_gap: {calibration['request_gap']:g}\n"
+            f"  max_request_gap: {max_request_gap:g}\n"
+            f"  latency: {calibration['latency']:g}\n")
+
+
+def write_pacing(config_text: str, pacing_text: str) -> str:
+    """Return the config text with the pacing section replaced or inserted before registers"""
+    text = re.sub(r'^(?:# Calibrated by calibrate_modbus\.py.*\n)?pacing:\n(?:[ \t]+.*\n)*', '', config_text,
+                  flags=re.MULTILINE)
+    return re.sub(r'^registers:', lambda _: pacing_text + 'registers:', text, count=1, flags=re.MULTILINE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate Modbus read span size and request pacing')
+    parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
+    parser.add_argument('--host', help='Modbus host (default: ip from the config)')
+    parser.add_argument('--port', type=int, help='Modbus port (default: port from the config)')
+    parser.add_argument('--unit', type=int, help='Modbus unit id (default: unit from the config or 1)')
+    parser.add_argument('--output', help='Output YAML file (default: overwrite --config)')
+    parser.add_argument('--max-gap', type=int, default=4, help='Largest run of unused registers to read through')
+    parser.add_argument('--max-span', type=int, default=MAX_READ_REGISTERS, help='Largest span size to probe')
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help='Polls of all addresses per setting')
+    parser.add_argument('--probe-gap', type=float, default=DEFAULT_PROBE_GAP,
+                        help='Seconds between requests while probing span sizes, also the largest gap probed')
+    parser.add_argument('--max-error-rate', type=float, default=0.0,
+                        help='Largest share of failed requests a setting may have')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds to wait for a response')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the results, do not write the config')
+
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print(f"Config file not found: {args.config}")
+        sys.exit(1)
+
+    config_text = Path(args.config).read_text(encoding='utf-8')
+    config = load_yaml(config_text)
+
+    if 'registers' not in config:
+        print("No 'registers' section found in config file")
+        sys.exit(1)
+
+    host = args.host or config['ip']
+    port = args.port or int(config.get('port', 502))
+    unit = args.unit or int(config.get('unit', 1))
+    max_span = max(1, min(args.max_span, MAX_READ_REGISTERS))
+
+    calibration = asyncio.run(calibrate(config, host, port, unit, args.max_gap, max_span, args.rounds,
+                                        args.probe_gap, args.max_error_rate, args.timeout))
+    if calibration is None:
+        sys.exit(1)
+
+    print(f"\nSpan size: {calibration['span_size']} registers, request gap: {1000 * calibration['request_gap']:g} ms, "
+          f"median latency: {1000 * calibration['latency']:.1f} ms, {calibration['addresses_per_s']:.0f} addresses/s")
+    if calibration['busy']:
+        print("The device answered busy during the probes, the bridge backs off the same way at runtime")
+
+    plan = plan_config(config, args.max_gap, calibration['span_size'])
+    print(f"Requests per cycle with read_spans: {plan['requests_spans']} "
+          f"(scan_batching: {plan['scan_batching']}: {plan['requests_batched']})")
+
+    if args.dry_run:
+        return
+
+    output = args.output or args.config
+    text = write_optimized_config(config_text, plan)
+    Path(output).write_text(write_pacing(text, format_pacing(calibration, f"{host}:{port}")), encoding='utf-8')
+    print(f"Saved calibrated configuration to: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -13,22 +13,169 @@ Usage:
 Features:
 - Remove discovery configs from JSON file
 - Remove all discovery topics with specific prefix
+- Per-entity and device-based (<prefix>/device/<id>/config) discovery topics
 - Dry-run mode to see what would be removed
 - Confirmation prompts for safety
+- Streams deletions with a bounded in-flight window, no fixed sleeps
+- End of the retained burst detected from broker round trip and arrival gaps
+- Confirms that every removed topic is gone from the broker
+- Optional metrics file with the cleanup duration for the node_exporter textfile collector
+- --profile: wall time and allocations for connecting, discovering, removing and confirming
 """
 
+import importlib.util
 import json
 import argparse
+import queue
 import sys
+import threading
 from pathlib import Path
 import time
+from typing import Callable, Iterable, List, Optional
+
+from discovery_manifest import forget_topics
+from metrics import MetricsRegistry, write_textfile
+from mqtt_publisher import DEFAULT_WINDOW, FlowControlledPublisher, connect_client, disconnect_client
+from profiling import NO_PROFILER, StageProfiler, report_profile
+
+# The retained burst is over after this much silence, scaled to the broker:
+# max(MIN_QUIET, QUIET_RTT_FACTOR * SUBACK round trip, QUIET_GAP_FACTOR * largest gap)
+MIN_QUIET = 0.05
+QUIET_RTT_FACTOR = 4
+QUIET_GAP_FACTOR = 4
+MAX_COLLECT_TIME = 30.0
+
+# Removal passes until every topic is confirmed gone
+CONFIRM_PASSES = 3
+
+
+class RetainedCollector:
+    """Subscribe to topic filters and collect the retained topics the broker replays
+
+    Only retained messages with a payload count, the echo of our own deletions
+    arrives without the retain flag. on_topic is called from the paho network
+    thread for every new topic.
+    """
+
+    def __init__(self, client, filters: List[str], accept: Optional[Callable[[str], bool]] = None,
+                 on_topic: Optional[Callable[[str], None]] = None):
+        self.client = client
+        self.filters = filters
+        self.accept = accept
+        self.on_topic = on_topic
+        self.topics: List[str] = []
+        self._seen = set()
+        self._condition = threading.Condition()
+        self._subscribe_mid = None
+        self._subscribed_at = None
+        self._rtt = None
+        self._last_activity = None
+        self._largest_gap = 0.0
+
+    def _on_subscribe(self, client, userdata, mid, *args):
+        with self._condition:
+            if mid == self._subscribe_mid:
+                now = time.monotonic()
+                self._rtt = now - self._subscribed_at
+                self._last_activity = now
+                self._condition.notify_all()
+
+    def _on_message(self, client, userdata, msg):
+        if not msg.retain or not msg.payload:
+            return
+        with self._condition:
+            now = time.monotonic()
+            if self._last_activity is not None:
+                self._largest_gap = max(self._largest_gap, now - self._last_activity)
+                self._last_activity = now
+            if msg.topic in self._seen or (self.accept and not self.accept(msg.topic)):
+                return
+            self._seen.add(msg.topic)
+            self.topics.append(msg.topic)
+        if self.on_topic:
+            self.on_topic(msg.topic)
+
+    def quiet_period(self) -> float:
+        return max(MIN_QUIET, QUIET_RTT_FACTOR * (self._rtt or 0.0), QUIET_GAP_FACTOR * self._largest_gap)
+
+    def start(self):
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_message = self._on_message
+        with self._condition:
+            self._subscribed_at = time.monotonic()
+            # Re-subscribing to an existing filter replays its retained messages as well
+            _, self._subscribe_mid = self.client.subscribe([(topic_filter, 0) for topic_filter in self.filters])
+
+    def finished(self) -> bool:
+        """Whether the retained burst is over, never blocks"""
+        with self._condition:
+            now = time.monotonic()
+            if now - self._subscribed_at >= MAX_COLLECT_TIME:
+                return True
+            return self._last_activity is not None and now - self._last_activity >= self.quiet_period()
+
+    def wait(self, timeout: float = 0.01):
+        """Sleep until something arrives or timeout passed"""
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def collect(self) -> List[str]:
+        """Subscribe and return all retained topics once the burst is over"""
+        self.start()
+        while not self.finished():
+            self.wait(MIN_QUIET / 2)
+        return list(self.topics)
+
+
+def remove_topics(publisher: FlowControlledPublisher, topics: Iterable[str]):
+    """Publish empty retained messages, the broker then drops the retained config"""
+    return publisher.publish_all((topic, "") for topic in topics)
+
+
+def stream_remove(client, publisher: FlowControlledPublisher, filters: List[str],
+                  accept: Optional[Callable[[str], bool]] = None):
+    """Delete retained topics while the broker is still replaying them"""
+    found = queue.Queue()
+    collector = RetainedCollector(client, filters, accept, on_topic=found.put)
+    publisher.begin()
+    collector.start()
+    while True:
+        try:
+            publisher.submit(found.get(timeout=MIN_QUIET / 2), "")
+        except queue.Empty:
+            if collector.finished() and found.empty():
+                break
+    return collector.topics, publisher.finish()
+
+
+def confirm_removed(client, publisher: FlowControlledPublisher, filters: List[str],
+                    accept: Optional[Callable[[str], bool]] = None) -> List[str]:
+    """Re-read the retained topics and remove leftovers, returns topics still present"""
+    remaining = []
+    for _ in range(CONFIRM_PASSES):
+        remaining = RetainedCollector(client, filters, accept).collect()
+        if not remaining:
+            break
+        print(f"🔁 {len(remaining)} topics still retained, removing again")
+        remove_topics(publisher, remaining)
+    return remaining
+
+
+def print_removal_summary(removed: List[str], remaining: List[str], total: int, report):
+    print(f"\n🗑️  Removal: {report.confirmed}/{report.messages} deletions acknowledged in {report.duration:.2f} s "
+          f"({report.messages_per_s:.0f} msgs/s)")
+    if remaining:
+        print(f"⚠️  {len(remaining)} topics are still retained on the broker:")
+        for topic in remaining:
+            print(f"  - {topic}")
+    print(f"✅ Successfully removed {len(removed)}/{total} discovery topics")
 
 def cleanup_from_json(config_file: str, mqtt_host: str, mqtt_port: int = 1883,
-                     mqtt_user: str = None, mqtt_password: str = None, dry_run: bool = False):
+                     mqtt_user: str = None, mqtt_password: str = None, dry_run: bool = False,
+                     manifest_file: str = None, assume_yes: bool = False, window: int = DEFAULT_WINDOW,
+                     profiler: StageProfiler = NO_PROFILER):
     """Remove discovery configurations from JSON file"""
-    try:
-        import paho.mqtt.client as mqtt
-    except ImportError:
+    if importlib.util.find_spec('paho') is None:
         print("❌ paho-mqtt not installed. Install with: pip install paho-mqtt")
         return False
 
@@ -37,7 +184,7 @@ def cleanup_from_json(config_file: str, mqtt_host: str, mqtt_port: int = 1883,
         return False
 
     # Load discovery configurations
-    with open(config_file, 'r', encoding='utf-8') as f:
+    with profiler.stage('load'), open(config_file, 'r', encoding='utf-8') as f:
         discovery_configs = json.load(f)
 
     print(f"📋 Found {len(discovery_configs)} discovery configurations in {config_file}")
@@ -50,60 +197,60 @@ def cleanup_from_json(config_file: str, mqtt_host: str, mqtt_port: int = 1883,
         return True
 
     # Ask for confirmation
-    print(f"\n⚠️  This will remove {len(discovery_configs)} entities from Home Assistant!")
+    # Device-based configs hold several entities as components (cmps when abbreviated)
+    entity_count = sum(len(config.get('components') or config.get('cmps') or [None])
+                       for config in discovery_configs.values())
+    print(f"\n⚠️  This will remove {entity_count} entities from Home Assistant!")
     print("The entities will disappear from your dashboard and you'll lose their history.")
 
-    response = input("\nAre you sure you want to continue? Type 'yes' to confirm: ")
-    if response.lower() != 'yes':
-        print("❌ Operation cancelled")
-        return False
+    if not assume_yes:
+        response = input("\nAre you sure you want to continue? Type 'yes' to confirm: ")
+        if response.lower() != 'yes':
+            print("❌ Operation cancelled")
+            return False
 
     print(f"🔗 Connecting to MQTT broker at {mqtt_host}:{mqtt_port}")
 
-    client = mqtt.Client()
-
-    if mqtt_user and mqtt_password:
-        client.username_pw_set(mqtt_user, mqtt_password)
-
     try:
-        client.connect(mqtt_host, mqtt_port, 60)
-        print("✅ Connected to MQTT broker")
-
-        removed_count = 0
-        for topic in discovery_configs.keys():
-            # Publish empty message with retain=True to remove the topic
-            result = client.publish(topic, "", retain=True)
-            if result.rc == 0:
-                removed_count += 1
-                print(f"🗑️  Removed: {topic}")
-            else:
-                print(f"❌ Failed to remove: {topic} (rc={result.rc})")
-
-            # Small delay to avoid overwhelming the broker
-            time.sleep(0.1)
-
-        client.disconnect()
-        print(f"\n✅ Successfully removed {removed_count}/{len(discovery_configs)} discovery topics")
-        print("🏠 Home Assistant should remove the entities within a few minutes")
-        return True
-
+        with profiler.stage('connect'):
+            client = connect_client(mqtt_host, mqtt_port, mqtt_user, mqtt_password, window=window)
     except Exception as e:
         print(f"❌ Failed to connect to MQTT broker: {e}")
         return False
+    print("✅ Connected to MQTT broker")
+
+    try:
+        topics = list(discovery_configs.keys())
+        publisher = FlowControlledPublisher(client, window)
+        # Publish empty messages with retain=True to remove the topics
+        with profiler.stage('remove'):
+            report = remove_topics(publisher, topics)
+        with profiler.stage('confirm'):
+            remaining = confirm_removed(client, publisher, topics)
+    finally:
+        with profiler.stage('disconnect'):
+            disconnect_client(client)
+
+    removed_topics = [topic for topic in topics if topic not in set(remaining) | set(report.failed)]
+    # Removed topics must be published again by the next incremental run
+    forget_topics(manifest_file, f"{mqtt_host}:{mqtt_port}", removed_topics)
+    print_removal_summary(removed_topics, remaining, len(topics), report)
+    print("🏠 Home Assistant should remove the entities within a few minutes")
+    return not remaining
 
 
 def cleanup_by_prefix(discovery_prefix: str, device_prefix: str = None, mqtt_host: str = None,
                      mqtt_port: int = 1883, mqtt_user: str = None, mqtt_password: str = None,
-                     dry_run: bool = False):
+                     dry_run: bool = False, manifest_file: str = None, assume_yes: bool = False,
+                     window: int = DEFAULT_WINDOW, profiler: StageProfiler = NO_PROFILER):
     """Remove all discovery topics matching prefixes"""
-    try:
-        import paho.mqtt.client as mqtt
-    except ImportError:
+    if importlib.util.find_spec('paho') is None:
         print("❌ paho-mqtt not installed. Install with: pip install paho-mqtt")
         return False
 
     # Build the topic patterns to search for
-    entity_types = ['sensor', 'number', 'select', 'switch', 'binary_sensor', 'button']
+    # 'device' covers device-based discovery, one topic with all entities of a device
+    entity_types = ['sensor', 'number', 'select', 'switch', 'binary_sensor', 'button', 'device']
     topics_to_remove = []
 
     if device_prefix:
@@ -133,86 +280,83 @@ def cleanup_by_prefix(discovery_prefix: str, device_prefix: str = None, mqtt_hos
     print(f"\n⚠️  This will remove ALL discovery topics matching the patterns above!")
     print("This could remove entities you want to keep if they share the same prefix.")
 
-    response = input("\nAre you sure you want to continue? Type 'yes' to confirm: ")
-    if response.lower() != 'yes':
-        print("❌ Operation cancelled")
-        return False
+    if not assume_yes:
+        response = input("\nAre you sure you want to continue? Type 'yes' to confirm: ")
+        if response.lower() != 'yes':
+            print("❌ Operation cancelled")
+            return False
 
-    # For prefix-based cleanup, we need to subscribe and collect topics first
-    discovered_topics = []
-
-    def on_connect(client, userdata, flags, rc):
-        if rc == 0:
-            print("✅ Connected to MQTT broker")
-            # Subscribe to discovery topics
-            for entity_type in entity_types:
-                topic = f"{discovery_prefix}/{entity_type}/+/config"
-                client.subscribe(topic)
-                print(f"🔍 Subscribed to: {topic}")
-        else:
-            print(f"❌ Failed to connect to MQTT broker (rc={rc})")
+    filters = [f"{discovery_prefix}/{entity_type}/+/config" for entity_type in entity_types]
 
-    def on_message(client, userdata, msg):
-        topic = msg.topic
+    def accept(topic):
         # Filter by device prefix if specified
-        if device_prefix:
-            topic_parts = topic.split('/')
-            if len(topic_parts) >= 3:
-                entity_id = topic_parts[2]
-                if entity_id.startswith(device_prefix):
-                    discovered_topics.append(topic)
+        topic_parts = topic.split('/')
+        return not device_prefix or (len(topic_parts) >= 3 and topic_parts[2].startswith(device_prefix))
+
+    try:
+        with profiler.stage('connect'):
+            client = connect_client(mqtt_host, mqtt_port, mqtt_user, mqtt_password, window=window)
+    except Exception as e:
+        print(f"❌ Failed to connect to MQTT broker: {e}")
+        return False
+    print("✅ Connected to MQTT broker")
+
+    try:
+        publisher = FlowControlledPublisher(client, window)
+        if assume_yes:
+            # Already confirmed, delete while the broker is still replaying
+            print("🔍 Discovering and removing existing topics...")
+            with profiler.stage('discover+remove'):
+                discovered_topics, report = stream_remove(client, publisher, filters, accept)
         else:
-            discovered_topics.append(topic)
+            print("🔍 Discovering existing topics...")
+            collector = RetainedCollector(client, filters, accept)
+            with profiler.stage('discover'):
+                discovered_topics = collector.collect()
+            print(f"   End of retained messages detected after {collector.quiet_period() * 1000:.0f} ms of silence")
 
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
+            if not discovered_topics:
+                print("ℹ️  No matching discovery topics found")
+                return True
 
-    if mqtt_user and mqtt_password:
-        client.username_pw_set(mqtt_user, mqtt_password)
+            print(f"\n📋 Found {len(discovered_topics)} matching topics:")
+            for topic in discovered_topics:
+                print(f"  - {topic}")
 
-    try:
-        client.connect(mqtt_host, mqtt_port, 60)
+            print(f"\n⚠️  About to remove {len(discovered_topics)} discovery topics!")
+            response = input("Continue? Type 'yes' to confirm: ")
+            if response.lower() != 'yes':
+                print("❌ Operation cancelled")
+                return False
 
-        # Listen for discovery topics for a few seconds
-        print("🔍 Discovering existing topics...")
-        client.loop_start()
-        time.sleep(5)  # Listen for 5 seconds
-        client.loop_stop()
+            with profiler.stage('remove'):
+                report = remove_topics(publisher, discovered_topics)
 
         if not discovered_topics:
             print("ℹ️  No matching discovery topics found")
             return True
-
-        print(f"\n📋 Found {len(discovered_topics)} matching topics:")
-        for topic in discovered_topics:
-            print(f"  - {topic}")
-
-        print(f"\n⚠️  About to remove {len(discovered_topics)} discovery topics!")
-        response = input("Continue? Type 'yes' to confirm: ")
-        if response.lower() != 'yes':
-            print("❌ Operation cancelled")
-            return False
-
-        # Remove the discovered topics
-        removed_count = 0
-        for topic in discovered_topics:
-            result = client.publish(topic, "", retain=True)
-            if result.rc == 0:
-                removed_count += 1
-                print(f"🗑️  Removed: {topic}")
-            else:
-                print(f"❌ Failed to remove: {topic} (rc={result.rc})")
-            time.sleep(0.1)
-
-        client.disconnect()
-        print(f"\n✅ Successfully removed {removed_count}/{len(discovered_topics)} discovery topics")
-        print("🏠 Home Assistant should remove the entities within a few minutes")
-        return True
-
-    except Exception as e:
-        print(f"❌ Failed to connect to MQTT broker: {e}")
-        return False
+        with profiler.stage('confirm'):
+            remaining = confirm_removed(client, publisher, filters, accept)
+    finally:
+        with profiler.stage('disconnect'):
+            disconnect_client(client)
+
+    removed_topics = [topic for topic in discovered_topics if topic not in set(remaining) | set(report.failed)]
+    forget_topics(manifest_file, f"{mqtt_host}:{mqtt_port}", removed_topics)
+    print_removal_summary(removed_topics, remaining, len(discovered_topics), report)
+    print("🏠 Home Assistant should remove the entities within a few minutes")
+    return not remaining
+
+
+def write_cleanup_metrics(metrics_file: str, duration: float, success: bool):
+    registry = MetricsRegistry()
+    registry.gauge('discovery_cleanup_duration_seconds', 'Duration of the last discovery cleanup').set(duration)
+    registry.gauge('discovery_cleanup_success', 'Whether the last cleanup removed every topic').set(int(success))
+    registry.gauge('discovery_cleanup_last_run_timestamp_seconds', 'End of the last discovery cleanup').set(time.time())
+    try:
+        write_textfile(registry, metrics_file)
+    except OSError as e:
+        print(f"⚠️  Could not write metrics to {metrics_file}: {e}")
 
 
 def main():
@@ -232,10 +376,22 @@ def main():
     # Filtering (for prefix mode)
     parser.add_argument('--device-prefix', help='Device prefix to filter by (e.g., bartl_wp)')
 
+    # Incremental publishing state
+    parser.add_argument('--manifest', help='Discovery manifest JSON file to drop the removed topics from')
+
     # Safety
     parser.add_argument('--dry-run', action='store_true', help='Show what would be removed without actually doing it')
+    parser.add_argument('--yes', action='store_true',
+                        help='Skip the confirmation prompts, prefix mode then removes topics as they are discovered')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='Maximum unacknowledged deletions in flight')
+    parser.add_argument('--metrics-file', help='Write the cleanup duration in Prometheus text format to this file')
+    parser.add_argument('--profile', action='store_true', help='Print wall time and allocations per stage')
+    parser.add_argument('--profile-output', help='Directory for cProfile and tracemalloc reports, implies --profile')
 
     args = parser.parse_args()
+    started = time.monotonic()
+    profiler = StageProfiler(args.profile, args.profile_output)
+    profiler.start()
 
     print("🧹 Home Assistant MQTT Discovery Cleanup Tool")
     print("=" * 50)
@@ -252,7 +408,11 @@ def main():
             args.mqtt_port,
             args.mqtt_user,
             args.mqtt_password,
-            args.dry_run
+            args.dry_run,
+            args.manifest,
+            args.yes,
+            args.window,
+            profiler
         )
     else:
         # Prefix mode
@@ -263,9 +423,17 @@ def main():
             args.mqtt_port,
             args.mqtt_user,
             args.mqtt_password,
-            args.dry_run
+            args.dry_run,
+            args.manifest,
+            args.yes,
+            args.window,
+            profiler
         )
 
+    if args.metrics_file and not args.dry_run:
+        write_cleanup_metrics(args.metrics_file, time.monotonic() - started, success)
+    report_profile(profiler, 'cleanup_discovery')
+
     if not success:
         sys.exit(1)
 
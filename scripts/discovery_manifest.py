@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Content-hash manifest for incremental discovery publishing
+
+The manifest records a hash of every retained discovery payload published to
+a broker. On the next run only added and changed topics are published and
+topics that disappeared from the discovery set are cleared, so a restart with
+an unchanged register map does not touch the broker or Home Assistant.
+
+Manifest file (JSON):
+    {
+      "version": 1,
+      "broker": "mqtt.local:1883",
+      "topics": {"homeassistant/sensor/heizkreis_vorlauf/config": "<sha256>"}
+    }
+
+A manifest written for a different broker is ignored, everything is
+published again. Use --force when the broker lost its retained messages.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Any, List, NamedTuple, Optional
+
+MANIFEST_VERSION = 1
+
+
+class ManifestDiff(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    unchanged: List[str]
+
+
+def encode_payload(config: Dict[str, Any]) -> str:
+    """Serialize a discovery config exactly like it is published, minified UTF-8"""
+    return json.dumps(config, separators=(',', ':'), ensure_ascii=False)
+
+
+def payload_bytes(discovery_configs: Dict[str, Any]) -> int:
+    """Total size of the retained payloads of a discovery set"""
+    return sum(len(encode_payload(config).encode('utf-8')) for config in discovery_configs.values())
+
+
+def payload_hash(payload: str) -> str:
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def build_manifest(discovery_configs: Dict[str, Any]) -> Dict[str, str]:
+    """Return topic -> payload hash for a discovery set"""
+    return {topic: payload_hash(encode_payload(config)) for topic, config in discovery_configs.items()}
+
+
+def diff_manifest(previous: Dict[str, str], current: Dict[str, str]) -> ManifestDiff:
+    """Compare the published manifest with the one of the current discovery set"""
+    added, changed, unchanged = [], [], []
+    for topic, digest in current.items():
+        if topic not in previous:
+            added.append(topic)
+        elif previous[topic] != digest:
+            changed.append(topic)
+        else:
+            unchanged.append(topic)
+    removed = [topic for topic in previous if topic not in current]
+    return ManifestDiff(added, changed, removed, unchanged)
+
+
+def load_manifest(manifest_file: Optional[str], broker: str) -> Dict[str, str]:
+    """Load the published manifest, empty if missing, unreadable or for another broker"""
+    if not manifest_file or not Path(manifest_file).exists():
+        return {}
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring unreadable manifest {manifest_file}: {e}")
+        return {}
+    if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION or data.get('broker') != broker:
+        return {}
+    return dict(data.get('topics') or {})
+
+
+def save_manifest(manifest_file: str, broker: str, topics: Dict[str, str]):
+    """Write the manifest atomically so an interrupted run never leaves half a file"""
+    path = Path(manifest_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'broker': broker, 'topics': topics}, f, indent=2, sort_keys=True)
+    os.replace(temp, path)
+
+
+def forget_topics(manifest_file: Optional[str], broker: str, topics: List[str]):
+    """Drop topics that were removed from the broker by other means, e.g. cleanup"""
+    manifest = load_manifest(manifest_file, broker)
+    if not manifest:
+        return
+    for topic in topics:
+        manifest.pop(topic, None)
+    save_manifest(manifest_file, broker, manifest)
+
+
+def publish_incremental(publisher, discovery_configs: Dict[str, Any], broker: str,
+                        manifest_file: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+    """Publish added and changed discovery configs and clear removed ones
+
+    publisher is a FlowControlledPublisher on a connected client. Without a
+    manifest file every config is published. Only topics the broker
+    acknowledged are recorded in the manifest. Returns counts for the summary.
+    """
+    previous = {} if force else load_manifest(manifest_file, broker)
+    current = build_manifest(discovery_configs)
+    diff = diff_manifest(previous, current)
+
+    # An empty retained payload removes the entity from Home Assistant. Removals
+    # go first: when switching between per-entity and device-based discovery
+    # the old topic must be gone before the same unique_id is announced again.
+    messages = [(topic, "") for topic in diff.removed]
+    messages += [(topic, encode_payload(discovery_configs[topic])) for topic in diff.added + diff.changed]
+    report = publisher.publish_all(messages, retain=True)
+
+    failed = set(report.failed)
+    for topic in failed:
+        print(f"✗ Not confirmed by the broker: {topic}")
+    published = dict(previous)
+    for topic in diff.added + diff.changed:
+        if topic not in failed:
+            published[topic] = current[topic]
+    for topic in diff.removed:
+        if topic not in failed:
+            published.pop(topic, None)
+
+    if manifest_file:
+        save_manifest(manifest_file, broker, published)
+
+    return {
+        'added': len(diff.added),
+        'changed': len(diff.changed),
+        'removed': len(diff.removed),
+        'unchanged': len(diff.unchanged),
+        'failed': len(failed),
+        'report': report,
+    }
+
+
+def format_summary(counts: Dict[str, Any]) -> str:
+    report = counts['report']
+    return (f"{counts['added']} added, {counts['changed']} changed, {counts['removed']} removed, "
+            f"{counts['unchanged']} unchanged, {counts['failed']} failed; "
+            f"{report.confirmed}/{report.messages} confirmed ({report.messages_per_s:.0f} msgs/s)")
@@ -6,26 +6,133 @@ This script reads a modbus4mqtt YAML configuration file and generates
 Home Assistant MQTT Auto Discovery configuration messages.
 
 Usage:
-    python generate_ha_discovery.py --config path/to/config.yml --mqtt-prefix bartl_wp --output discovery.json
+    python generate_ha_discovery.py --config path/to/config.yml --mqtt-prefix bartl_wp --discovery-prefix homeassistant --output discovery.json
 
 Features:
 - Automatically maps modbus4mqtt topics to HA discovery topics
 - Handles value mappings for select entities
 - Supports different entity types (sensor, number, select, switch)
 - Groups entities by device based on topic structure
+- Keyword rules compiled once, each topic is classified once
+- Optional compact payloads: abbreviated keys, '~' topic base, the full
+  device block only on the first entity of each device, minified JSON
+- Optional device-based discovery: one message per device with all its entities
+- --profile: wall time and allocations per stage and entity type,
+  --profile-output adds cProfile and tracemalloc reports
 """
 
-import yaml
+import importlib.util
 import json
 import argparse
+import re
 import sys
+import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from discovery_manifest import build_manifest, format_summary, payload_bytes, publish_incremental
+from mqtt_publisher import FlowControlledPublisher, connect_client, disconnect_client
+from profiling import NO_PROFILER, StageProfiler, report_profile
+from register_model import load_config
+
+# Topics are split into tokens on these characters before keyword matching
+TOKEN_SEPARATORS = re.compile(r'[/_\s.-]+')
+
+# Keywords up to this length only match a whole token, so 'a' or 'h' no
+# longer match every topic containing that letter. Longer keywords also match
+# at the start or end of a token to cover compounds like 'raumtemperatur'.
+MIN_COMPOUND_KEYWORD_LENGTH = 4
+
+SWITCH_KEYWORDS = ['pumpe', 'pump', 'schalter', 'switch', 'aktiv', 'enable']
+TOTAL_INCREASING_KEYWORDS = ['betriebsstunden', 'verbrauch']
+
+# Key abbreviations supported by Home Assistant MQTT discovery
+ABBREVIATIONS = {
+    'command_template': 'cmd_tpl',
+    'command_topic': 'cmd_t',
+    'device': 'dev',
+    'device_class': 'dev_cla',
+    'options': 'ops',
+    'payload_off': 'pl_off',
+    'payload_on': 'pl_on',
+    'state_class': 'stat_cla',
+    'state_off': 'stat_off',
+    'state_on': 'stat_on',
+    'state_topic': 'stat_t',
+    'unique_id': 'uniq_id',
+    'unit_of_measurement': 'unit_of_meas',
+    'value_template': 'val_tpl',
+    # Device-based discovery
+    'components': 'cmps',
+    'origin': 'o',
+    'platform': 'p',
+}
+DEVICE_ABBREVIATIONS = {
+    'identifiers': 'ids',
+    'manufacturer': 'mf',
+    'model': 'mdl',
+    'sw_version': 'sw',
+}
+# Keys whose values may use the '~' base topic
+TOPIC_KEYS = ('state_topic', 'command_topic')
+
+# Origin of device-based discovery messages, required by Home Assistant
+ORIGIN = {'name': 'bartl-modbus-mqtt-bridge'}
+
+
+class TopicClassification(NamedTuple):
+    tokens: Tuple[str, ...]
+    device_class: Optional[str]
+    unit: Optional[str]
+    switch: bool
+    total_increasing: bool
+
+
+class KeywordClassifier:
+    """Token-aware keyword matcher built from several keyword to value rule sets
+
+    Each rule set is a role, for example 'unit'. Within a role the first
+    keyword in rule order wins, like the dictionaries it is built from.
+    """
+
+    def __init__(self, roles: Dict[str, Dict[str, Any]]):
+        self.roles = list(roles)
+        # keyword -> [(role, priority, value)]
+        self._keywords: Dict[str, List[Tuple[str, int, Any]]] = {}
+        for role, rules in roles.items():
+            for priority, (keyword, value) in enumerate(rules.items()):
+                self._keywords.setdefault(keyword.lower(), []).append((role, priority, value))
+        self._compound_lengths = sorted({len(keyword) for keyword in self._keywords
+                                         if len(keyword) >= MIN_COMPOUND_KEYWORD_LENGTH}, reverse=True)
+
+    @staticmethod
+    def tokenize(topic: str) -> Tuple[str, ...]:
+        return tuple(token for token in TOKEN_SEPARATORS.split(topic.lower()) if token)
+
+    def _candidates(self, token: str):
+        yield token
+        for length in self._compound_lengths:
+            if length < len(token):
+                yield token[:length]
+                yield token[-length:]
+
+    def classify(self, tokens: Tuple[str, ...]) -> Dict[str, Any]:
+        """Return the best matching value per role, roles without a match are None"""
+        best: Dict[str, Tuple[int, Any]] = {}
+        for token in tokens:
+            for candidate in self._candidates(token):
+                for role, priority, value in self._keywords.get(candidate, ()):
+                    if role not in best or priority < best[role][0]:
+                        best[role] = (priority, value)
+        return {role: best[role][1] if role in best else None for role in self.roles}
 
 
 class HADiscoveryGenerator:
-    def __init__(self, mqtt_prefix: str = ""):
+    def __init__(self, mqtt_prefix: str = "", discovery_prefix: str = "homeassistant",
+                 profiler: StageProfiler = NO_PROFILER):
         self.mqtt_prefix = mqtt_prefix
+        self.discovery_prefix = discovery_prefix
+        self.profiler = profiler
         self.devices = {}
         self.discovery_configs = {}
         
@@ -92,6 +199,33 @@ class HADiscoveryGenerator:
             'seconds': 's'
         }
 
+        self._classifier = None
+        self._classifications: Dict[str, TopicClassification] = {}
+
+    def classify_topic(self, topic: str) -> TopicClassification:
+        """Tokenize and classify a topic once, later calls hit the cache"""
+        classification = self._classifications.get(topic)
+        if classification is None:
+            if self._classifier is None:
+                # Compiled on first use so tweaks to the mappings after __init__ are included
+                self._classifier = KeywordClassifier({
+                    'device_class': self.device_class_mapping,
+                    'unit': self.unit_mapping,
+                    'switch': dict.fromkeys(SWITCH_KEYWORDS, True),
+                    'total_increasing': dict.fromkeys(TOTAL_INCREASING_KEYWORDS, True),
+                })
+            tokens = self._classifier.tokenize(topic)
+            matches = self._classifier.classify(tokens)
+            classification = TopicClassification(
+                tokens=tokens,
+                device_class=matches['device_class'],
+                unit=matches['unit'],
+                switch=bool(matches['switch']),
+                total_increasing=bool(matches['total_increasing']),
+            )
+            self._classifications[topic] = classification
+        return classification
+
     def extract_device_info(self, topic: str) -> Dict[str, Any]:
         """Extract device information from topic structure"""
         parts = topic.split('/')
@@ -122,8 +256,7 @@ class HADiscoveryGenerator:
         # Check if it has set_topic - likely a number input
         if 'set_topic' in register:
             # Check if it looks like a binary switch
-            topic_lower = register.get('pub_topic', '').lower()
-            if any(word in topic_lower for word in ['pumpe', 'pump', 'schalter', 'switch', 'aktiv', 'enable']):
+            if self.classify_topic(register.get('pub_topic', '')).switch:
                 return 'switch'
             return 'number'
         
@@ -132,25 +265,11 @@ class HADiscoveryGenerator:
 
     def get_device_class(self, register: Dict[str, Any]) -> Optional[str]:
         """Determine device class from register information"""
-        topic = register.get('pub_topic', '').lower()
-        
-        # Check topic for device class hints
-        for key, device_class in self.device_class_mapping.items():
-            if key in topic:
-                return device_class
-        
-        return None
+        return self.classify_topic(register.get('pub_topic', '')).device_class
 
     def get_unit_of_measurement(self, register: Dict[str, Any]) -> Optional[str]:
         """Extract unit of measurement from register or topic"""
-        topic = register.get('pub_topic', '').lower()
-        
-        # Check topic for unit hints
-        for unit_hint, standard_unit in self.unit_mapping.items():
-            if unit_hint in topic:
-                return standard_unit
-        
-        return None
+        return self.classify_topic(register.get('pub_topic', '')).unit
 
     def create_sensor_config(self, register: Dict[str, Any], device_info: Dict[str, Any]) -> Dict[str, Any]:
         """Create sensor configuration"""
@@ -177,7 +296,7 @@ class HADiscoveryGenerator:
         
         # Add state class for numeric sensors
         if device_class in ['temperature', 'humidity', 'power', 'energy', 'voltage', 'current']:
-            if 'betriebsstunden' in topic.lower() or 'verbrauch' in topic.lower():
+            if self.classify_topic(topic).total_increasing:
                 config["state_class"] = "total_increasing"
             else:
                 config["state_class"] = "measurement"
@@ -319,11 +438,10 @@ class HADiscoveryGenerator:
 
     def generate_discovery_configs(self, config_file: str) -> Dict[str, Any]:
         """Generate discovery configurations from modbus4mqtt config"""
-        with open(config_file, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-        
-        if 'registers' not in config:
-            raise ValueError("No 'registers' section found in config file")
+        profiler = self.profiler
+        # Raises ValueError without a 'registers' section
+        with profiler.stage('load'):
+            config = load_config(config_file)
         
         discovery_configs = {}
         
@@ -331,13 +449,18 @@ class HADiscoveryGenerator:
             if 'pub_topic' not in register:
                 continue
             
+            if profiler:
+                started, allocated = time.perf_counter(), profiler.allocated()
             topic = register['pub_topic']
             device_info = self.extract_device_info(topic)
             entity_type = self.determine_entity_type(register)
+            if profiler:
+                classified, classified_allocated = time.perf_counter(), profiler.allocated()
+                profiler.record('classify', classified - started, classified_allocated - allocated)
             
             # Generate unique_id and discovery topic
             unique_id = topic.replace('/', '_')
-            discovery_topic = f"homeassistant/{entity_type}/{unique_id}/config"
+            discovery_topic = f"{self.discovery_prefix}/{entity_type}/{unique_id}/config"
             
             # Create configuration based on entity type
             if entity_type == 'sensor':
@@ -352,38 +475,122 @@ class HADiscoveryGenerator:
                 continue
             
             discovery_configs[discovery_topic] = entity_config
+            if profiler:
+                profiler.record(f'build/{entity_type}', time.perf_counter() - classified,
+                                profiler.allocated() - classified_allocated)
         
         return discovery_configs
 
-    def save_discovery_configs(self, discovery_configs: Dict[str, Any], output_file: str):
+    @staticmethod
+    def topic_base(config: Dict[str, Any]) -> Optional[str]:
+        """Longest common topic level prefix of the entity topics, None if fewer than two share one"""
+        topics = [config[key] for key in TOPIC_KEYS if key in config]
+        if len(topics) < 2:
+            return None
+        levels = topics[0].split('/')
+        for topic in topics[1:]:
+            other = topic.split('/')
+            common = 0
+            while common < min(len(levels), len(other)) and levels[common] == other[common]:
+                common += 1
+            levels = levels[:common]
+        return '/'.join(levels) or None
+
+    def device_object_id(self, device_info: Dict[str, Any]) -> str:
+        """Object id of a device-based discovery topic, prefixed so it does not clash with other devices"""
+        device_id = str(device_info['identifiers'][0])
+        return f"{self.mqtt_prefix}_{device_id}".replace('/', '_') if self.mqtt_prefix else device_id
+
+    def bundle_device_configs(self, discovery_configs: Dict[str, Any]) -> Dict[str, Any]:
+        """Group per-entity configs into one device-based discovery message per device
+        
+        Home Assistant (2024.11 and later) reads all entities of a device as
+        components of <discovery_prefix>/device/<object_id>/config. Unique ids
+        stay the same, so entity ids and history carry over.
+        """
+        bundles = {}
+        for discovery_topic, config in discovery_configs.items():
+            # <discovery_prefix>/<entity_type>/<unique_id>/config
+            component = {'platform': discovery_topic.split('/')[-3]}
+            component.update((key, value) for key, value in config.items() if key != 'device')
+            device_topic = f"{self.discovery_prefix}/device/{self.device_object_id(config['device'])}/config"
+            bundle = bundles.setdefault(device_topic, {
+                'device': config['device'],
+                'origin': dict(ORIGIN),
+                'components': {},
+            })
+            bundle['components'][config['unique_id']] = component
+        return bundles
+
+    def compact_entity_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Abbreviate the keys of one entity config and use the '~' topic base"""
+        compact = {}
+        base = self.topic_base(config)
+        if base:
+            compact['~'] = base
+        for key, value in config.items():
+            if key == 'device':
+                value = {DEVICE_ABBREVIATIONS.get(k, k): v for k, v in value.items()}
+            elif key in TOPIC_KEYS and base and (value == base or value.startswith(base + '/')):
+                value = '~' + value[len(base):]
+            compact[ABBREVIATIONS.get(key, key)] = value
+        return compact
+
+    def compact_discovery_configs(self, discovery_configs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the configs with abbreviated keys and the '~' topic base
+        
+        Home Assistant keeps the device in its registry, so only the first
+        entity of a device carries the full device block, later ones link to
+        it by identifiers. Device bundles carry it once anyway.
+        """
+        compact_configs = {}
+        seen_devices = set()
+        for discovery_topic, config in discovery_configs.items():
+            if 'components' in config:
+                compact = {'dev': {DEVICE_ABBREVIATIONS.get(k, k): v for k, v in config['device'].items()}}
+                compact.update((ABBREVIATIONS.get(key, key), value) for key, value in config.items()
+                               if key not in ('device', 'components'))
+                compact['cmps'] = {component_id: self.compact_entity_config(component)
+                                   for component_id, component in config['components'].items()}
+            else:
+                if 'device' in config:
+                    identifiers = tuple(config['device'].get('identifiers', ()))
+                    if identifiers and identifiers in seen_devices:
+                        config = dict(config, device={'identifiers': config['device']['identifiers']})
+                    seen_devices.add(identifiers)
+                compact = self.compact_entity_config(config)
+            compact_configs[discovery_topic] = compact
+        return compact_configs
+
+    def save_discovery_configs(self, discovery_configs: Dict[str, Any], output_file: str, minify: bool = False):
         """Save discovery configurations to JSON file"""
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(discovery_configs, f, indent=2, ensure_ascii=False)
+            if minify:
+                json.dump(discovery_configs, f, separators=(',', ':'), ensure_ascii=False)
+            else:
+                json.dump(discovery_configs, f, indent=2, ensure_ascii=False)
+
+    def build_manifest(self, discovery_configs: Dict[str, Any]) -> Dict[str, str]:
+        """Hash each discovery payload, see discovery_manifest.py"""
+        return build_manifest(discovery_configs)
 
     def publish_discovery_configs(self, discovery_configs: Dict[str, Any], mqtt_host: str, 
-                                mqtt_port: int = 1883, mqtt_user: str = None, mqtt_password: str = None):
+                                mqtt_port: int = 1883, mqtt_user: str = None, mqtt_password: str = None,
+                                manifest_file: str = None, force: bool = False):
         """Publish discovery configurations to MQTT broker"""
-        try:
-            import paho.mqtt.client as mqtt
-        except ImportError:
+        if importlib.util.find_spec('paho') is None:
             print("paho-mqtt not installed. Install with: pip install paho-mqtt")
             return False
         
-        client = mqtt.Client()
-        
-        if mqtt_user and mqtt_password:
-            client.username_pw_set(mqtt_user, mqtt_password)
-        
         try:
-            client.connect(mqtt_host, mqtt_port, 60)
-            
-            for topic, config in discovery_configs.items():
-                payload = json.dumps(config)
-                client.publish(topic, payload, retain=True)
-                print(f"Published: {topic}")
-            
-            client.disconnect()
-            return True
+            client = connect_client(mqtt_host, mqtt_port, mqtt_user, mqtt_password)
+            try:
+                counts = publish_incremental(FlowControlledPublisher(client), discovery_configs,
+                                             f"{mqtt_host}:{mqtt_port}", manifest_file, force)
+            finally:
+                disconnect_client(client)
+            print(f"Discovery configurations: {format_summary(counts)}")
+            return not counts['failed']
         except Exception as e:
             print(f"Failed to publish to MQTT: {e}")
             return False
@@ -393,12 +600,22 @@ def main():
     parser = argparse.ArgumentParser(description='Generate Home Assistant MQTT Auto Discovery from modbus4mqtt config')
     parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
     parser.add_argument('--mqtt-prefix', default='', help='MQTT topic prefix used by modbus4mqtt')
+    parser.add_argument('--discovery-prefix', default='homeassistant', help='Home Assistant discovery prefix')
     parser.add_argument('--output', default='ha_discovery.json', help='Output JSON file for discovery configs')
     parser.add_argument('--publish', action='store_true', help='Publish directly to MQTT broker')
     parser.add_argument('--mqtt-host', help='MQTT broker hostname')
     parser.add_argument('--mqtt-port', type=int, default=1883, help='MQTT broker port')
     parser.add_argument('--mqtt-user', help='MQTT username')
     parser.add_argument('--mqtt-password', help='MQTT password')
+    parser.add_argument('--manifest', help='Manifest JSON file, only added/changed/removed topics are published')
+    parser.add_argument('--force', action='store_true', help='Publish every config even if the manifest says unchanged')
+    parser.add_argument('--device-discovery', action='store_true',
+                        help='One device-based discovery message per device instead of one per entity')
+    parser.add_argument('--compact', action='store_true',
+                        help='Abbreviated keys, ~ topic base, device block once per device, minified output')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print wall time and allocations per stage and entity type')
+    parser.add_argument('--profile-output', help='Directory for cProfile and tracemalloc reports, implies --profile')
     
     args = parser.parse_args()
     
@@ -406,15 +623,33 @@ def main():
         print(f"Config file not found: {args.config}")
         sys.exit(1)
     
+    profiler = StageProfiler(args.profile, args.profile_output)
+    profiler.start()
+    
     # Generate discovery configurations
-    generator = HADiscoveryGenerator(args.mqtt_prefix)
+    generator = HADiscoveryGenerator(args.mqtt_prefix, args.discovery_prefix, profiler)
     
     try:
         discovery_configs = generator.generate_discovery_configs(args.config)
         print(f"Generated {len(discovery_configs)} discovery configurations")
         
+        if args.device_discovery:
+            entity_count = len(discovery_configs)
+            with profiler.stage('bundle'):
+                discovery_configs = generator.bundle_device_configs(discovery_configs)
+            print(f"Bundled {entity_count} entities into {len(discovery_configs)} device discovery messages")
+        
+        if args.compact:
+            full_bytes = payload_bytes(discovery_configs)
+            with profiler.stage('compact'):
+                discovery_configs = generator.compact_discovery_configs(discovery_configs)
+            compact_bytes = payload_bytes(discovery_configs)
+            print(f"Payload size: {full_bytes} bytes full, {compact_bytes} bytes compact "
+                  f"({100 * (1 - compact_bytes / full_bytes) if full_bytes else 0:.0f}% smaller)")
+        
         # Save to file
-        generator.save_discovery_configs(discovery_configs, args.output)
+        with profiler.stage('save'):
+            generator.save_discovery_configs(discovery_configs, args.output, minify=args.compact)
         print(f"Saved discovery configurations to: {args.output}")
         
         # Optionally publish to MQTT
@@ -423,13 +658,16 @@ def main():
                 print("--mqtt-host required when using --publish")
                 sys.exit(1)
             
-            success = generator.publish_discovery_configs(
-                discovery_configs, 
-                args.mqtt_host, 
-                args.mqtt_port, 
-                args.mqtt_user, 
-                args.mqtt_password
-            )
+            with profiler.stage('publish'):
+                success = generator.publish_discovery_configs(
+                    discovery_configs, 
+                    args.mqtt_host, 
+                    args.mqtt_port, 
+                    args.mqtt_user, 
+                    args.mqtt_password,
+                    args.manifest,
+                    args.force
+                )
             
             if success:
                 print("Successfully published all discovery configurations to MQTT")
@@ -440,6 +678,8 @@ def main():
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
+    finally:
+        report_profile(profiler, 'generate_ha_discovery')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Telegraf Config Generator for modbus4mqtt configurations
+
+This script reads a modbus4mqtt YAML configuration file and writes a Telegraf
+configuration that stores every published register in InfluxDB through a
+single MQTT consumer.
+
+Usage:
+    python generate_telegraf_config.py --config path/to/config.yml --mqtt-prefix bartl_wp --output config/telegraf/telegraf.conf
+
+Features:
+- One mqtt_consumer, one broker connection for all registers
+- Measurement per device (heizkreis, puffer, ...) from topic_parsing, no regex processors
+- Numbers stored as float in field value, value_map and status/* registers as string in
+  field text, so a measurement never mixes field types
+- Command topics (set_topic) are dropped at the input
+- Subscriptions derived from the register map, no hand-maintained topic globs
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from register_model import load_config
+
+# Registers below these topics are text even without a value_map
+STRING_TOPIC_PREFIXES = ('status/',)
+
+AGENT_SECTION = """\
+[global_tags]
+
+[agent]
+  interval = "5s"
+  round_interval = true
+  metric_batch_size = 1000
+  metric_buffer_limit = 10000
+  collection_jitter = "0s"
+  flush_interval = "10s"
+  flush_jitter = "0s"
+  precision = ""
+  hostname = "bartl-wp"
+  omit_hostname = false
+  debug = true
+
+[[outputs.influxdb_v2]]
+  urls = ["https://${INFLUXDB_URL}"]
+  ## Token for authentication.
+  token = "${INFLUXDB_TOKEN}"
+  ## Organization is the name of the organization you wish to write to; must exist.
+  organization = "${INFLUXDB_ORG}"
+  ## Destination bucket to write into.
+  bucket = "${INFLUXDB_BUCKET}"
+  insecure_skip_verify = true
+"""
+
+
+def toml_list(values: List[str], indent: str = '    ') -> str:
+    """Render a list of strings, one per line"""
+    if not values:
+        return '[]'
+    return '[\n' + ''.join(f'{indent}{json.dumps(value, ensure_ascii=False)},\n' for value in values) + indent[:-2] + ']'
+
+
+def full_topic(mqtt_prefix: str, topic: str) -> str:
+    return f"{mqtt_prefix}/{topic}" if mqtt_prefix else topic
+
+
+def is_string_register(register: Dict[str, Any]) -> bool:
+    """value_map registers publish the mapped text, status registers are text anyway"""
+    return bool(register.get('value_map')) or register['pub_topic'].startswith(STRING_TOPIC_PREFIXES)
+
+
+def subscriptions(mqtt_prefix: str, registers: List[Dict[str, Any]]) -> List[str]:
+    """One wildcard per device level, each covers all registers of that device"""
+    devices = sorted({register['pub_topic'].split('/')[0] for register in registers})
+    return [full_topic(mqtt_prefix, f"{device}/#") for device in devices]
+
+
+def command_topic_filters(mqtt_prefix: str, registers: List[Dict[str, Any]]) -> List[str]:
+    """Globs for the set topics the device wildcards also match"""
+    set_topics = [register['set_topic'] for register in registers if 'set_topic' in register]
+    filters = {'*/set'} if any(topic.endswith('/set') for topic in set_topics) else set()
+    filters.update(full_topic(mqtt_prefix, topic) for topic in set_topics if not topic.endswith('/set'))
+    return sorted(filters)
+
+
+def string_topic_filters(mqtt_prefix: str, registers: List[Dict[str, Any]]) -> List[str]:
+    """Globs for registers stored as string, prefixes first, then single value_map topics"""
+    filters = [full_topic(mqtt_prefix, f"{prefix}*") for prefix in STRING_TOPIC_PREFIXES
+               if any(register['pub_topic'].startswith(prefix) for register in registers)]
+    filters += sorted(full_topic(mqtt_prefix, register['pub_topic']) for register in registers
+                      if register.get('value_map') and not register['pub_topic'].startswith(STRING_TOPIC_PREFIXES))
+    return filters
+
+
+def topic_parsing_rules(mqtt_prefix: str, registers: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(topic, measurement) per topic depth, the measurement is the device level"""
+    prefix_levels = mqtt_prefix.split('/') if mqtt_prefix else []
+    rules = []
+    for depth in sorted({len(register['pub_topic'].split('/')) for register in registers}):
+        topic = '/'.join(prefix_levels + ['+'] * depth)
+        measurement = '/'.join(['_'] * len(prefix_levels) + ['measurement'] + ['_'] * (depth - 1))
+        rules.append((topic, measurement))
+    return rules
+
+
+def render_config(mqtt_prefix: str, registers: List[Dict[str, Any]]) -> str:
+    """Return the Telegraf configuration for the published registers"""
+    lines = [
+        AGENT_SECTION,
+        '[[inputs.mqtt_consumer]]',
+        '  servers = ["tcp://${MQTT_SERVER_ADDRESS}:${MQTT_SERVER_PORT}"]',
+        '  username = "${MQTT_SERVER_USER}"',
+        '  password = "${MQTT_SERVER_PASSWORD}"',
+        f'  topics = {toml_list(subscriptions(mqtt_prefix, registers))}',
+        '  data_format = "value"',
+        '  ## Numbers become float, text stays string; text registers are moved to',
+        '  ## field "text" below, InfluxDB fixes the type of a field per measurement',
+        '  data_type = "auto_float"',
+    ]
+    command_filters = command_topic_filters(mqtt_prefix, registers)
+    if command_filters:
+        lines += ['', '  ## Commands from Home Assistant are not measurements',
+                  '  [inputs.mqtt_consumer.tagdrop]',
+                  f'    topic = {toml_list(command_filters, "      ")}']
+    for topic, measurement in topic_parsing_rules(mqtt_prefix, registers):
+        lines += ['', '  [[inputs.mqtt_consumer.topic_parsing]]',
+                  f'    topic = "{topic}"',
+                  f'    measurement = "{measurement}"']
+
+    string_filters = string_topic_filters(mqtt_prefix, registers)
+    if string_filters:
+        lines += ['', '[[processors.rename]]',
+                  '  order = 1',
+                  '  [processors.rename.tagpass]',
+                  f'    topic = {toml_list(string_filters, "      ")}',
+                  '  [[processors.rename.replace]]',
+                  '    field = "value"',
+                  '    dest = "text"',
+                  '',
+                  '## A raw fallback value of a text register stays a string',
+                  '[[processors.converter]]',
+                  '  order = 2',
+                  '  [processors.converter.fields]',
+                  '    string = ["text"]']
+    return '\n'.join(lines) + '\n'
+
+
+def load_registers(config_file: str) -> List[Dict[str, Any]]:
+    """Return the registers that publish a value"""
+    config = load_config(config_file)
+    return [register for register in config['registers'] if 'pub_topic' in register]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a Telegraf config from a modbus4mqtt config')
+    parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
+    parser.add_argument('--mqtt-prefix', default='bartl_wp', help='MQTT topic prefix used by the bridge')
+    parser.add_argument('--output', default='config/telegraf/telegraf.conf', help='Output Telegraf config file')
+
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print(f"❌ Config file not found: {args.config}")
+        sys.exit(1)
+
+    try:
+        registers = load_registers(args.config)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(render_config(args.mqtt_prefix, registers))
+
+    string_count = sum(1 for register in registers if is_string_register(register))
+    print(f"✅ Wrote {args.output}: 1 MQTT consumer for {len(registers)} registers "
+          f"({len(registers) - string_count} float, {string_count} string), "
+          f"{len(subscriptions(args.mqtt_prefix, registers))} subscriptions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Batched InfluxDB line-protocol sink for the Modbus to MQTT bridge
+
+Writes the polled values straight to the InfluxDB v2 write API instead of
+sending each value as its own MQTT message for Telegraf to parse. Every
+device group (the first pub_topic level) becomes one multi-field point per
+poll cycle, stamped with the poll time. Points are buffered and written once
+per flush interval as a single gzip compressed request.
+
+Configuration (bridge command line):
+    --influx-url http://influxdb:8086 --influx-org home --influx-bucket bartl
+    --influx-token <token> --influx-flush-interval 10
+
+Points:
+    heizkreis temperatur/vorlauf/istwert=35.2,raumtemperatur/aktuell=21.5 1718000000000
+    status heizkreis/betriebsart="Tag",warmwasser/betriebsart="Auto" 1718000000000
+
+Writes that fail are kept and sent again with the next flush, up to
+max_lines buffered lines, the oldest are dropped beyond that.
+"""
+
+import asyncio
+import gzip
+import logging
+import math
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, Any, List, Tuple, Union
+
+logger = logging.getLogger('modbus_mqtt_bridge')
+
+DEFAULT_FLUSH_INTERVAL = 10.0
+MAX_BUFFERED_LINES = 100000
+WRITE_TIMEOUT = 10.0
+GZIP_LEVEL = 6
+
+
+def escape_key(key: str) -> str:
+    """Escape a measurement name or field key for line protocol"""
+    return key.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def encode_field_value(value: Union[float, int, str]) -> str:
+    """Encode a field value, numbers as float so the field type never changes"""
+    if isinstance(value, str):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return repr(float(value))
+
+
+class InfluxLineSink:
+    def __init__(self, url: str, token: str = '', org: str = '', bucket: str = '',
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_lines: int = MAX_BUFFERED_LINES):
+        query = urllib.parse.urlencode({'org': org, 'bucket': bucket, 'precision': 'ms'})
+        self.write_url = f"{url.rstrip('/')}/api/v2/write?{query}"
+        self.token = token
+        self.flush_interval = flush_interval
+        self.max_lines = max_lines
+        # (timestamp ms, measurement) -> field key -> encoded value, until the next flush
+        self._points: Dict[Tuple[int, str], Dict[str, str]] = {}
+        # Serialized lines waiting to be written, includes failed writes
+        self._lines: List[str] = []
+        self.points_written = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, measurement: str, field: str, value: Union[float, int, str], timestamp: float):
+        """Add a field to the point of a measurement at a poll timestamp in seconds"""
+        if not isinstance(value, str) and not math.isfinite(value):
+            # Line protocol has no NaN or infinity
+            return
+        self._points.setdefault((int(timestamp * 1000), measurement), {})[field] = encode_field_value(value)
+
+    def _serialize(self):
+        for (timestamp, measurement), fields in self._points.items():
+            field_set = ','.join(f"{escape_key(key)}={value}" for key, value in fields.items())
+            self._lines.append(f"{escape_key(measurement)} {field_set} {timestamp}")
+        self._points = {}
+        if len(self._lines) > self.max_lines:
+            self.dropped += len(self._lines) - self.max_lines
+            del self._lines[:len(self._lines) - self.max_lines]
+
+    def _post(self, body: bytes):
+        # Blocking, runs in the default executor
+        request = urllib.request.Request(self.write_url, data=body, method='POST', headers={
+            'Content-Encoding': 'gzip',
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Authorization': f"Token {self.token}",
+        })
+        with urllib.request.urlopen(request, timeout=WRITE_TIMEOUT) as response:
+            response.read()
+
+    async def flush(self):
+        """Write all buffered points with one gzip compressed request"""
+        self._serialize()
+        if not self._lines:
+            return
+        lines, self._lines = self._lines, []
+        body = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), GZIP_LEVEL)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._post, body)
+        except asyncio.CancelledError:
+            # Shutdown during a write, the final flush sends them again. A point
+            # written twice is harmless, same series and timestamp overwrite.
+            self._lines = lines + self._lines
+            raise
+        except urllib.error.HTTPError as e:
+            self.failures += 1
+            if e.code == 400:
+                # Rejected line protocol does not get better with retries
+                logger.warning("InfluxDB rejected %d points: %s", len(lines), e.read()[:200].decode('utf-8', 'replace'))
+                self.dropped += len(lines)
+                return
+            logger.warning("InfluxDB write of %d points failed: HTTP %s", len(lines), e.code)
+            self._lines = lines + self._lines
+            return
+        except (urllib.error.URLError, OSError) as e:
+            self.failures += 1
+            logger.warning("InfluxDB write of %d points failed: %s", len(lines), e)
+            self._lines = lines + self._lines
+            return
+        self.requests += 1
+        self.bytes_sent += len(body)
+        self.points_written += len(lines)
+
+    async def run(self):
+        """Flush every flush_interval until cancelled"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'points': self.points_written,
+            'requests': self.requests,
+            'bytes': self.bytes_sent,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'buffered': len(self._lines) + len(self._points),
+        }
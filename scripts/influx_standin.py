@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+InfluxDB Write API Stand-in
+
+Minimal asyncio HTTP server that accepts InfluxDB v2 line-protocol writes for
+benchmarks and offline runs. It does not store anything, it decodes the
+requests and counts what would have been written.
+
+Usage:
+    python influx_standin.py --port 8086 --print
+
+Features:
+- POST /api/v2/write with plain or gzip request bodies, answers 204
+- Counts requests, points, fields and bytes before and after decompression
+- Optionally prints every received line
+"""
+
+import asyncio
+import argparse
+import gzip
+from typing import Dict, List, Optional
+
+
+def count_fields(line: str) -> int:
+    """Number of fields of a line protocol point, commas inside quoted strings excluded"""
+    fields = 1
+    quoted = escaped = False
+    # Skip the measurement and tag set, fields start after the first unescaped space
+    start = 0
+    while True:
+        start = line.index(' ', start)
+        if line[start - 1] != '\\':
+            break
+        start += 1
+    for char in line[start + 1:line.rindex(' ')]:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            fields += 1
+    return fields
+
+
+class InfluxStandin:
+    def __init__(self, print_lines: bool = False):
+        self.print_lines = print_lines
+        self.lines: List[str] = []
+        self.requests = 0
+        self.points = 0
+        self.fields = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'requests': self.requests,
+            'points': self.points,
+            'fields': self.fields,
+            'bytes_received': self.bytes_received,
+            'bytes_decoded': self.bytes_decoded,
+        }
+
+    def _handle_write(self, headers: Dict[str, str], body: bytes):
+        self.requests += 1
+        self.bytes_received += len(body)
+        if headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.bytes_decoded += len(body)
+        for line in body.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            self.points += 1
+            self.fields += count_fields(line)
+            if self.print_lines:
+                print(line)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'POST' and path.startswith('/api/v2/write'):
+                    try:
+                        self._handle_write(headers, body)
+                        status = '204 No Content'
+                    except (OSError, ValueError, EOFError):
+                        status = '400 Bad Request'
+                else:
+                    status = '404 Not Found'
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8086) -> int:
+        """Start listening, return the bound port"""
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def serve(standin: InfluxStandin, host: str, port: int):
+    port = await standin.start(host, port)
+    print(f"📈 InfluxDB write stand-in listening on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a minimal InfluxDB write API stand-in')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8086, help='Port to listen on')
+    parser.add_argument('--print', action='store_true', dest='print_lines', help='Print every received line')
+
+    args = parser.parse_args()
+
+    standin = InfluxStandin(args.print_lines)
+    try:
+        asyncio.run(serve(standin, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n📊 {standin.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Prometheus / OpenMetrics metrics for the bridge and the discovery scripts
+
+Small dependency-free metrics registry. The bridge serves it over HTTP for
+Prometheus to scrape, the short-lived discovery scripts write it to a file
+for the node_exporter textfile collector.
+
+Usage:
+    registry = MetricsRegistry()
+    cycles = registry.histogram('bartl_poll_cycle_duration_seconds', 'Duration of a poll cycle')
+    cycles.observe(0.42)
+    await MetricsServer(registry).start('0.0.0.0', 9105)     # GET /metrics
+    write_textfile(registry, '/data/metrics/discovery.prom')
+
+Features:
+- Counter, gauge, summary (sum and count) and histogram, all with labels
+- Values can come from a callback, read at scrape time
+- Prometheus text format 0.0.4, OpenMetrics 1.0 when the scraper asks for it
+"""
+
+import asyncio
+import bisect
+import math
+import os
+from typing import Dict, Callable, List, Optional, Sequence, Tuple
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Seconds a client gets to send its request line and headers
+REQUEST_TIMEOUT = 5.0
+
+# Seconds, from a single Modbus request up to a slow poll cycle
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *labels: str):
+        """Read the value from function at scrape time"""
+        self._functions[tuple(labels)] = function
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        """(suffix, label values, value) per sample"""
+        return [('', labels, function()) for labels, function in self._functions.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        # The family name has no _total suffix, the samples have
+        super().__init__(name[:-len('_total')] if name.endswith('_total') else name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        return [('_total', labels, value) for labels, value in self._values.items()] + \
+               [('_total', labels, function()) for labels, function in self._functions.items()]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        return [('', labels, value) for labels, value in self._values.items()] + super().samples()
+
+
+class Summary(Metric):
+    """Sum and count only, cheap enough for one series per read span"""
+
+    kind = 'summary'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0.0, 0]
+        entry[0] += value
+        entry[1] += 1
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        samples = []
+        for labels, (total, count) in self._values.items():
+            samples += [('_sum', labels, total), ('_count', labels, count)]
+        return samples
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> per bucket counts (not cumulative) + overflow, sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        samples = []
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', labels + (format_value(bound),), cumulative))
+            samples += [('_sum', labels, total[0]), ('_count', labels, cumulative)]
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def summary(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Summary:
+        return self._register(Summary(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Return all metrics in the text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            samples = metric.samples()
+            if not samples:
+                continue
+            kind = 'unknown' if openmetrics and metric.kind == 'untyped' else metric.kind
+            # The 0.0.4 text format names a counter family with its _total suffix
+            family = metric.name if openmetrics or metric.kind != 'counter' else f"{metric.name}_total"
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {kind}")
+            for suffix, labels, value in samples:
+                names = metric.label_names + (('le',) if suffix == '_bucket' else ())
+                lines.append(f"{metric.name}{suffix}{format_labels(names, labels)} {format_value(value)}")
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+def write_textfile(registry: MetricsRegistry, path: str):
+    """Write the metrics for the node_exporter textfile collector, atomically"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(temp, path)
+
+
+class MetricsServer:
+    """Serves GET /metrics from a registry"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Tuple[bytes, Dict[str, str]]:
+        """Return the request line and the headers with lower case names"""
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return request_line, headers
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # A client that never finishes its request must not hold the connection open
+            request_line, headers = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            if method != 'GET' or path.split('?')[0] not in ('/metrics', '/'):
+                status, content_type, body = '404 Not Found', 'text/plain', b''
+            else:
+                openmetrics = 'application/openmetrics-text' in headers.get('accept', '')
+                status = '200 OK'
+                content_type = OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE
+                body = self.registry.render(openmetrics).encode('utf-8')
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '0.0.0.0', port: int = 9105) -> int:
+        """Start listening, return the bound port"""
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
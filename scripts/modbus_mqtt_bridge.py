@@ -0,0 +1,773 @@
+#!/usr/bin/env python3
+"""
+Native asyncio Modbus to MQTT bridge
+
+This script reads a modbus4mqtt YAML configuration file, polls the configured
+registers over one persistent Modbus TCP connection and publishes the values
+over one persistent MQTT connection. It is a drop-in replacement for the
+modbus4mqtt container and accepts the same command line options.
+
+Usage:
+    python modbus_mqtt_bridge.py --hostname your-mqtt-host --config path/to/config.yml --mqtt_topic_prefix bartl_wp
+
+Features:
+- Reads the modbus4mqtt YAML schema (pub_topic, set_topic, address, value_map, scale, pub_only_on_change, ...)
+- Reads contiguous register spans (read_spans from plan_read_spans.py, otherwise scan_batching)
+- Registers sharing an address are read and decoded once, each topic keeps its own scale and value_map
+- Per-register and per-group update_rate tiers, due tiers are merged into shared reads
+- Deadband and heartbeat publish filter with suppression counters
+- Reading, decoding and publishing run as a pipeline so a slow publish never delays the next poll
+- Writes values received on set_topic back to the controller, debounced per register and
+  coalesced into multi-register writes with one read-back
+- Optional batched, gzip compressed InfluxDB line-protocol sink, one point per device group and poll
+- Optional per-cycle JSON snapshots per top-level group and for the whole device, with the
+  last value of every register and the read time of values from earlier cycles
+- Optional Prometheus / OpenMetrics endpoint (--metrics-port) for the poll, write and publish paths
+- Request pacing from calibrate_modbus.py, backs off when the controller answers busy or slows down
+- Optional pipelined reads, several requests in flight on the one connection
+"""
+
+import asyncio
+import argparse
+import bisect
+import json
+import logging
+import signal
+import struct
+import sys
+import time
+from collections import deque
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from generate_telegraf_config import STRING_TOPIC_PREFIXES
+from influx_sink import DEFAULT_FLUSH_INTERVAL, InfluxLineSink
+from metrics import MetricsRegistry, MetricsServer
+from modbus_tcp import (AsyncModbusTcpClient, ModbusError, MAX_READ_REGISTERS, DEFAULT_MAX_REQUEST_GAP,
+                        DEFAULT_MAX_WRITE_BURST, POLL_LANE, WRITE_LANE, RequestPacer)
+from plan_read_spans import DEFAULT_SCAN_BATCHING, DEFAULT_TABLE, TYPE_WIDTHS, plan_spans
+from poll_scheduler import PollScheduler, resolve_update_rate
+from publish_filter import PublishFilter, resolve_deadband
+from register_model import duplicate_addresses, load_config
+from write_coalescer import DEFAULT_DEBOUNCE, DEFAULT_MAX_DELAY, WriteBatch, WriteCoalescer
+
+logger = logging.getLogger('modbus_mqtt_bridge')
+
+DEFAULT_UPDATE_RATE = 5
+DEFAULT_UNIT = 1
+DEFAULT_SNAPSHOT_TOPIC = 'snapshot'
+PUBLISH_QUEUE_SIZE = 1000
+STATS_INTERVAL = 300
+
+SIGNED_TYPES = {'int16', 'int32', 'int64'}
+FLOAT_FORMATS = {'float': '>f', 'double': '>d'}
+
+
+class Register:
+    """A single register entry of a modbus4mqtt configuration"""
+
+    def __init__(self, entry: Dict[str, Any], address_offset: int = 0,
+                 update_rate: float = DEFAULT_UPDATE_RATE, deadband: Optional[tuple] = None):
+        self.entry = entry
+        self.pub_topic = entry['pub_topic']
+        self.set_topic = entry.get('set_topic')
+        self.address = int(entry['address']) + address_offset
+        self.table = entry.get('table', DEFAULT_TABLE)
+        self.type = entry.get('type', 'uint16')
+        self.width = TYPE_WIDTHS.get(self.type, 1)
+        self.word_order = entry.get('word_order', 'highlow')
+        self.mask = entry.get('mask')
+        self.scale = entry.get('scale', 1)
+        self.decimals = max(0, -Decimal(str(self.scale)).as_tuple().exponent)
+        self.value_map = entry.get('value_map') or {}
+        self.reverse_map = {value: state for state, value in self.value_map.items()}
+        self.pub_only_on_change = entry.get('pub_only_on_change', True)
+        self.retain = entry.get('retain', False)
+        self.update_rate = update_rate
+        self.deadband = deadband
+        # Device group and field key in InfluxDB, heizkreis + temperatur/vorlauf/istwert
+        self.group, _, self.field = self.pub_topic.partition('/')
+        self.field = self.field or 'value'
+        self.is_text = bool(self.value_map) or self.pub_topic.startswith(STRING_TOPIC_PREFIXES)
+        # Registers with the same key decode to the same raw value
+        self.decode_key = (self.table, self.address, self.type, self.word_order, self.mask)
+
+    def json_value(self, payload: str):
+        """Payload as JSON value, mapped and text registers stay strings"""
+        if self.is_text:
+            return payload
+        value = float(payload)
+        return int(value) if value.is_integer() and '.' not in payload else value
+
+    def decode(self, words: List[int], index: int = 0):
+        """Decode the raw register value from a block of read words"""
+        chunk = words[index:index + self.width]
+        if self.word_order == 'lowhigh':
+            chunk = chunk[::-1]
+        raw = 0
+        for word in chunk:
+            raw = (raw << 16) | word
+
+        if self.type in FLOAT_FORMATS:
+            return struct.unpack(FLOAT_FORMATS[self.type], raw.to_bytes(2 * self.width, 'big'))[0]
+        if self.mask is not None:
+            raw &= self.mask
+        if self.type in SIGNED_TYPES and raw >= 1 << (16 * self.width - 1):
+            raw -= 1 << (16 * self.width)
+        return raw
+
+    def format(self, raw) -> str:
+        """Apply value_map and scale and return the MQTT payload"""
+        if raw in self.reverse_map:
+            return str(self.reverse_map[raw])
+        if self.scale != 1:
+            raw = round(raw * self.scale, self.decimals)
+        return str(raw)
+
+    def encode(self, payload: str) -> List[int]:
+        """Convert a set_topic payload into register words"""
+        text = payload.strip()
+        if self.value_map:
+            if text in self.value_map:
+                value = self.value_map[text]
+            elif text in {str(raw) for raw in self.reverse_map}:
+                # Discovery command templates send the raw value of the selected option
+                value = float(text)
+            else:
+                raise ValueError(f"'{text}' is not one of {list(self.value_map)}")
+        else:
+            value = float(text) / self.scale
+
+        if self.type in FLOAT_FORMATS:
+            raw = int.from_bytes(struct.pack(FLOAT_FORMATS[self.type], value), 'big')
+        else:
+            raw = int(round(value)) & ((1 << (16 * self.width)) - 1)
+
+        words = [(raw >> (16 * shift)) & 0xFFFF for shift in reversed(range(self.width))]
+        return words[::-1] if self.word_order == 'lowhigh' else words
+
+
+class ReadSpan:
+    """A contiguous block of registers fetched with a single Modbus request"""
+
+    def __init__(self, table: str, start: int, count: int):
+        self.table = table
+        self.start = start
+        self.count = count
+        self.registers: List[Register] = []
+        # decode_key -> registers sharing one decoded raw value
+        self.decode_groups: Dict[tuple, List[Register]] = {}
+
+    def add(self, register: Register):
+        self.registers.append(register)
+        self.decode_groups.setdefault(register.decode_key, []).append(register)
+
+    @property
+    def label(self) -> str:
+        """Address range for metrics, holding:0-31"""
+        return f"{self.table}:{self.start}-{self.start + self.count - 1}"
+
+    def contains(self, register: Register) -> bool:
+        return (register.table == self.table and self.start <= register.address
+                and register.address + register.width <= self.start + self.count)
+
+
+def load_registers(config: Dict[str, Any]) -> List[Register]:
+    """Create Register objects for all publishable entries of a config"""
+    offset = int(config.get('address_offset', 0))
+    default_rate = config.get('update_rate', DEFAULT_UPDATE_RATE)
+    patterns = config.get('update_rates') or {}
+    filter_config = config.get('publish_filter')
+    if filter_config is not None and not isinstance(filter_config, dict):
+        filter_config = {}
+    registers = []
+    for entry in config['registers']:
+        if 'pub_topic' not in entry or 'address' not in entry:
+            continue
+        if 'json_key' in entry:
+            logger.warning("json_key is not supported, skipping %s (%s)", entry['pub_topic'], entry['json_key'])
+            continue
+        registers.append(Register(entry, offset, resolve_update_rate(entry, patterns, default_rate),
+                                  resolve_deadband(entry, filter_config)))
+    return registers
+
+
+def build_read_plan(registers: List[Register], config: Dict[str, Any]) -> List[ReadSpan]:
+    """Assign every register to a read span
+
+    Spans listed under read_spans are used as they are. Addresses they do not
+    cover are grouped into contiguous runs of at most scan_batching registers,
+    which never reads an address that is not configured.
+    """
+    offset = int(config.get('address_offset', 0))
+    max_span = max(1, min(int(config.get('scan_batching', DEFAULT_SCAN_BATCHING)), MAX_READ_REGISTERS))
+    configured = config.get('read_spans') or {}
+
+    tables: Dict[str, set] = {}
+    for register in registers:
+        tables.setdefault(register.table, set()).update(range(register.address, register.address + register.width))
+
+    spans = []
+    for table, addresses in tables.items():
+        remaining = set(addresses)
+        for start, count in configured.get(table, []):
+            start += offset
+            covered = {address for address in remaining if start <= address < start + count}
+            if covered:
+                spans.append(ReadSpan(table, start, count))
+                remaining -= covered
+        for start, count in plan_spans(sorted(remaining), 0, max_span):
+            spans.append(ReadSpan(table, start, count))
+
+    spans.sort(key=lambda span: (span.table, span.start))
+    starts = {table: [span.start for span in spans if span.table == table] for table in tables}
+    offsets = {table: next(i for i, span in enumerate(spans) if span.table == table) for table in tables}
+    extra = []
+    for register in registers:
+        index = offsets[register.table] + bisect.bisect_right(starts[register.table], register.address) - 1
+        span = spans[index] if index >= offsets[register.table] else None
+        if span is None or not span.contains(register):
+            # Register straddles a span boundary, give it its own request
+            span = ReadSpan(register.table, register.address, register.width)
+            extra.append(span)
+        span.add(register)
+
+    return sorted((span for span in spans + extra if span.registers), key=lambda span: (span.table, span.start))
+
+
+class ModbusMqttBridge:
+    def __init__(self, config: Dict[str, Any], mqtt_host: str, mqtt_port: int = 1883,
+                 mqtt_user: str = None, mqtt_password: str = None, topic_prefix: str = '',
+                 use_tls: bool = False, influx: Optional[InfluxLineSink] = None,
+                 metrics_port: Optional[int] = None, metrics_host: str = '0.0.0.0'):
+        self.config = config
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.mqtt_user = mqtt_user
+        self.mqtt_password = mqtt_password
+        self.topic_prefix = topic_prefix.rstrip('/')
+        self.use_tls = use_tls
+        self.influx = influx
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+
+        self.registers = load_registers(config)
+        self.shared_addresses = self.share_addresses(self.registers)
+        self.read_plan = build_read_plan(self.registers, config)
+        self.scheduler = PollScheduler(self.registers, lambda registers: build_read_plan(registers, config))
+        self.set_topics = {self.full_topic(r.set_topic): r for r in self.registers if r.set_topic}
+
+        # writes: {debounce: 0.3, max_delay: 1.0, max_burst: 8}
+        writes = config.get('writes') or {}
+        # pacing: {request_gap: 0.01, max_request_gap: 1.0, latency: 0.012, pipeline_depth: 4}
+        # calibrate_modbus.py writes the first three, pipeline_depth is only set by hand
+        pacing = config.get('pacing') or {}
+        self.pacer = RequestPacer(float(pacing.get('request_gap', 0.0)),
+                                  float(pacing.get('max_request_gap', DEFAULT_MAX_REQUEST_GAP)),
+                                  float(pacing['latency']) if pacing.get('latency') else None)
+        self.modbus = AsyncModbusTcpClient(config['ip'], int(config.get('port', 502)),
+                                           int(config.get('unit', DEFAULT_UNIT)),
+                                           max_write_burst=int(writes.get('max_burst', DEFAULT_MAX_WRITE_BURST)),
+                                           pacer=self.pacer, pipeline_depth=int(pacing.get('pipeline_depth', 1)))
+        self.mqtt = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        heartbeat = (config.get('publish_filter') or {}).get('heartbeat')
+        self.publish_filter = PublishFilter(float(heartbeat) if heartbeat else None)
+
+        # snapshots: true or {topic: snapshot, retain: false}
+        snapshots = config.get('snapshots')
+        if snapshots and not isinstance(snapshots, dict):
+            snapshots = {}
+        self.snapshot_topic = self.full_topic(snapshots.get('topic', DEFAULT_SNAPSHOT_TOPIC)) \
+            if isinstance(snapshots, dict) else None
+        self.snapshot_retain = bool(snapshots.get('retain', False)) if isinstance(snapshots, dict) else False
+        # group -> field -> last value read in a poll cycle, and the poll timestamp it was read at
+        self.snapshot: Dict[str, Dict[str, Any]] = {}
+        self.snapshot_read: Dict[str, Dict[str, float]] = {}
+        # Groups with values read in the current poll cycle
+        self.snapshot_groups = set()
+        self.snapshots_published = 0
+        self.last_cycle_duration = 0.0
+
+        self.writes = WriteCoalescer(float(writes.get('debounce', DEFAULT_DEBOUNCE)),
+                                     float(writes.get('max_delay', DEFAULT_MAX_DELAY)))
+        self.write_wakeup: Optional[asyncio.Event] = None
+
+        self.metrics = MetricsRegistry()
+        self._create_metrics()
+
+    def _create_metrics(self):
+        """Register the bridge metrics, counters kept elsewhere are read at scrape time"""
+        metrics = self.metrics
+        self.cycle_duration = metrics.histogram('modbus_bridge_poll_cycle_duration_seconds',
+                                                'Duration of a poll cycle', ('tiers',))
+        self.read_duration = metrics.histogram('modbus_bridge_read_duration_seconds',
+                                               'Duration of a Modbus read request including the wait for the connection')
+        self.span_duration = metrics.summary('modbus_bridge_span_read_duration_seconds',
+                                             'Duration of the Modbus read requests per read span', ('span',))
+        self.read_errors = metrics.counter('modbus_bridge_read_errors_total',
+                                           'Failed Modbus read requests per read span', ('span', 'error'))
+        self.confirmation_latency = metrics.histogram('modbus_bridge_write_confirmation_seconds',
+                                                      'Time from the last set command to the read-back confirming it')
+        self.mqtt_published = metrics.counter('modbus_bridge_mqtt_messages_total',
+                                              'MQTT messages handed to the client')
+        self.mqtt_sent = metrics.counter('modbus_bridge_mqtt_messages_sent_total',
+                                         'MQTT messages written to the broker connection')
+        metrics.gauge('modbus_bridge_publish_queue_depth',
+                      'Read results waiting for the publish stage').set_function(
+            lambda: self.queue.qsize() if self.queue else 0)
+        suppressed = metrics.counter('modbus_bridge_values_suppressed_total',
+                                     'Values not published by the deadband filter')
+        suppressed.set_function(lambda: self.publish_filter.suppressed)
+        metrics.counter('modbus_bridge_heartbeats_total', 'Unchanged values re-published by the heartbeat') \
+            .set_function(lambda: self.publish_filter.heartbeats)
+        metrics.counter('modbus_bridge_snapshots_total', 'Snapshot messages published') \
+            .set_function(lambda: self.snapshots_published)
+
+        writes = metrics.counter('modbus_bridge_write_commands_total', 'Set commands by outcome', ('outcome',))
+        writes.set_function(lambda: self.writes.commands - self.writes.superseded, 'written')
+        writes.set_function(lambda: self.writes.superseded, 'superseded')
+        write_requests = metrics.counter('modbus_bridge_write_requests_total', 'Modbus write requests by result',
+                                         ('result',))
+        write_requests.set_function(lambda: self.writes.requests, 'ok')
+        write_requests.set_function(lambda: self.writes.failures, 'failed')
+        lanes = metrics.counter('modbus_bridge_lane_requests_total', 'Modbus requests per lane', ('lane',))
+        lanes.set_function(lambda: self.modbus.lane_stats()['write_requests'], 'write')
+        lanes.set_function(lambda: self.modbus.lane_stats()['poll_requests'], 'poll')
+        metrics.counter('modbus_bridge_polls_preempted_total', 'Poll reads that waited for a write') \
+            .set_function(lambda: self.modbus.lane_stats()['preempted'])
+        metrics.counter('modbus_bridge_polls_forced_total', 'Poll reads let through by the write burst limit') \
+            .set_function(lambda: self.modbus.lane_stats()['forced_polls'])
+        metrics.gauge('modbus_bridge_request_gap_seconds', 'Current gap between a response and the next request') \
+            .set_function(lambda: self.pacer.gap)
+        backoffs = metrics.counter('modbus_bridge_request_backoffs_total', 'Widenings of the request gap by cause',
+                                   ('cause',))
+        backoffs.set_function(lambda: self.pacer.error_backoffs, 'error')
+        backoffs.set_function(lambda: self.pacer.latency_backoffs, 'latency')
+        metrics.gauge('modbus_bridge_pipeline_depth', 'Modbus requests allowed in flight') \
+            .set_function(lambda: self.modbus.depth)
+        metrics.counter('modbus_bridge_pipeline_fallbacks_total', 'Fallbacks to one request at a time') \
+            .set_function(lambda: self.modbus.pipeline_fallbacks)
+        if self.influx:
+            influx = metrics.counter('modbus_bridge_influx_total', 'InfluxDB sink counters', ('counter',))
+            for key in ('points', 'requests', 'bytes', 'failures', 'dropped'):
+                influx.set_function(lambda key=key: self.influx.stats()[key], key)
+
+    @staticmethod
+    def share_addresses(registers: List[Register]) -> Dict[tuple, List[Register]]:
+        """Group the registers of duplicate_addresses and give each group one update_rate
+
+        All registers of an address move to the fastest update_rate among them.
+        The address is read at that rate anyway, so every topic gets the value
+        of the same read instead of a slower tier reading it again.
+        """
+        by_entry = {id(register.entry): register for register in registers}
+        shared = {}
+        for (table, _), entries in duplicate_addresses([r.entry for r in registers], DEFAULT_TABLE).items():
+            group = [by_entry[id(entry)] for entry in entries]
+            update_rate = min(register.update_rate for register in group)
+            for register in group:
+                register.update_rate = update_rate
+            # Keyed by the address with address_offset, like the read spans
+            shared[(table, group[0].address)] = group
+        return shared
+
+    def full_topic(self, topic: str) -> str:
+        """Prefix a topic with the configured MQTT topic prefix"""
+        return f"{self.topic_prefix}/{topic}" if self.topic_prefix else topic
+
+    def start_mqtt(self):
+        """Connect to the MQTT broker and start the network loop thread"""
+        import paho.mqtt.client as mqtt
+
+        self.mqtt = mqtt.Client()
+        if self.mqtt_user and self.mqtt_password:
+            self.mqtt.username_pw_set(self.mqtt_user, self.mqtt_password)
+        if self.use_tls:
+            self.mqtt.tls_set()
+        self.mqtt.on_connect = self._on_connect
+        self.mqtt.on_message = self._on_message
+        self.mqtt.on_publish = self._on_publish
+        self.mqtt.connect_async(self.mqtt_host, self.mqtt_port, 60)
+        self.mqtt.loop_start()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error("Failed to connect to MQTT broker (rc=%s)", rc)
+            return
+        logger.info("Connected to MQTT broker at %s:%s", self.mqtt_host, self.mqtt_port)
+        for topic in self.set_topics:
+            client.subscribe(topic)
+
+    def _on_publish(self, client, userdata, mid):
+        # QoS 0: the message left the client, the broker sends no acknowledgement
+        self.mqtt_sent.inc()
+
+    def _on_message(self, client, userdata, msg):
+        # Runs in the paho network thread, hand over to the event loop
+        self.loop.call_soon_threadsafe(self._schedule_write, msg.topic, msg.payload.decode('utf-8', 'replace'))
+
+    def _schedule_write(self, topic: str, payload: str):
+        register = self.set_topics.get(topic)
+        if register is None:
+            return
+        try:
+            words = register.encode(payload)
+        except ValueError as e:
+            logger.warning("Failed to write '%s' to %s: %s", payload, register.set_topic, e)
+            return
+        self.writes.add(register, payload, words, self.loop.time())
+        self.write_wakeup.set()
+
+    async def write_loop(self):
+        """Write pending commands once they are due"""
+        while True:
+            due = self.writes.due_at()
+            if due is None or due > self.loop.time():
+                # A new command can move the due time, wait for either
+                timeout = None if due is None else due - self.loop.time()
+                try:
+                    await asyncio.wait_for(self.write_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.write_wakeup.clear()
+                continue
+            for batch in self.writes.take(self.loop.time()):
+                # Write and read-back back to back, a poll waits until both are done
+                async with self.modbus.exclusive(WRITE_LANE):
+                    await self.write(batch)
+
+    async def write(self, batch: WriteBatch):
+        """Write a batch of set_topic commands to the controller and confirm it with a read-back
+
+        A write counts as confirmed once the read-back returns the written
+        words. The controller may clamp or ignore a value, then the value it
+        kept is published and the write counts as failed.
+        """
+        try:
+            if len(batch.words) == 1:
+                await self.modbus.write_register(batch.start, batch.words[0])
+            else:
+                await self.modbus.write_registers(batch.start, batch.words)
+        except (ValueError, ModbusError, OSError, asyncio.TimeoutError, EOFError) as e:
+            self.writes.failures += 1
+            for pending in batch.writes:
+                logger.warning("Failed to write '%s' to %s: %s", pending.payload, pending.register.set_topic, e)
+            return
+
+        # Read the registers back right away, their tier may not be due for minutes.
+        # Topics sharing an address see the written value with the same read.
+        span = ReadSpan(batch.table, batch.start, len(batch.words))
+        for pending in batch.writes:
+            for register in self.shared_addresses.get((batch.table, pending.register.address), [pending.register]):
+                self.publish_filter.invalidate(register.pub_topic)
+                span.count = max(span.count, register.address + register.width - span.start)
+                span.add(register)
+        try:
+            words = await self.read_span(span, WRITE_LANE)
+        except (OSError, asyncio.TimeoutError, EOFError) as e:
+            self.read_errors.inc(1, span.label, 'timeout' if isinstance(e, asyncio.TimeoutError) else 'connection')
+            words = None
+        if words is None:
+            self.writes.failures += 1
+            for pending in batch.writes:
+                logger.warning("Wrote '%s' to %s, the read-back failed", pending.payload, pending.register.set_topic)
+            return
+
+        # Only this read was issued after the write completed, a poll value
+        # queued before it may still be the old one
+        read_back = self.loop.time()
+        confirmed = []
+        for pending in batch.writes:
+            offset = pending.register.address - batch.start
+            kept = words[offset:offset + len(pending.words)]
+            if kept == pending.words:
+                confirmed.append(pending)
+                latency = read_back - pending.last_received
+                self.writes.record_latency(latency)
+                self.confirmation_latency.observe(latency)
+                logger.info("Wrote '%s' to %s", pending.payload, pending.register.set_topic)
+            else:
+                logger.warning("Wrote '%s' to %s, the controller kept '%s'", pending.payload,
+                               pending.register.set_topic, pending.register.format(pending.register.decode(kept)))
+        if len(confirmed) < len(batch.writes):
+            self.writes.failures += 1
+        else:
+            self.writes.requests += 1
+            self.writes.registers_written += len(batch.words)
+        self.queue_words(span, words, None)
+
+    async def read_span(self, span: ReadSpan, lane: int) -> Optional[List[int]]:
+        """Read one span, None after a Modbus exception or a malformed response. Connection errors are raised."""
+        started = self.loop.time()
+        try:
+            words = await self.modbus.read_registers(span.start, span.count, span.table, lane)
+        except (ModbusError, ValueError) as e:
+            self.read_errors.inc(1, span.label, 'exception')
+            logger.warning("Read of %s %d-%d failed: %s", span.table, span.start, span.start + span.count - 1, e)
+            return None
+        duration = self.loop.time() - started
+        self.read_duration.observe(duration)
+        self.span_duration.observe(duration, span.label)
+        return words
+
+    def queue_words(self, span: ReadSpan, words: Optional[List[int]], timestamp: Optional[float]) -> bool:
+        """Hand read words to the publish stage, False if there were none or the queue is full"""
+        if words is None:
+            return False
+        try:
+            self.queue.put_nowait((span, words, timestamp))
+        except asyncio.QueueFull:
+            logger.warning("Publish queue full, dropping values of %s %d", span.table, span.start)
+            return False
+        return True
+
+    async def poll_once(self, read_plan: List[ReadSpan]):
+        """Read the spans of a poll cycle once and hand the raw words to the publish stage
+
+        The cycle ends with a marker so the publish stage can send the
+        snapshots. Read-backs after a write carry no timestamp, they only go
+        to MQTT and never mix into a cycle's snapshot.
+
+        With pipelining the reads run as tasks, up to the client's depth at a
+        time, and are queued in plan order.
+        """
+        # One timestamp per cycle, the InfluxDB sink merges its values into one point per group
+        timestamp = time.time()
+        reads = deque()
+        span = None
+        try:
+            for span in read_plan:
+                if self.modbus.depth == 1 and not reads:
+                    self.queue_words(span, await self.read_span(span, POLL_LANE), timestamp)
+                    continue
+                reads.append((span, self.loop.create_task(self.read_span(span, POLL_LANE))))
+                while len(reads) >= self.modbus.depth:
+                    span, task = reads.popleft()
+                    self.queue_words(span, await task, timestamp)
+            while reads:
+                span, task = reads.popleft()
+                self.queue_words(span, await task, timestamp)
+        except (OSError, asyncio.TimeoutError, EOFError) as e:
+            self.read_errors.inc(1, span.label, 'timeout' if isinstance(e, asyncio.TimeoutError) else 'connection')
+            logger.warning("Modbus connection to %s:%s failed: %s", self.modbus.host, self.modbus.port, e)
+        finally:
+            for _, task in reads:
+                task.cancel()
+            # Retrieve the errors of reads that failed along with the connection
+            await asyncio.gather(*(task for _, task in reads), return_exceptions=True)
+        if self.snapshot_topic:
+            try:
+                self.queue.put_nowait((None, None, timestamp))
+            except asyncio.QueueFull:
+                logger.warning("Publish queue full, dropping the snapshots of this cycle")
+
+    async def poll_loop(self):
+        """Poll every tier at its own update_rate"""
+        self.scheduler.start(self.loop.time())
+        next_stats = self.loop.time() + STATS_INTERVAL
+        depth = self.modbus.depth
+        while True:
+            delay = self.scheduler.next_wakeup() - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            started = self.loop.time()
+            rates = self.scheduler.due(started)
+            await self.poll_once(self.scheduler.plan(rates))
+            self.last_cycle_duration = self.loop.time() - started
+            self.cycle_duration.observe(self.last_cycle_duration, ','.join(f"{rate:g}" for rate in rates))
+            logger.debug("Poll of tiers %s took %.3f s", rates, self.last_cycle_duration)
+            self.scheduler.advance(rates, self.loop.time())
+            if self.modbus.depth != depth:
+                depth = self.modbus.depth
+                logger.warning("Modbus device failed with pipelined requests in flight, "
+                               "sending one request at a time from now on")
+
+            if self.loop.time() >= next_stats:
+                next_stats += STATS_INTERVAL
+                logger.info("Publish filter: %(published)d published (%(heartbeats)d heartbeats), "
+                            "%(suppressed)d suppressed (%(suppressed_percent)d%%)", self.publish_filter.stats())
+                if self.influx:
+                    logger.info("InfluxDB: %(points)d points in %(requests)d requests (%(bytes)d bytes), "
+                                "%(failures)d failures, %(dropped)d dropped, %(buffered)d buffered",
+                                self.influx.stats())
+                if self.pacer.error_backoffs or self.pacer.latency_backoffs:
+                    logger.info("Modbus pacing: gap %(gap_ms)s ms (calibrated %(base_gap_ms)s ms), latency "
+                                "%(latency_ms)s ms (baseline %(baseline_ms)s ms), %(error_backoffs)d backoffs "
+                                "after errors, %(latency_backoffs)d after slow responses", self.pacer.stats())
+                if self.writes.commands:
+                    logger.info("Writes: %(commands)d commands (%(superseded)d superseded) in %(requests)d requests, "
+                                "%(failures)d failures, confirmed p50 %(latency_p50_ms)s ms, p99 %(latency_p99_ms)s ms",
+                                self.writes.stats())
+                    logger.info("Modbus lanes: %(write_requests)d write lane, %(poll_requests)d poll requests, "
+                                "%(preempted)d polls preempted, %(forced_polls)d forced", self.modbus.lane_stats())
+
+    def publish_span(self, span: ReadSpan, words: List[int], timestamp: Optional[float] = None):
+        """Decode the registers of a span and publish their payloads"""
+        now = self.loop.time()
+        for registers in span.decode_groups.values():
+            # Decoded once, formatted per topic with its own scale and value_map
+            raw = registers[0].decode(words, registers[0].address - span.start)
+            for register in registers:
+                payload = register.format(raw)
+                if self.influx and timestamp is not None:
+                    # Every value read in a cycle, the publish filter only saves MQTT messages
+                    self.influx.add(register.group, register.field,
+                                    payload if register.is_text else float(payload), timestamp)
+                if self.snapshot_topic and timestamp is not None:
+                    self.snapshot.setdefault(register.group, {})[register.field] = register.json_value(payload)
+                    self.snapshot_read.setdefault(register.group, {})[register.field] = timestamp
+                    self.snapshot_groups.add(register.group)
+                if not self.publish_filter.should_publish(register, payload, now):
+                    continue
+                self.mqtt.publish(self.full_topic(register.pub_topic), payload, retain=register.retain)
+                self.mqtt_published.inc()
+
+    def publish_snapshots(self, timestamp: float):
+        """Publish one JSON object per group read in this cycle and one for the whole device
+
+        Every snapshot carries the last value of each register of its groups.
+        Values not read in this cycle, from a slower tier or a failed read,
+        are listed under read_at with the timestamp of the cycle they are from.
+        """
+        if not self.snapshot_groups:
+            return
+        # group -> field -> timestamp of the values read before this cycle
+        read_at = {group: {field: round(read, 3) for field, read in fields.items() if read != timestamp}
+                   for group, fields in self.snapshot_read.items()}
+        timestamp = round(timestamp, 3)
+        for group, values in self.snapshot.items():
+            if group not in self.snapshot_groups:
+                continue
+            message = {'timestamp': timestamp, 'values': values}
+            if read_at[group]:
+                message['read_at'] = read_at[group]
+            payload = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+            self.mqtt.publish(f"{self.snapshot_topic}/{group}", payload, retain=self.snapshot_retain)
+        message = {'timestamp': timestamp, 'values': self.snapshot}
+        if any(read_at.values()):
+            message['read_at'] = {group: fields for group, fields in read_at.items() if fields}
+        payload = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+        self.mqtt.publish(self.snapshot_topic, payload, retain=self.snapshot_retain)
+        self.snapshots_published += len(self.snapshot_groups) + 1
+        self.mqtt_published.inc(len(self.snapshot_groups) + 1)
+        self.snapshot_groups.clear()
+
+    async def publish_loop(self):
+        """Consume read results and publish them"""
+        while True:
+            span, words, timestamp = await self.queue.get()
+            if span is None:
+                self.publish_snapshots(timestamp)
+            else:
+                self.publish_span(span, words, timestamp)
+            self.queue.task_done()
+
+    async def run(self) -> int:
+        """Run the bridge until SIGINT or SIGTERM, return the exit status
+
+        The bridge also stops when one of its tasks ends, with status 1, so
+        the container restart policy can start it again.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self.write_wakeup = asyncio.Event()
+        logger.info("Polling %d registers in %d requests, update rates %s s",
+                    len(self.registers), len(self.read_plan), sorted(self.scheduler.tiers))
+        if self.pacer.base_gap:
+            logger.info("Pacing Modbus requests %.0f ms apart", 1000 * self.pacer.base_gap)
+        if self.modbus.depth > 1:
+            logger.info("Pipelining up to %d Modbus requests", self.modbus.depth)
+        if self.shared_addresses:
+            logger.info("Reading %d shared addresses once for %d topics", len(self.shared_addresses),
+                        sum(len(group) for group in self.shared_addresses.values()))
+            for (table, address), group in sorted(self.shared_addresses.items()):
+                logger.debug("%s %d: %s", table, address, ', '.join(r.pub_topic for r in group))
+
+        self.start_mqtt()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, stop.set)
+
+        tasks = [self.loop.create_task(self.poll_loop(), name='poll loop'),
+                 self.loop.create_task(self.publish_loop(), name='publish loop'),
+                 self.loop.create_task(self.write_loop(), name='write loop')]
+        if self.influx:
+            logger.info("Writing to InfluxDB every %.0f s", self.influx.flush_interval)
+            tasks.append(self.loop.create_task(self.influx.run(), name='InfluxDB sink'))
+        metrics_server = None
+        if self.metrics_port is not None:
+            metrics_server = MetricsServer(self.metrics)
+            port = await metrics_server.start(self.metrics_host, self.metrics_port)
+            logger.info("Serving metrics on http://%s:%d/metrics", self.metrics_host, port)
+        stopped = self.loop.create_task(stop.wait())
+        done = set()
+        try:
+            done, _ = await asyncio.wait(tasks + [stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopped.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.influx:
+                await self.influx.flush()
+            if metrics_server:
+                await metrics_server.stop()
+            await self.modbus.close()
+            self.mqtt.loop_stop()
+            self.mqtt.disconnect()
+
+        failed = [task for task in tasks if task in done]
+        for task in failed:
+            logger.error("The %s stopped, exiting", task.get_name(), exc_info=task.exception())
+        return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bridge Modbus TCP registers to MQTT using a modbus4mqtt config')
+    parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
+    parser.add_argument('--hostname', default='localhost', help='MQTT broker hostname')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--username', help='MQTT username')
+    parser.add_argument('--password', help='MQTT password')
+    parser.add_argument('--mqtt_topic_prefix', default='modbus4mqtt', help='MQTT topic prefix')
+    parser.add_argument('--use_tls', action='store_true', help='Connect to the MQTT broker using TLS')
+    parser.add_argument('--log-level', default='INFO', help='Logging level')
+    parser.add_argument('--influx-url', help='InfluxDB base URL, enables the direct line-protocol sink')
+    parser.add_argument('--influx-token', default='', help='InfluxDB API token')
+    parser.add_argument('--influx-org', default='', help='InfluxDB organization')
+    parser.add_argument('--influx-bucket', default='', help='InfluxDB bucket')
+    parser.add_argument('--influx-flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help='Seconds between InfluxDB writes')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-host', default='0.0.0.0', help='Address for the metrics endpoint')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(message)s')
+
+    if not Path(args.config).exists():
+        print(f"Config file not found: {args.config}")
+        sys.exit(1)
+
+    try:
+        config = load_config(args.config)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    influx = None
+    if args.influx_url:
+        influx = InfluxLineSink(args.influx_url, args.influx_token, args.influx_org, args.influx_bucket,
+                                args.influx_flush_interval)
+
+    bridge = ModbusMqttBridge(config, args.hostname, args.port, args.username, args.password,
+                              args.mqtt_topic_prefix, args.use_tls, influx, args.metrics_port, args.metrics_host)
+    sys.exit(asyncio.run(bridge.run()))
+
+
+if __name__ == '__main__':
+    main()
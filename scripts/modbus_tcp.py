@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Asyncio Modbus TCP client
+
+Minimal Modbus TCP client used by the in-repo bridge. It keeps a single
+persistent connection to the controller and implements the function codes a
+modbus4mqtt configuration needs.
+
+Features:
+- Read holding and input registers (function codes 0x03 / 0x04)
+- Write single and multiple registers (function codes 0x06 / 0x10)
+- Transparent reconnect on the next request after a connection error
+- Modbus exception responses raised as ModbusError
+- Two priority lanes: writes and their read-backs go before queued polls at
+  the next request boundary, a bounded number of times in a row
+- exclusive() keeps the connection across several requests, e.g. a write
+  and its read-back
+- Optional pipelining: up to pipeline_depth requests in flight, responses
+  matched by transaction id in any order. Falls back to one request at a time
+  when the device drops, times out or answers busy with several in flight
+- Request pacing: a minimum gap between a response and the next request that
+  widens when the device answers busy, times out or slows down, and narrows
+  back to the calibrated gap once it recovers
+"""
+
+import asyncio
+import contextlib
+import struct
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+READ_FUNCTIONS = {
+    'holding': READ_HOLDING_REGISTERS,
+    'input': READ_INPUT_REGISTERS,
+}
+
+# Protocol limits for a single request
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+SERVER_DEVICE_BUSY = 0x06
+GATEWAY_TARGET_FAILED = 0x0B
+# Exceptions that mean the device is overloaded rather than the request wrong
+BUSY_EXCEPTIONS = (SERVER_DEVICE_BUSY, GATEWAY_TARGET_FAILED)
+
+# Transaction id, protocol id, length, unit id
+MBAP_HEADER = struct.Struct('>HHHB')
+
+# Request lanes, a lower number goes first
+WRITE_LANE = 0
+POLL_LANE = 1
+# Write lane requests in a row while a poll waits, then the poll goes
+DEFAULT_MAX_WRITE_BURST = 8
+
+# Request pacing: the gap doubles on every backoff, at least to MIN_BACKOFF_GAP,
+# and shrinks by RECOVERY per normal response until it is back at the base gap
+DEFAULT_MAX_REQUEST_GAP = 1.0
+MIN_BACKOFF_GAP = 0.01
+RECOVERY = 0.9
+# Smoothed latency above LATENCY_FACTOR * baseline + LATENCY_SLACK counts as slow,
+# at most one latency backoff per LATENCY_HOLD responses
+LATENCY_FACTOR = 2.0
+LATENCY_SLACK = 0.005
+LATENCY_HOLD = 8
+SMOOTHING = 0.2
+# The baseline follows a lasting rise in latency this slowly
+BASELINE_DRIFT = 0.01
+
+
+class ModbusError(Exception):
+    """Raised when the device answers with a Modbus exception response"""
+
+    def __init__(self, function: int, code: int):
+        super().__init__(f"Modbus exception {code} for function 0x{function:02x}")
+        self.function = function
+        self.code = code
+
+
+class LaneLock:
+    """Request slots on the connection, handed to the write lane first
+
+    capacity requests may be in flight at once, 1 unless requests are
+    pipelined. A freed slot goes to the oldest waiting write lane request.
+    A waiting poll goes next once max_burst write lane requests in a row
+    went before it, so a flood of commands delays polling but never stalls it.
+    An exclusive holder keeps every other task from starting a request until
+    it releases.
+    """
+
+    def __init__(self, max_burst: int = DEFAULT_MAX_WRITE_BURST, capacity: int = 1):
+        self.max_burst = max(1, max_burst)
+        self.capacity = max(1, capacity)
+        self._held = 0
+        # Task holding the connection exclusively, its requests do not queue again
+        self.owner: Optional[asyncio.Task] = None
+        # Per lane: (future, task if the slot is wanted exclusively)
+        self._waiters = (deque(), deque())
+        self._bypassed = 0
+        self.preempted = 0
+        self.forced = 0
+
+    def _free(self) -> bool:
+        return self._held < self.capacity and self.owner is None
+
+    async def acquire(self, lane: int, exclusive: bool = False):
+        if self._free() and not any(self._waiters):
+            self._held += 1
+            if exclusive:
+                self.owner = asyncio.current_task()
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, asyncio.current_task() if exclusive else None)
+        self._waiters[lane].append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancel, pass it on
+                self.release(exclusive)
+            else:
+                self._waiters[lane].remove(waiter)
+            raise
+
+    def release(self, exclusive: bool = False):
+        self._held -= 1
+        if exclusive:
+            self.owner = None
+        writes, polls = self._waiters
+        while self._free():
+            while writes and writes[0][0].done():
+                writes.popleft()
+            while polls and polls[0][0].done():
+                polls.popleft()
+            if writes and (not polls or self._bypassed < self.max_burst):
+                if polls:
+                    self._bypassed += 1
+                    self.preempted += 1
+                future, owner = writes.popleft()
+            elif polls:
+                if writes:
+                    self.forced += 1
+                self._bypassed = 0
+                future, owner = polls.popleft()
+            else:
+                break
+            self._held += 1
+            self.owner = owner
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'preempted': self.preempted, 'forced_polls': self.forced}
+
+
+class RequestPacer:
+    """Minimum gap between a response and the next request, with backoff
+
+    The gap starts at the calibrated value and doubles when the device
+    answers busy, times out or drops the connection, or when the smoothed
+    request latency rises to LATENCY_FACTOR times its baseline. Every
+    normal response shrinks it back towards the calibrated gap. The
+    baseline is the lowest smoothed latency seen, or the calibrated one,
+    and slowly follows a lasting rise so a slower link does not keep the
+    gap at its maximum. max_gap equal to gap gives a fixed gap.
+    """
+
+    def __init__(self, gap: float = 0.0, max_gap: float = DEFAULT_MAX_REQUEST_GAP,
+                 latency: Optional[float] = None):
+        self.base_gap = gap
+        self.gap = gap
+        self.max_gap = max(max_gap, gap)
+        self.baseline = latency
+        self.smoothed: Optional[float] = None
+        self._ready_at = 0.0
+        self._since_backoff = LATENCY_HOLD
+        self.error_backoffs = 0
+        self.latency_backoffs = 0
+
+    async def wait(self):
+        """Sleep until the gap after the previous response has passed"""
+        delay = self._ready_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _back_off(self):
+        self.gap = min(self.max_gap, max(2 * self.gap, MIN_BACKOFF_GAP))
+        self._since_backoff = 0
+
+    def success(self, latency: float, now: float):
+        """Record a normal response that took latency seconds"""
+        self.smoothed = latency if self.smoothed is None else self.smoothed + SMOOTHING * (latency - self.smoothed)
+        if self.baseline is None or self.smoothed < self.baseline:
+            self.baseline = self.smoothed
+        else:
+            self.baseline += BASELINE_DRIFT * (self.smoothed - self.baseline)
+        self._since_backoff += 1
+        if (self.smoothed > LATENCY_FACTOR * self.baseline + LATENCY_SLACK
+                and self._since_backoff > LATENCY_HOLD):
+            self.latency_backoffs += 1
+            self._back_off()
+        elif self.gap > self.base_gap:
+            self.gap = max(self.base_gap, self.gap * RECOVERY)
+            if self.gap - self.base_gap < MIN_BACKOFF_GAP / 10:
+                self.gap = self.base_gap
+        self._ready_at = now + self.gap
+
+    def failure(self, now: float):
+        """Record a busy response, a timeout or a dropped connection"""
+        self.error_backoffs += 1
+        self._back_off()
+        self._ready_at = now + self.gap
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'gap_ms': round(1000 * self.gap, 1),
+            'base_gap_ms': round(1000 * self.base_gap, 1),
+            'latency_ms': round(1000 * self.smoothed, 1) if self.smoothed is not None else None,
+            'baseline_ms': round(1000 * self.baseline, 1) if self.baseline is not None else None,
+            'error_backoffs': self.error_backoffs,
+            'latency_backoffs': self.latency_backoffs,
+        }
+
+
+class AsyncModbusTcpClient:
+    def __init__(self, host: str, port: int = 502, unit: int = 1, timeout: float = 3.0,
+                 max_write_burst: int = DEFAULT_MAX_WRITE_BURST, pacer: Optional[RequestPacer] = None,
+                 pipeline_depth: int = 1):
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.timeout = timeout
+        self.pacer = pacer or RequestPacer()
+        self.pipeline_depth = max(1, pipeline_depth)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connect_lock = asyncio.Lock()
+        self._lock = LaneLock(max_write_burst, self.pipeline_depth)
+        self._transaction_id = 0
+        # transaction id -> future of the response PDU
+        self._in_flight: Dict[int, asyncio.Future] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._last_response = 0.0
+        # Requests sent per lane
+        self.lane_requests = [0, 0]
+        self.most_in_flight = 0
+        self.unmatched = 0
+        self.pipeline_fallbacks = 0
+
+    @property
+    def connected(self) -> bool:
+        """Whether the TCP connection is currently open"""
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def depth(self) -> int:
+        """Requests allowed in flight, drops to 1 when the device rejects pipelining"""
+        return self._lock.capacity
+
+    async def connect(self):
+        """Open the TCP connection if it is not open yet"""
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch(self._reader))
+
+    async def close(self):
+        """Close the TCP connection"""
+        writer = self._writer
+        self._drop_connection()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _drop_connection(self, error: Optional[BaseException] = None):
+        """Forget the current connection so the next request reconnects, fail the requests in flight"""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        if self._dispatcher is not None and self._dispatcher is not asyncio.current_task():
+            self._dispatcher.cancel()
+        self._dispatcher = None
+        in_flight, self._in_flight = self._in_flight, {}
+        for future in in_flight.values():
+            if not future.done():
+                future.set_exception(error or ConnectionResetError("Modbus connection dropped"))
+
+    def _next_transaction_id(self) -> int:
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        return self._transaction_id
+
+    async def _dispatch(self, reader: asyncio.StreamReader):
+        """Hand every response frame to the request with its transaction id, in any order"""
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, _, length, _ = MBAP_HEADER.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                future = self._in_flight.pop(transaction_id, None)
+                if future is None:
+                    # Late answer to a cancelled request or a stray frame
+                    self.unmatched += 1
+                elif not future.done():
+                    future.set_result(pdu)
+        except (OSError, EOFError, ValueError) as e:
+            if self._reader is reader:
+                self._drop_connection(e if isinstance(e, (OSError, EOFError)) else ConnectionError(str(e)))
+
+    def _reject_pipelining(self):
+        """The device failed with several requests in flight, send one at a time from now on"""
+        if self._lock.capacity > 1:
+            self._lock.capacity = 1
+            self.pipeline_fallbacks += 1
+
+    def lane_stats(self) -> Dict[str, Any]:
+        """Requests per lane and how often the write lane went first"""
+        return dict(self._lock.stats(), write_requests=self.lane_requests[WRITE_LANE],
+                    poll_requests=self.lane_requests[POLL_LANE])
+
+    def pipeline_stats(self) -> Dict[str, Any]:
+        """Configured and current depth, most requests seen in flight, fallbacks"""
+        return {
+            'configured_depth': self.pipeline_depth,
+            'depth': self.depth,
+            'most_in_flight': self.most_in_flight,
+            'fallbacks': self.pipeline_fallbacks,
+            'unmatched': self.unmatched,
+        }
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, lane: int = WRITE_LANE):
+        """Hold the connection for all requests of the current task inside the block"""
+        await self._lock.acquire(lane, exclusive=True)
+        try:
+            yield
+        finally:
+            self._lock.release(exclusive=True)
+
+    async def _transact(self, pdu: bytes) -> bytes:
+        await self.pacer.wait()
+        loop = asyncio.get_running_loop()
+        try:
+            await self.connect()
+        except (OSError, asyncio.TimeoutError):
+            self.pacer.failure(loop.time())
+            raise
+        transaction_id = self._next_transaction_id()
+        future = loop.create_future()
+        pipelined = bool(self._in_flight)
+        self._in_flight[transaction_id] = future
+        self.most_in_flight = max(self.most_in_flight, len(self._in_flight))
+        sent = loop.time()
+        writer = self._writer
+        try:
+            writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, self.unit) + pdu)
+            await writer.drain()
+            response = await asyncio.wait_for(future, self.timeout)
+        except BaseException as e:
+            self._in_flight.pop(transaction_id, None)
+            if isinstance(e, (OSError, asyncio.TimeoutError, EOFError)):
+                pipelined = pipelined or bool(self._in_flight)
+                # The device state is unknown after a timeout, start over. Another
+                # request may already have opened a new connection, keep that one.
+                if self._writer is writer:
+                    self._drop_connection()
+                self.pacer.failure(loop.time())
+                if pipelined:
+                    self._reject_pipelining()
+            raise
+        now = loop.time()
+        if len(response) < 2 or response[0] & 0x7F != pdu[0]:
+            # Too short for a function code and a byte, or the answer to another request
+            self._last_response = now
+            self.pacer.failure(now)
+            if pipelined or self._in_flight:
+                self._reject_pipelining()
+            raise ValueError(f"Malformed response to function {pdu[0]:#04x}: {response.hex() or 'empty'}")
+        if response[0] & 0x80 and response[1] in BUSY_EXCEPTIONS:
+            self.pacer.failure(now)
+            if pipelined or self._in_flight:
+                self._reject_pipelining()
+        else:
+            # Time the device spent on this request, not the wait behind pipelined ones
+            self.pacer.success(now - max(sent, self._last_response), now)
+        self._last_response = now
+        return response
+
+    async def request(self, pdu: bytes, lane: int = POLL_LANE) -> bytes:
+        """Send a request PDU and return the response PDU"""
+        self.lane_requests[lane] += 1
+        if self._lock.owner is not None and self._lock.owner is asyncio.current_task():
+            response = await self._transact(pdu)
+        else:
+            await self._lock.acquire(lane)
+            try:
+                response = await self._transact(pdu)
+            finally:
+                self._lock.release()
+
+        if response[0] & 0x80:
+            raise ModbusError(response[0] & 0x7F, response[1])
+        return response
+
+    async def read_registers(self, address: int, count: int, table: str = 'holding',
+                             lane: int = POLL_LANE) -> List[int]:
+        """Read count registers starting at address from the given table"""
+        if not 1 <= count <= MAX_READ_REGISTERS:
+            raise ValueError(f"Cannot read {count} registers in one request")
+        response = await self.request(struct.pack('>BHH', READ_FUNCTIONS[table], address, count), lane)
+        if response[1] != 2 * count or len(response) != 2 + 2 * count:
+            raise ValueError(f"Expected {2 * count} bytes, got {response[1]} in {len(response) - 2}")
+        return list(struct.unpack(f'>{count}H', response[2:2 + 2 * count]))
+
+    async def write_register(self, address: int, value: int, lane: int = WRITE_LANE):
+        """Write a single holding register"""
+        await self.request(struct.pack('>BHH', WRITE_SINGLE_REGISTER, address, value & 0xFFFF), lane)
+
+    async def write_registers(self, address: int, values: List[int], lane: int = WRITE_LANE):
+        """Write consecutive holding registers in one request"""
+        count = len(values)
+        if not 1 <= count <= MAX_WRITE_REGISTERS:
+            raise ValueError(f"Cannot write {count} registers in one request")
+        pdu = struct.pack(f'>BHHB{count}H', WRITE_MULTIPLE_REGISTERS, address, count, 2 * count,
+                          *(value & 0xFFFF for value in values))
+        await self.request(pdu, lane)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Flow-controlled QoS 1 MQTT publisher
+
+Publishes a batch of messages with QoS 1 and only counts a message as
+delivered once the broker acknowledged it. At most `window` messages are
+unacknowledged at any time, so a slow or loaded broker slows the publisher
+down instead of growing an unbounded client-side queue. Messages without an
+acknowledgement within `ack_timeout` are published again up to `retries`
+times.
+
+Usage:
+    client = connect_client('mqtt.local', 1883)
+    report = FlowControlledPublisher(client).publish_all(messages)
+    print(format_report(report))
+    disconnect_client(client)
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+DEFAULT_WINDOW = 32
+DEFAULT_ACK_TIMEOUT = 10.0
+DEFAULT_RETRIES = 3
+CONNECT_TIMEOUT = 30.0
+
+Payload = Union[str, bytes]
+
+
+class PublishReport(NamedTuple):
+    messages: int
+    confirmed: int
+    failed: List[str]
+    retries: int
+    duration: float
+
+    @property
+    def messages_per_s(self) -> float:
+        return self.confirmed / self.duration if self.duration > 0 else 0.0
+
+
+def format_report(report: PublishReport) -> str:
+    return (f"{report.confirmed}/{report.messages} confirmed in {report.duration:.2f} s "
+            f"({report.messages_per_s:.0f} msgs/s), {report.retries} retries, {len(report.failed)} failed")
+
+
+def connect_client(host: str, port: int = 1883, user: Optional[str] = None, password: Optional[str] = None,
+                   timeout: float = CONNECT_TIMEOUT, window: int = DEFAULT_WINDOW):
+    """Connect a paho client with a running network loop, raise ConnectionError on failure
+
+    window must be at least the publisher's window, paho holds back messages
+    beyond its in-flight limit and the limit cannot change after connecting.
+    """
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client()
+    if user and password:
+        client.username_pw_set(user, password)
+    client.max_inflight_messages_set(window)
+
+    connected = threading.Event()
+    result = {}
+
+    def on_connect(client, userdata, flags, rc):
+        result['rc'] = rc
+        connected.set()
+
+    client.on_connect = on_connect
+    client.connect_async(host, port, 60)
+    client.loop_start()
+    if not connected.wait(timeout):
+        client.loop_stop()
+        raise ConnectionError(f"No connection to MQTT broker at {host}:{port} within {timeout:.0f} s")
+    if result['rc'] != 0:
+        client.loop_stop()
+        raise ConnectionError(f"MQTT broker at {host}:{port} refused the connection (rc={result['rc']})")
+    return client
+
+
+def disconnect_client(client):
+    """Disconnect cleanly and stop the network loop"""
+    client.disconnect()
+    client.loop_stop()
+
+
+class FlowControlledPublisher:
+    def __init__(self, client, window: int = DEFAULT_WINDOW, ack_timeout: float = DEFAULT_ACK_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES):
+        self.client = client
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        client.on_publish = self._on_publish
+
+        self._condition = threading.Condition()
+        # mid -> (topic, payload, retain, attempt, sent at)
+        self._inflight: Dict[int, Tuple[str, Payload, bool, int, float]] = {}
+        # Acknowledgements that arrived before publish() returned the mid
+        self._early_acks = set()
+        # Timed out mids, a late acknowledgement for them must not confirm a reused mid
+        self._expired = set()
+        self._confirmed = 0
+        self.begin()
+
+    def _on_publish(self, client, userdata, mid, *args):
+        # Runs in the paho network thread
+        with self._condition:
+            if mid in self._expired:
+                self._expired.discard(mid)
+            elif self._inflight.pop(mid, None) is None:
+                self._early_acks.add(mid)
+            else:
+                self._confirmed += 1
+            self._condition.notify_all()
+
+    def _send(self, topic: str, payload: Payload, retain: bool, attempt: int):
+        # Our lock must not be held here, paho calls on_publish while holding its own.
+        # A non-zero rc while reconnecting still queues the message in paho, the
+        # ack timeout decides about a retry either way.
+        info = self.client.publish(topic, payload, qos=1, retain=retain)
+        with self._condition:
+            # paho reused the mid of an expired message, acks for it belong to this one now.
+            # An ack taken for a late one before we got here only costs a retry.
+            self._expired.discard(info.mid)
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                self._confirmed += 1
+            else:
+                self._inflight[info.mid] = (topic, payload, retain, attempt, time.monotonic())
+
+    def _expire(self, now: float):
+        """Retry or give up unacknowledged messages past the timeout"""
+        # Insertion order is send order, stop at the first message still within the timeout
+        while self._inflight:
+            mid, (topic, payload, retain, attempt, sent_at) = next(iter(self._inflight.items()))
+            if now - sent_at < self.ack_timeout:
+                break
+            del self._inflight[mid]
+            self._expired.add(mid)
+            if attempt >= self.retries:
+                self._failed.append(topic)
+            else:
+                self._retries += 1
+                self._pending.append((topic, payload, retain, attempt + 1))
+
+    def _pump(self, drain: bool):
+        """Send pending messages as the window allows, with drain also wait for all acks"""
+        while True:
+            with self._condition:
+                self._expire(time.monotonic())
+                if not self._pending and (not drain or not self._inflight):
+                    return
+                if not self._pending or len(self._inflight) >= self.window:
+                    oldest = next(iter(self._inflight.values()))[4] if self._inflight else time.monotonic()
+                    self._condition.wait(max(0.0, oldest + self.ack_timeout - time.monotonic()) + 0.01)
+                    continue
+                message = self._pending.popleft()
+            self._send(*message)
+
+    def begin(self):
+        """Start a new batch, the report of finish() covers everything submitted after this"""
+        with self._condition:
+            self._confirmed = 0
+        self._pending = deque()
+        self._failed: List[str] = []
+        self._retries = 0
+        self._total = 0
+        self._started = time.monotonic()
+
+    def submit(self, topic: str, payload: Payload, retain: bool = True):
+        """Publish one message, blocks while the in-flight window is full"""
+        self._total += 1
+        self._pending.append((topic, payload, retain, 0))
+        self._pump(drain=False)
+
+    def finish(self) -> PublishReport:
+        """Wait until every submitted message is confirmed or given up"""
+        self._pump(drain=True)
+        with self._condition:
+            confirmed = self._confirmed
+        return PublishReport(self._total, confirmed, self._failed, self._retries, time.monotonic() - self._started)
+
+    def publish_all(self, messages: Iterable[Tuple[str, Payload]], retain: bool = True) -> PublishReport:
+        """Publish all messages with QoS 1 and wait until each is confirmed or given up"""
+        self.begin()
+        for topic, payload in messages:
+            self.submit(topic, payload, retain)
+        return self.finish()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+MQTT Broker Stand-in
+
+Minimal asyncio MQTT 3.1.1 broker for benchmarks and offline runs. It is not
+a production broker, it implements just enough of the protocol for the bridge,
+the discovery scripts and Home Assistant style subscribers.
+
+Usage:
+    python mqtt_standin.py --port 1883
+
+Features:
+- CONNECT, PUBLISH (QoS 0/1/2), SUBSCRIBE with + and # wildcards, UNSUBSCRIBE, PING
+- Retained messages, an empty retained payload deletes the topic
+- Counts messages and bytes in both directions
+- Optional delay before acknowledgements to mimic a loaded broker
+"""
+
+import asyncio
+import argparse
+import struct
+from typing import Dict, List, Optional, Tuple
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Check a topic against an MQTT topic filter with + and # wildcards"""
+    if topic.startswith('$') and not topic_filter.startswith('$'):
+        return False
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for index, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[index]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def encode_length(length: int) -> bytes:
+    """Encode an MQTT remaining length"""
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+
+def publish_packet(topic: str, payload: bytes, retain: bool = False) -> bytes:
+    """Build a QoS 0 PUBLISH packet"""
+    body = encode_string(topic) + payload
+    return bytes([(PUBLISH << 4) | int(retain)]) + encode_length(len(body)) + body
+
+
+class Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscriptions: List[str] = []
+
+
+class MqttBrokerStandin:
+    def __init__(self, ack_delay: float = 0.0):
+        self.ack_delay = ack_delay
+        self.retained: Dict[str, bytes] = {}
+        self.sessions: List[Session] = []
+        self._server = None
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.connections = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the traffic counters"""
+        return {
+            'connections': self.connections,
+            'messages_received': self.messages_received,
+            'messages_sent': self.messages_sent,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent,
+            'retained_topics': len(self.retained),
+        }
+
+    def _send(self, session: Session, packet: bytes):
+        if not session.writer.is_closing():
+            session.writer.write(packet)
+            self.bytes_sent += len(packet)
+
+    async def _ack(self, session: Session, packet_type: int, packet_id: int):
+        if self.ack_delay:
+            await asyncio.sleep(self.ack_delay)
+        self._send(session, bytes([packet_type << 4, 2]) + struct.pack('>H', packet_id))
+
+    def _route(self, topic: str, payload: bytes, retain: bool):
+        self.messages_received += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        packet = None
+        for session in self.sessions:
+            if any(topic_matches(f, topic) for f in session.subscriptions):
+                packet = packet or publish_packet(topic, payload)
+                self._send(session, packet)
+                self.messages_sent += 1
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+        first = (await reader.readexactly(1))[0]
+        length = 0
+        multiplier = 1
+        size = 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            size += 1
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        body = await reader.readexactly(length)
+        self.bytes_received += size + length
+        return first >> 4, first & 0x0F, body
+
+    def _handle_publish(self, session: Session, flags: int, body: bytes) -> Optional[Tuple[int, int]]:
+        qos = (flags >> 1) & 0x03
+        topic_length = struct.unpack('>H', body[:2])[0]
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+        packet_id = None
+        if qos:
+            packet_id = struct.unpack('>H', body[offset:offset + 2])[0]
+            offset += 2
+        self._route(topic, body[offset:], bool(flags & 0x01))
+        if qos == 1:
+            return PUBACK, packet_id
+        if qos == 2:
+            return PUBREC, packet_id
+        return None
+
+    def _handle_subscribe(self, session: Session, body: bytes):
+        packet_id = struct.unpack('>H', body[:2])[0]
+        offset = 2
+        granted = bytearray()
+        filters = []
+        while offset < len(body):
+            length = struct.unpack('>H', body[offset:offset + 2])[0]
+            filters.append(body[offset + 2:offset + 2 + length].decode('utf-8'))
+            granted.append(min(body[offset + 2 + length], 1))
+            offset += 3 + length
+        session.subscriptions.extend(filters)
+        self._send(session, bytes([SUBACK << 4 | 0]) + encode_length(2 + len(granted))
+                   + struct.pack('>H', packet_id) + bytes(granted))
+        for topic, payload in list(self.retained.items()):
+            if any(topic_matches(f, topic) for f in filters):
+                self._send(session, publish_packet(topic, payload, retain=True))
+                self.messages_sent += 1
+
+    def _handle_unsubscribe(self, session: Session, body: bytes):
+        packet_id = struct.unpack('>H', body[:2])[0]
+        offset = 2
+        while offset < len(body):
+            length = struct.unpack('>H', body[offset:offset + 2])[0]
+            topic_filter = body[offset + 2:offset + 2 + length].decode('utf-8')
+            if topic_filter in session.subscriptions:
+                session.subscriptions.remove(topic_filter)
+            offset += 2 + length
+        self._send(session, bytes([UNSUBACK << 4, 2]) + struct.pack('>H', packet_id))
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(writer)
+        self.sessions.append(session)
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                if packet_type == CONNECT:
+                    self._send(session, bytes([CONNACK << 4, 2, 0, 0]))
+                elif packet_type == PUBLISH:
+                    ack = self._handle_publish(session, flags, body)
+                    if ack is not None:
+                        loop.create_task(self._ack(session, *ack))
+                elif packet_type == PUBREL:
+                    loop.create_task(self._ack(session, PUBCOMP, struct.unpack('>H', body[:2])[0]))
+                elif packet_type == SUBSCRIBE:
+                    self._handle_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._handle_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    self._send(session, bytes([PINGRESP << 4, 0]))
+                elif packet_type == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.remove(session)
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 1883) -> int:
+        """Start serving and return the bound port"""
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def serve(broker: MqttBrokerStandin, host: str, port: int):
+    port = await broker.start(host, port)
+    print(f"📡 MQTT broker stand-in listening on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a minimal MQTT broker stand-in')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=1883, help='Port to listen on')
+    parser.add_argument('--ack-delay', type=float, default=0.0, help='Delay in seconds before acknowledgements')
+
+    args = parser.parse_args()
+
+    broker = MqttBrokerStandin(args.ack_delay)
+    try:
+        asyncio.run(serve(broker, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n📊 {broker.stats()}")
+
+
+if __name__ == '__main__':
+    main()
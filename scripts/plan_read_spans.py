@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Modbus Read Span Planner for modbus4mqtt configurations
+
+This script reads a modbus4mqtt YAML configuration file, groups the register
+addresses into the fewest contiguous read spans and writes back an optimized
+configuration.
+
+Usage:
+    python plan_read_spans.py --config path/to/config.yml --max-gap 4 --max-span 32
+
+Features:
+- Sorts and groups registers per Modbus table into contiguous read spans
+- Bridges small address gaps instead of issuing an extra request
+- Respects a maximum number of registers per request
+- Picks the scan_batching value with the fewest requests for modbus4mqtt
+- Prints the number of Modbus requests per poll cycle before and after
+- Lists addresses used by more than one register, the bridge reads them once
+"""
+
+import re
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from register_model import duplicate_addresses, load_yaml
+
+# Defaults used by modbus4mqtt when a key is missing from the config
+DEFAULT_SCAN_BATCHING = 100
+DEFAULT_TABLE = 'holding'
+
+# Number of 16 bit registers occupied by each modbus4mqtt data type
+TYPE_WIDTHS = {
+    'int16': 1,
+    'uint16': 1,
+    'int32': 2,
+    'uint32': 2,
+    'float': 2,
+    'int64': 4,
+    'uint64': 4,
+    'double': 4,
+}
+
+
+def register_width(register: Dict[str, Any]) -> int:
+    """Return the number of registers a register entry occupies"""
+    return TYPE_WIDTHS.get(register.get('type', 'uint16'), 1)
+
+
+def collect_addresses(config: Dict[str, Any]) -> Dict[str, List[int]]:
+    """Collect the sorted, unique register addresses per Modbus table"""
+    tables: Dict[str, set] = {}
+    for register in config.get('registers') or []:
+        if 'address' not in register:
+            continue
+        table = register.get('table', DEFAULT_TABLE)
+        addresses = tables.setdefault(table, set())
+        for offset in range(register_width(register)):
+            addresses.add(int(register['address']) + offset)
+    return {table: sorted(addresses) for table, addresses in tables.items()}
+
+
+def plan_spans(addresses: List[int], max_gap: int = 0, max_span: int = 125) -> List[Tuple[int, int]]:
+    """Group sorted addresses into the fewest (start, count) read spans
+
+    A span is extended as long as the next address is at most ``max_gap``
+    unused registers away and the span stays within ``max_span`` registers.
+    Greedy extension is optimal here because both limits only ever force a
+    break, never reward one.
+    """
+    if max_span < 1:
+        raise ValueError("max_span must be at least 1")
+
+    spans = []
+    start = end = None
+    for address in sorted(set(addresses)):
+        if start is not None and address - end - 1 <= max_gap and address - start < max_span:
+            end = address
+            continue
+        if start is not None:
+            spans.append((start, end - start + 1))
+        start = end = address
+    if start is not None:
+        spans.append((start, end - start + 1))
+    return spans
+
+
+def count_batched_requests(addresses: List[int], scan_batching: int) -> int:
+    """Count the requests modbus4mqtt issues per cycle for a scan_batching value
+
+    modbus4mqtt reads aligned windows of ``scan_batching`` registers and skips
+    every window that contains no configured address.
+    """
+    return len({address - address % scan_batching for address in addresses})
+
+
+def best_scan_batching(tables: Dict[str, List[int]], max_span: int) -> int:
+    """Return the smallest scan_batching up to max_span with the fewest requests"""
+    best = 1
+    best_count = sum(count_batched_requests(addresses, 1) for addresses in tables.values())
+    for batching in range(2, max_span + 1):
+        count = sum(count_batched_requests(addresses, batching) for addresses in tables.values())
+        if count < best_count:
+            best, best_count = batching, count
+    return best
+
+
+def plan_config(config: Dict[str, Any], max_gap: int, max_span: int) -> Dict[str, Any]:
+    """Plan read spans and scan_batching for a loaded modbus4mqtt config"""
+    tables = collect_addresses(config)
+    current_batching = int(config.get('scan_batching', DEFAULT_SCAN_BATCHING))
+    spans = {table: plan_spans(addresses, max_gap, max_span) for table, addresses in tables.items()}
+    scan_batching = best_scan_batching(tables, max_span) if tables else current_batching
+
+    return {
+        'registers': sum(len(addresses) for addresses in tables.values()),
+        'read_spans': spans,
+        'scan_batching': scan_batching,
+        'requests_before': sum(count_batched_requests(a, current_batching) for a in tables.values()),
+        'requests_batched': sum(count_batched_requests(a, scan_batching) for a in tables.values()),
+        'requests_spans': sum(len(table_spans) for table_spans in spans.values()),
+    }
+
+
+def describe_register(register: Dict[str, Any]) -> str:
+    """Topic with the settings that make a shared value differ per topic"""
+    details = []
+    if register.get('type', 'uint16') != 'uint16':
+        details.append(register['type'])
+    if register.get('scale', 1) != 1:
+        details.append(f"scale {register['scale']}")
+    if register.get('value_map'):
+        details.append('value_map')
+    if register.get('mask') is not None:
+        details.append(f"mask {register['mask']:#x}")
+    topic = register.get('pub_topic', '(no pub_topic)')
+    return f"{topic} ({', '.join(details)})" if details else topic
+
+
+def format_duplicate_report(duplicates: Dict[Tuple[str, int], List[Dict[str, Any]]]) -> str:
+    """Render the shared addresses, one line per address"""
+    topics = sum(len(group) for group in duplicates.values())
+    lines = [f"Shared addresses: {len(duplicates)} read once for {topics} topics"]
+    for (table, address), group in duplicates.items():
+        lines.append(f"  {table} {address:>6}: {', '.join(describe_register(register) for register in group)}")
+    return '\n'.join(lines)
+
+
+def format_read_spans(spans: Dict[str, List[Tuple[int, int]]]) -> str:
+    """Render the read_spans section as YAML text"""
+    lines = ['read_spans:']
+    for table, table_spans in sorted(spans.items()):
+        rendered = ', '.join(f"[{start}, {count}]" for start, count in table_spans)
+        lines.append(f"  {table}: [{rendered}]")
+    return '\n'.join(lines) + '\n'
+
+
+def write_optimized_config(config_text: str, plan: Dict[str, Any]) -> str:
+    """Return the config text with updated scan_batching and read_spans
+
+    The file is edited textually so the register comments survive.
+    """
+    text = re.sub(r'^read_spans:\n(?:[ \t]+.*\n)*', '', config_text, flags=re.MULTILINE)
+    batching_line = f"scan_batching: {plan['scan_batching']}\n"
+    spans_text = format_read_spans(plan['read_spans'])
+
+    if re.search(r'^scan_batching:.*$', text, flags=re.MULTILINE):
+        return re.sub(r'^scan_batching:.*\n', lambda _: batching_line + spans_text, text,
+                      count=1, flags=re.MULTILINE)
+    return re.sub(r'^registers:', lambda _: batching_line + spans_text + 'registers:', text,
+                  count=1, flags=re.MULTILINE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan contiguous Modbus read spans for a modbus4mqtt config')
+    parser.add_argument('--config', required=True, help='Path to modbus4mqtt YAML config file')
+    parser.add_argument('--output', help='Output YAML file (default: overwrite --config)')
+    parser.add_argument('--max-gap', type=int, default=4, help='Largest run of unused registers to read through')
+    parser.add_argument('--max-span', type=int, default=125, help='Maximum registers per read request')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the plan, do not write the config')
+
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print(f"Config file not found: {args.config}")
+        sys.exit(1)
+
+    config_text = Path(args.config).read_text(encoding='utf-8')
+    config = load_yaml(config_text)
+
+    if 'registers' not in config:
+        print("No 'registers' section found in config file")
+        sys.exit(1)
+
+    plan = plan_config(config, args.max_gap, args.max_span)
+
+    print(f"Registers: {plan['registers']}")
+    for table, spans in sorted(plan['read_spans'].items()):
+        print(f"Read spans ({table}):")
+        for start, count in spans:
+            print(f"  {start:>6} - {start + count - 1:<6} ({count} registers)")
+    print(f"Requests per cycle before (scan_batching: {config.get('scan_batching', DEFAULT_SCAN_BATCHING)}): "
+          f"{plan['requests_before']}")
+    print(f"Requests per cycle with scan_batching: {plan['scan_batching']}: {plan['requests_batched']}")
+    print(f"Requests per cycle with read_spans: {plan['requests_spans']}")
+    duplicates = duplicate_addresses(config['registers'], DEFAULT_TABLE)
+    if duplicates:
+        print(format_duplicate_report(duplicates))
+
+    if args.dry_run:
+        return
+
+    output = args.output or args.config
+    Path(output).write_text(write_optimized_config(config_text, plan), encoding='utf-8')
+    print(f"Saved optimized configuration to: {output}")
+
+
+if __name__ == '__main__':
+    main()
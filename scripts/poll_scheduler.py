@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Multi-rate poll scheduler for the Modbus to MQTT bridge
+
+Registers are grouped into tiers by their update_rate. On every tick the
+scheduler collects all tiers that are due and merges their registers into
+one shared read plan, so slow tiers piggyback on the reads of fast ones.
+
+Configuration (modbus4mqtt YAML):
+    update_rate: 5                      # default for all registers
+    update_rates:                       # per group, matched against pub_topic
+      "waermepumpe/betriebsstunden/*": 300
+    registers:
+      - pub_topic: heizkreis/temperatur/vorlauf/maximal
+        address: 24
+        update_rate: 300                # per register, wins over update_rates
+"""
+
+import fnmatch
+import math
+from typing import Dict, Any, List, Callable, Tuple
+
+# Tiers due within this many seconds of each other are read together
+TICK_TOLERANCE = 0.05
+
+
+def resolve_update_rate(entry: Dict[str, Any], patterns: Dict[str, float], default: float) -> float:
+    """Return the update_rate of a register entry
+
+    The register's own update_rate key wins, then the first matching
+    update_rates pattern, then the global default.
+    """
+    if 'update_rate' in entry:
+        return float(entry['update_rate'])
+    topic = entry.get('pub_topic', '')
+    for pattern, rate in patterns.items():
+        if fnmatch.fnmatchcase(topic, pattern):
+            return float(rate)
+    return float(default)
+
+
+class PollScheduler:
+    def __init__(self, registers: List[Any], plan_builder: Callable[[List[Any]], List[Any]]):
+        self.tiers: Dict[float, List[Any]] = {}
+        for register in registers:
+            self.tiers.setdefault(register.update_rate, []).append(register)
+        self.plan_builder = plan_builder
+        self.next_due: Dict[float, float] = {}
+        self._plans: Dict[Tuple[float, ...], List[Any]] = {}
+
+    def start(self, now: float):
+        """Make every tier due immediately"""
+        self.next_due = {rate: now for rate in self.tiers}
+
+    def next_wakeup(self) -> float:
+        """Time at which the next tier becomes due"""
+        return min(self.next_due.values())
+
+    def due(self, now: float) -> Tuple[float, ...]:
+        """Return the update rates of all tiers due at now"""
+        return tuple(sorted(rate for rate, due in self.next_due.items() if due <= now + TICK_TOLERANCE))
+
+    def plan(self, rates: Tuple[float, ...]) -> List[Any]:
+        """Return the merged read plan for a set of due tiers
+
+        Plans are cached per tier combination, there are only a handful.
+        """
+        if rates not in self._plans:
+            registers = [register for rate in rates for register in self.tiers[rate]]
+            self._plans[rates] = self.plan_builder(registers)
+        return self._plans[rates]
+
+    def advance(self, rates: Tuple[float, ...], now: float):
+        """Schedule the next read of the given tiers
+
+        After an overrun the missed slots are skipped, keeping every tier on
+        its original grid so slow tiers keep coinciding with fast ones.
+        """
+        for rate in rates:
+            due = self.next_due[rate] + rate
+            if due < now:
+                due += rate * math.ceil((now - due) / rate)
+            self.next_due[rate] = due
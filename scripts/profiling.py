@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Stage-level profiling for the discovery scripts
+
+Records wall time and memory allocations per pipeline stage (YAML load,
+classification, config building per entity type, JSON output, publish, ...)
+and prints them as a summary table. Optionally runs cProfile and tracemalloc
+over the whole run and writes their reports for a closer look.
+
+Usage:
+    profiler = StageProfiler(enabled=True, output_dir='profile')
+    profiler.start()
+    with profiler.stage('load'):
+        config = load_config(config_file)
+    profiler.record('build/sensor', seconds, allocated_bytes)   # aggregated per register
+    report_profile(profiler, 'generate_ha_discovery')   # stop, print the table, write the reports
+
+Features:
+- Disabled profilers cost one attribute check per stage
+- Allocations from tracemalloc: bytes still held after the stage and the
+  stage's peak above its starting point
+- Repeated stages (one per register) are aggregated with a call count
+- --profile-output writes <name>.prof (cProfile, for snakeviz or pstats),
+  <name>.pstats.txt and <name>.tracemalloc.txt
+"""
+
+import contextlib
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Lines in the cProfile and tracemalloc text reports
+REPORT_LINES = 30
+
+
+def reset_peak():
+    """Reset the traced peak to the current allocation"""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # Python 3.8 has no reset_peak. Restarting resets the peak but also
+        # forgets earlier allocations, the tracemalloc report then only shows
+        # those since the last stage started.
+        frames = tracemalloc.get_traceback_limit()
+        tracemalloc.stop()
+        tracemalloc.start(frames)
+
+
+class StageStats:
+    __slots__ = ('calls', 'seconds', 'allocated', 'peak')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.allocated = 0
+        self.peak = 0
+
+
+class StageProfiler:
+    def __init__(self, enabled: bool = False, output_dir: Optional[str] = None):
+        self.enabled = enabled or output_dir is not None
+        self.output_dir = output_dir
+        self.stages: Dict[str, StageStats] = {}
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+        self._started = 0.0
+        self.total_seconds = 0.0
+
+    def __bool__(self) -> bool:
+        return self.enabled
+
+    def start(self):
+        """Start allocation tracing, and cProfile when reports are written"""
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.output_dir is not None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.total_seconds = time.perf_counter() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+        if self.output_dir is not None:
+            self._snapshot = tracemalloc.take_snapshot()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def allocated(self) -> int:
+        """Bytes currently allocated, 0 when not tracing"""
+        return tracemalloc.get_traced_memory()[0] if self.enabled else 0
+
+    def record(self, name: str, seconds: float, allocated: int = 0, peak: int = 0):
+        """Add one call of a stage"""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.allocated += allocated
+        stats.peak = max(stats.peak, peak)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time a stage and record its allocations and peak memory
+
+        Stages measured this way must not be nested, the peak is reset at the
+        start of each one.
+        """
+        if not self.enabled:
+            yield
+            return
+        reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            self.record(name, seconds, current - before, peak - before)
+
+    def summary(self) -> str:
+        """Per stage table: calls, total and per call time, allocations"""
+        lines = [f"{'Stage':<22} {'Calls':>6} {'Total ms':>9} {'µs/call':>9} {'Held KiB':>9} {'Peak KiB':>9}"]
+        for name, stats in self.stages.items():
+            peak = f"{stats.peak / 1024:>9.1f}" if stats.peak else f"{'-':>9}"
+            lines.append(f"{name:<22} {stats.calls:>6} {1000 * stats.seconds:>9.2f} "
+                         f"{1e6 * stats.seconds / stats.calls:>9.1f} {stats.allocated / 1024:>9.1f} {peak}")
+        measured = sum(stats.seconds for stats in self.stages.values())
+        lines.append(f"{'(total run)':<22} {'':>6} {1000 * self.total_seconds:>9.2f} "
+                     f"{'':>9} {'':>9} {'':>9}")
+        if self.total_seconds > measured:
+            lines.append(f"{'(outside stages)':<22} {'':>6} {1000 * (self.total_seconds - measured):>9.2f}")
+        # Allocation tracing slows allocation heavy code several times over
+        overhead = 'tracemalloc and cProfile' if self._profile is not None else 'tracemalloc'
+        lines.append(f"Times include the {overhead} overhead, compare stages with each other, "
+                     f"not with unprofiled runs")
+        return '\n'.join(lines)
+
+    def dump(self, name: str) -> List[str]:
+        """Write the cProfile and tracemalloc reports, return the written paths"""
+        if self.output_dir is None:
+            return []
+        directory = Path(self.output_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        written = []
+        if self._profile is not None:
+            prof_path = directory / f"{name}.prof"
+            self._profile.dump_stats(str(prof_path))
+            text = io.StringIO()
+            pstats.Stats(self._profile, stream=text).sort_stats('cumulative').print_stats(REPORT_LINES)
+            text_path = directory / f"{name}.pstats.txt"
+            text_path.write_text(text.getvalue(), encoding='utf-8')
+            written += [str(prof_path), str(text_path)]
+        if self._snapshot is not None:
+            top = self._snapshot.statistics('lineno')[:REPORT_LINES]
+            total = sum(stat.size for stat in self._snapshot.statistics('filename'))
+            malloc_path = directory / f"{name}.tracemalloc.txt"
+            malloc_path.write_text(f"Allocated at the end of the run: {total / 1024:.1f} KiB\n"
+                                   + '\n'.join(str(stat) for stat in top) + '\n', encoding='utf-8')
+            written.append(str(malloc_path))
+        return written
+
+
+def report_profile(profiler: StageProfiler, name: str):
+    """Stop a profiled run, print the stage table and write the reports"""
+    if not profiler:
+        return
+    profiler.stop()
+    print(f"\nProfile:\n{profiler.summary()}")
+    for path in profiler.dump(name):
+        print(f"Wrote {path}")
+
+
+# Shared disabled profiler for callers that do not profile
+NO_PROFILER = StageProfiler()
@@ -12,53 +12,57 @@ Features:
 - Publishes all discovery configurations from JSON file
 - Supports authentication
 - Sets retain flag for discovery messages
+- Only publishes added and changed configs when a manifest is given
+- QoS 1 with a bounded in-flight window, every config is confirmed by the broker
 - Shows progress and confirmation
+- --profile: wall time and allocations for loading, connecting and publishing
 """
 
+import importlib.util
 import json
 import argparse
 import sys
 from pathlib import Path
 
+from discovery_manifest import format_summary, publish_incremental
+from mqtt_publisher import DEFAULT_WINDOW, FlowControlledPublisher, connect_client, disconnect_client
+from profiling import NO_PROFILER, StageProfiler, report_profile
+
 def publish_discovery_configs(config_file: str, mqtt_host: str, mqtt_port: int = 1883, 
-                            mqtt_user: str = None, mqtt_password: str = None):
+                            mqtt_user: str = None, mqtt_password: str = None,
+                            manifest_file: str = None, force: bool = False, window: int = DEFAULT_WINDOW,
+                            profiler: StageProfiler = NO_PROFILER):
     """Publish discovery configurations to MQTT broker"""
-    try:
-        import paho.mqtt.client as mqtt
-    except ImportError:
+    if importlib.util.find_spec('paho') is None:
         print("paho-mqtt not installed. Install with: pip install paho-mqtt")
         return False
     
     # Load discovery configurations
-    with open(config_file, 'r', encoding='utf-8') as f:
+    with profiler.stage('load'), open(config_file, 'r', encoding='utf-8') as f:
         discovery_configs = json.load(f)
     
     print(f"Loaded {len(discovery_configs)} discovery configurations from {config_file}")
     
-    client = mqtt.Client()
-    
     if mqtt_user and mqtt_password:
-        client.username_pw_set(mqtt_user, mqtt_password)
         print(f"Connecting to {mqtt_host}:{mqtt_port} as {mqtt_user}")
     else:
         print(f"Connecting to {mqtt_host}:{mqtt_port} (no authentication)")
     
     try:
-        client.connect(mqtt_host, mqtt_port, 60)
+        with profiler.stage('connect'):
+            client = connect_client(mqtt_host, mqtt_port, mqtt_user, mqtt_password, window=window)
         print("Connected to MQTT broker")
         
-        published_count = 0
-        for topic, config in discovery_configs.items():
-            payload = json.dumps(config)
-            result = client.publish(topic, payload, retain=True)
-            if result.rc == 0:
-                published_count += 1
-                print(f"✓ Published: {topic}")
-            else:
-                print(f"✗ Failed to publish: {topic} (rc={result.rc})")
-        
-        client.disconnect()
-        print(f"\nSuccessfully published {published_count}/{len(discovery_configs)} configurations")
+        try:
+            with profiler.stage('publish'):
+                counts = publish_incremental(FlowControlledPublisher(client, window), discovery_configs,
+                                             f"{mqtt_host}:{mqtt_port}", manifest_file, force)
+        finally:
+            with profiler.stage('disconnect'):
+                disconnect_client(client)
+        print(f"\nDiscovery configurations: {format_summary(counts)}")
+        if counts['failed']:
+            return False
         print("Home Assistant should now auto-discover your Bartl Heat Pump devices!")
         return True
         
@@ -74,6 +78,11 @@ def main():
     parser.add_argument('--mqtt-port', type=int, default=1883, help='MQTT broker port')
     parser.add_argument('--mqtt-user', help='MQTT username')
     parser.add_argument('--mqtt-password', help='MQTT password')
+    parser.add_argument('--manifest', help='Manifest JSON file, only added/changed/removed topics are published')
+    parser.add_argument('--force', action='store_true', help='Publish every config even if the manifest says unchanged')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='Maximum unacknowledged messages in flight')
+    parser.add_argument('--profile', action='store_true', help='Print wall time and allocations per stage')
+    parser.add_argument('--profile-output', help='Directory for cProfile and tracemalloc reports, implies --profile')
     
     args = parser.parse_args()
     
@@ -81,13 +90,20 @@ def main():
         print(f"Config file not found: {args.config}")
         sys.exit(1)
     
+    profiler = StageProfiler(args.profile, args.profile_output)
+    profiler.start()
     success = publish_discovery_configs(
         args.config,
         args.mqtt_host, 
         args.mqtt_port, 
         args.mqtt_user, 
-        args.mqtt_password
+        args.mqtt_password,
+        args.manifest,
+        args.force,
+        args.window,
+        profiler
     )
+    report_profile(profiler, 'publish_discovery')
     
     if not success:
         sys.exit(1)
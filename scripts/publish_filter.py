@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Deadband and heartbeat publish filter for the Modbus to MQTT bridge
+
+Decides per decoded value whether it is worth an MQTT message. Numeric values
+are only published when they moved further than the register's deadband away
+from the last published value, other values only when they changed. A
+heartbeat re-publishes unchanged values so consumers still see liveness.
+
+Configuration (modbus4mqtt YAML):
+    publish_filter:
+      heartbeat: 300                    # seconds, re-publish unchanged values
+      deadbands:                        # matched against pub_topic, first match wins
+        "waermepumpe/temperatur/*": 0.1 # absolute, after scale
+        "photovoltaik/*_w": "2%"        # relative to the last published value
+    registers:
+      - pub_topic: heizkreis/temperatur/vorlauf/istwert
+        address: 14
+        deadband: 0.2                   # per register, wins over deadbands
+
+As soon as a publish_filter section exists it applies to every register and
+replaces pub_only_on_change. Without it, registers only get filtered when
+they define their own deadband.
+"""
+
+import fnmatch
+from typing import Dict, Any, Optional, Tuple
+
+# (absolute, relative) deadband, a change must exceed both to be published
+Deadband = Tuple[float, float]
+NO_DEADBAND: Deadband = (0.0, 0.0)
+
+# Scaled values carry float noise, 21.6 - 21.5 is slightly above 0.1
+EPSILON = 1e-9
+
+
+def parse_deadband(value: Any) -> Deadband:
+    """Parse a deadband setting like 0.1 or "2%" """
+    if isinstance(value, str) and value.strip().endswith('%'):
+        return (0.0, float(value.strip()[:-1]) / 100)
+    return (float(value), 0.0)
+
+
+def resolve_deadband(entry: Dict[str, Any], filter_config: Optional[Dict[str, Any]]) -> Optional[Deadband]:
+    """Return the deadband of a register entry, None if it is not filtered"""
+    if 'deadband' in entry:
+        return parse_deadband(entry['deadband'])
+    if filter_config is None:
+        return None
+    topic = entry.get('pub_topic', '')
+    for pattern, value in (filter_config.get('deadbands') or {}).items():
+        if fnmatch.fnmatchcase(topic, pattern):
+            return parse_deadband(value)
+    return NO_DEADBAND
+
+
+def _as_float(payload: str) -> Optional[float]:
+    try:
+        return float(payload)
+    except ValueError:
+        return None
+
+
+class PublishFilter:
+    def __init__(self, heartbeat: Optional[float] = None):
+        self.heartbeat = heartbeat
+        # topic -> (payload, numeric value, publish time)
+        self._last: Dict[str, Tuple[str, Optional[float], float]] = {}
+        self.published = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+
+    def invalidate(self, topic: str):
+        """Force the next value of a topic to be published"""
+        self._last.pop(topic, None)
+
+    def _changed(self, register: Any, payload: str, last_payload: str, last_value: Optional[float]) -> bool:
+        deadband = register.deadband
+        if deadband is None:
+            return not register.pub_only_on_change or payload != last_payload
+        value = _as_float(payload)
+        if value is None or last_value is None:
+            return payload != last_payload
+        delta = abs(value - last_value)
+        absolute, relative = deadband
+        return delta > EPSILON and delta > absolute + EPSILON and delta > relative * abs(last_value) + EPSILON
+
+    def should_publish(self, register: Any, payload: str, now: float) -> bool:
+        """Return whether payload should be published and record it if so"""
+        topic = register.pub_topic
+        last = self._last.get(topic)
+        if last is not None:
+            last_payload, last_value, last_time = last
+            if not self._changed(register, payload, last_payload, last_value):
+                if self.heartbeat is None or now - last_time < self.heartbeat:
+                    self.suppressed += 1
+                    return False
+                self.heartbeats += 1
+
+        self._last[topic] = (payload, _as_float(payload), now)
+        self.published += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Return the publish counters"""
+        total = self.published + self.suppressed
+        return {
+            'published': self.published,
+            'suppressed': self.suppressed,
+            'heartbeats': self.heartbeats,
+            'suppressed_percent': round(100 * self.suppressed / total) if total else 0,
+        }
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Shared register model for modbus4mqtt configurations
+
+Loads a modbus4mqtt YAML configuration into compact records and caches the
+parsed entries on disk as JSON, keyed by the SHA-256 of the file content.
+Repeated runs and container restarts with an unchanged file skip YAML
+parsing, an edited file simply gets a new cache entry.
+
+Usage:
+    register_map = load_register_map('config/modbus4mqtt/bartl_full.yml')
+    config = register_map.as_config()   # {'ip': ..., 'registers': [RegisterRecord, ...]}
+
+Features:
+- RegisterRecord uses __slots__ and reads like the register dict it replaces
+  (register['pub_topic'], register.get('scale', 1), 'set_topic' in register)
+- libyaml C loader when PyYAML was built with it, pure Python loader otherwise
+- Cache directory from REGISTER_MODEL_CACHE, empty to disable caching
+- The cache holds plain JSON data, the records are rebuilt on load, so a
+  tampered cache file can change the register map but never run code
+- An unreadable or outdated cache entry is ignored and rebuilt, a config
+  JSON cannot represent exactly (non-string keys, dates) is not cached
+- Detects registers that share an address, the bridge reads those once and
+  fans the value out to every topic
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import yaml
+
+logger = logging.getLogger('register_model')
+
+# Bump when RegisterRecord or RegisterMap change, old cache entries are ignored
+MODEL_VERSION = 2
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'bartl-modbus-mqtt-bridge'
+MAX_CACHE_ENTRIES = 16
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_yaml(text: str) -> Any:
+    """Parse YAML with the C loader when available"""
+    return yaml.load(text, Loader=SafeLoader)
+
+
+class RegisterRecord(Mapping):
+    """One register entry, read-only and dict-like
+
+    The common modbus4mqtt keys live in slots, anything else in extra.
+    Missing keys behave like missing dict keys.
+    """
+
+    FIELDS = ('pub_topic', 'set_topic', 'address', 'table', 'type', 'scale', 'value_map', 'mask',
+              'word_order', 'pub_only_on_change', 'retain', 'update_rate', 'deadband', 'json_key')
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, entry: Dict[str, Any]):
+        extra = {}
+        for key, value in entry.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                extra[key] = value
+        self.extra = extra or None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"RegisterRecord({dict(self)!r})"
+
+
+class RegisterMap:
+    """A parsed configuration: top-level settings and the register records"""
+
+    __slots__ = ('settings', 'registers', 'digest')
+
+    def __init__(self, settings: Dict[str, Any], registers: List[RegisterRecord], digest: str):
+        self.settings = settings
+        self.registers = registers
+        self.digest = digest
+
+    def as_config(self) -> Dict[str, Any]:
+        """The configuration in the shape of yaml.safe_load output"""
+        return dict(self.settings, registers=self.registers)
+
+
+def compile_register_map(text: str, digest: str) -> RegisterMap:
+    """Parse the YAML text and build the register model"""
+    config = load_yaml(text)
+    if not isinstance(config, dict) or 'registers' not in config:
+        raise ValueError("No 'registers' section found in config file")
+    registers = [RegisterRecord(entry) for entry in config.pop('registers') or []]
+    return RegisterMap(config, registers, digest)
+
+
+def duplicate_addresses(registers: List[Any], default_table: str = 'holding') -> Dict[Tuple[str, int], List[Any]]:
+    """Return (table, address) -> registers for every address used by more than one register
+
+    Registers without an address are ignored, the order within a group is the
+    order in the config.
+    """
+    by_address: Dict[Tuple[str, int], List[Any]] = {}
+    for register in registers:
+        if 'address' not in register:
+            continue
+        key = (register.get('table', default_table), int(register['address']))
+        by_address.setdefault(key, []).append(register)
+    return {key: group for key, group in sorted(by_address.items()) if len(group) > 1}
+
+
+def cache_dir_from_env() -> Optional[Path]:
+    value = os.getenv('REGISTER_MODEL_CACHE')
+    if value is None:
+        return DEFAULT_CACHE_DIR
+    return Path(value) if value else None
+
+
+def _read_cache(path: Path, digest: str) -> Optional[RegisterMap]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data['version'] != MODEL_VERSION or data['digest'] != digest:
+            return None
+        settings, entries = data['settings'], data['registers']
+        if not isinstance(settings, dict) or not all(isinstance(entry, dict) for entry in entries):
+            raise TypeError("unexpected cache layout")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.debug("Ignoring register model cache %s: %s", path, e)
+        return None
+    return RegisterMap(settings, [RegisterRecord(entry) for entry in entries], digest)
+
+
+def _write_cache(cache_dir: Path, path: Path, register_map: RegisterMap):
+    data = {'version': MODEL_VERSION, 'digest': register_map.digest, 'settings': register_map.settings,
+            'registers': [dict(register) for register in register_map.registers]}
+    try:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    except (TypeError, ValueError):
+        text = None
+    if text is None or json.loads(text) != data:
+        logger.debug("Not caching %s, it does not round-trip through JSON", register_map.digest)
+        return
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, path)
+        # Pickle entries of model version 1 are never read again
+        for entry in cache_dir.glob('*.pickle'):
+            entry.unlink()
+        entries = sorted(cache_dir.glob('*.json'), key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[MAX_CACHE_ENTRIES:]:
+            entry.unlink()
+    except OSError as e:
+        # A read-only or full cache directory only costs the next run a YAML parse
+        logger.debug("Could not write register model cache %s: %s", path, e)
+
+
+def load_register_map(config_file: str, cache_dir: Optional[Path] = ...) -> RegisterMap:
+    """Load a modbus4mqtt config, from the cache when the file content is unchanged
+
+    cache_dir defaults to REGISTER_MODEL_CACHE or ~/.cache/bartl-modbus-mqtt-bridge,
+    None disables the cache.
+    """
+    if cache_dir is ...:
+        cache_dir = cache_dir_from_env()
+    with open(config_file, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{digest}.v{MODEL_VERSION}.json"
+        register_map = _read_cache(cache_path, digest)
+        if register_map is not None:
+            return register_map
+
+    register_map = compile_register_map(data.decode('utf-8'), digest)
+    if cache_dir is not None:
+        _write_cache(Path(cache_dir), cache_path, register_map)
+    return register_map
+
+
+def load_config(config_file: str, cache_dir: Optional[Path] = ...) -> Dict[str, Any]:
+    """Shortcut for load_register_map(...).as_config()"""
+    return load_register_map(config_file, cache_dir).as_config()
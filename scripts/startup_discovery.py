@@ -2,37 +2,83 @@
 """
 Startup script for MQTT Auto Discovery in Docker environment
 
-This script waits for modbus4mqtt and MQTT broker to be ready,
-then generates and publishes Home Assistant MQTT Auto Discovery configurations.
+This script generates the Home Assistant MQTT Auto Discovery configurations,
+waits until the bridge actually publishes data and then publishes the
+discovery configurations, all in one process.
+
+Readiness is the first live message on <MQTT_PREFIX>/#, there is no fixed
+delay, so entities appear about one broker round trip after the first value.
+Retained messages from an earlier run and /set commands do not count.
+
+With METRICS_FILE set, the stage durations and publish counts of the run are
+written there for the node_exporter textfile collector.
 """
 
 import os
-import time
 import sys
-import subprocess
-import json
-from pathlib import Path
-
-def wait_for_service(host, port, timeout=60):
-    """Wait for a service to be available"""
-    import socket
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((host, port))
-            sock.close()
-            if result == 0:
-                return True
-        except:
-            pass
-        time.sleep(2)
-    return False
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from discovery_manifest import format_summary, payload_bytes, publish_incremental
+from generate_ha_discovery import HADiscoveryGenerator
+from metrics import MetricsRegistry, write_textfile
+from mqtt_publisher import FlowControlledPublisher, connect_client, disconnect_client
+
+
+def readiness_filters(mqtt_prefix: str, discovery_configs: Dict[str, Any]) -> List[str]:
+    """Topic filters that only match data published by the bridge"""
+    if mqtt_prefix:
+        return [f"{mqtt_prefix}/#"]
+    # Without a prefix the bridge publishes below the first level of each state topic
+    return sorted({f"{config['state_topic'].split('/')[0]}/#" for config in discovery_configs.values()})
+
+
+def wait_for_first_message(client, filters: List[str], timeout: float) -> Optional[str]:
+    """Subscribe and block until the first live message arrives, return its topic or None on timeout
+
+    Retained messages are left over from an earlier run and /set topics carry
+    commands to the bridge, neither shows that the bridge publishes.
+    """
+    arrived = threading.Event()
+    first = []
+
+    def on_message(client, userdata, msg):
+        if msg.retain or msg.topic.endswith('/set'):
+            return
+        if not first:
+            first.append(msg.topic)
+        arrived.set()
+
+    client.on_message = on_message
+    client.subscribe([(topic_filter, 0) for topic_filter in filters])
+    arrived.wait(timeout)
+    client.unsubscribe(filters)
+    client.on_message = None
+    return first[0] if first else None
+
+
+def write_run_metrics(metrics_file: str, durations: Dict[str, float], counts: Dict[str, Any], payload_size: int):
+    """Write the durations and counts of this run as gauges"""
+    registry = MetricsRegistry()
+    stages = registry.gauge('discovery_stage_duration_seconds', 'Duration of a discovery startup stage', ('stage',))
+    for stage, duration in durations.items():
+        stages.set(duration, stage)
+    configs = registry.gauge('discovery_configs', 'Discovery configurations of the last run by state', ('state',))
+    for state in ('added', 'changed', 'removed', 'unchanged', 'failed'):
+        configs.set(counts.get(state, 0), state)
+    registry.gauge('discovery_payload_bytes', 'Retained discovery payload bytes').set(payload_size)
+    registry.gauge('discovery_last_run_timestamp_seconds', 'End of the last discovery run').set(time.time())
+    try:
+        write_textfile(registry, metrics_file)
+    except OSError as e:
+        print(f"⚠️  Could not write metrics to {metrics_file}: {e}")
+
 
 def main():
+    started = time.monotonic()
     print("🚀 Starting MQTT Auto Discovery setup...")
-    
+
     # Configuration from environment variables
     config_file = os.getenv('CONFIG_FILE', 'config/modbus4mqtt/Bartl-WP.yml')
     mqtt_prefix = os.getenv('MQTT_PREFIX', 'bartl_wp')
@@ -42,86 +88,88 @@ def main():
     mqtt_user = os.getenv('MQTT_SERVER_USER')
     mqtt_password = os.getenv('MQTT_SERVER_PASSWORD')
     output_file = os.getenv('OUTPUT_FILE', 'ha_discovery.json')
-    
+    manifest_file = os.getenv('MANIFEST_FILE', 'ha_discovery_manifest.json')
+    force_publish = os.getenv('FORCE_PUBLISH', '').lower() in ('1', 'true', 'yes')
+    compact = os.getenv('COMPACT_DISCOVERY', 'true').lower() in ('1', 'true', 'yes')
+    device_discovery = os.getenv('DEVICE_DISCOVERY', '').lower() in ('1', 'true', 'yes')
+    broker_timeout = float(os.getenv('BROKER_TIMEOUT', '120'))
+    ready_timeout = float(os.getenv('READY_TIMEOUT', '300'))
+    metrics_file = os.getenv('METRICS_FILE')
+    durations: Dict[str, float] = {}
+
     if not mqtt_host:
         print("❌ MQTT_SERVER_ADDRESS environment variable is required")
         sys.exit(1)
-    
+
     print(f"📋 Configuration:")
     print(f"   Config file: {config_file}")
     print(f"   MQTT prefix: '{mqtt_prefix}' (topics will be: {mqtt_prefix}/sensor/data)")
     print(f"   Discovery prefix: '{discovery_prefix}' (discovery topics: {discovery_prefix}/sensor/...)")
     print(f"   MQTT broker: {mqtt_host}:{mqtt_port}")
     print(f"   Output file: {output_file}")
-    
-    # Wait for MQTT broker to be available
-    print(f"⏳ Waiting for MQTT broker at {mqtt_host}:{mqtt_port}...")
-    if not wait_for_service(mqtt_host, mqtt_port, timeout=120):
-        print(f"❌ MQTT broker at {mqtt_host}:{mqtt_port} is not available after 120 seconds")
-        sys.exit(1)
-    print("✅ MQTT broker is available")
-    
-    # Wait a bit more for modbus4mqtt to start publishing
-    print("⏳ Waiting for modbus4mqtt to initialize...")
-    time.sleep(30)
-    
-    # Generate discovery configurations
+    print(f"   Manifest file: {manifest_file}{' (ignored, FORCE_PUBLISH)' if force_publish else ''}")
+    print(f"   Compact payloads: {'yes' if compact else 'no'}")
+    print(f"   Device-based discovery: {'yes' if device_discovery else 'no'}")
+
+    # Generating needs no broker, do it before waiting for one
     print("🔧 Generating Home Assistant MQTT Auto Discovery configurations...")
+    generator = HADiscoveryGenerator(mqtt_prefix, discovery_prefix)
     try:
-        cmd = [
-            'python3', 'scripts/generate_ha_discovery.py',
-            '--config', config_file,
-            '--mqtt-prefix', mqtt_prefix,
-            '--discovery-prefix', discovery_prefix,
-            '--output', output_file
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        print("✅ Discovery configurations generated successfully")
-        print(result.stdout)
-        
-    except subprocess.CalledProcessError as e:
+        discovery_configs = generator.generate_discovery_configs(config_file)
+        # Readiness needs the plain state topics, derive the filters before compacting
+        filters = readiness_filters(mqtt_prefix, discovery_configs)
+        entity_count = len(discovery_configs)
+        if device_discovery:
+            discovery_configs = generator.bundle_device_configs(discovery_configs)
+        full_bytes = payload_bytes(discovery_configs)
+        if compact:
+            discovery_configs = generator.compact_discovery_configs(discovery_configs)
+        generator.save_discovery_configs(discovery_configs, output_file, minify=compact)
+    except Exception as e:
         print(f"❌ Failed to generate discovery configurations: {e}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
         sys.exit(1)
-    
-    # Install paho-mqtt if needed for publishing
+    durations['generate'] = time.monotonic() - started
+    print(f"✅ Generated {len(discovery_configs)} discovery configurations for {entity_count} entities")
+    if compact:
+        print(f"📦 Payload size: {full_bytes} bytes full, {payload_bytes(discovery_configs)} bytes compact")
+
+    print(f"⏳ Connecting to MQTT broker at {mqtt_host}:{mqtt_port}...")
+    stage_started = time.monotonic()
     try:
-        import paho.mqtt.client as mqtt
-    except ImportError:
-        print("📦 Installing paho-mqtt...")
-        subprocess.run([sys.executable, '-m', 'pip', 'install', 'paho-mqtt'], check=True)
-        import paho.mqtt.client as mqtt
-    
-    # Publish discovery configurations
-    print("📡 Publishing discovery configurations to MQTT...")
+        client = connect_client(mqtt_host, mqtt_port, mqtt_user, mqtt_password, timeout=broker_timeout)
+    except ConnectionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print("✅ MQTT broker is available")
+    durations['connect'] = time.monotonic() - stage_started
+
     try:
-        with open(output_file, 'r') as f:
-            discovery_configs = json.load(f)
-        
-        client = mqtt.Client()
-        if mqtt_user and mqtt_password:
-            client.username_pw_set(mqtt_user, mqtt_password)
-        
-        client.connect(mqtt_host, mqtt_port, 60)
-        
-        published_count = 0
-        for topic, config in discovery_configs.items():
-            payload = json.dumps(config)
-            result = client.publish(topic, payload, retain=True)
-            if result.rc == 0:
-                published_count += 1
-        
-        client.disconnect()
-        print(f"✅ Successfully published {published_count}/{len(discovery_configs)} discovery configurations")
-        print("🎉 Home Assistant should now auto-discover your Bartl Heat Pump devices!")
-        
-    except Exception as e:
-        print(f"❌ Failed to publish to MQTT: {e}")
+        print(f"⏳ Waiting for the first message on {', '.join(filters)}...")
+        stage_started = time.monotonic()
+        first_topic = wait_for_first_message(client, filters, ready_timeout)
+        durations['wait_for_bridge'] = time.monotonic() - stage_started
+        if first_topic:
+            print(f"✅ Bridge is publishing ({first_topic})")
+        else:
+            print(f"⚠️  No data after {ready_timeout:.0f} s, publishing discovery anyway")
+
+        print("📡 Publishing discovery configurations to MQTT...")
+        stage_started = time.monotonic()
+        counts = publish_incremental(FlowControlledPublisher(client), discovery_configs,
+                                     f"{mqtt_host}:{mqtt_port}", manifest_file, force_publish)
+        durations['publish'] = time.monotonic() - stage_started
+    finally:
+        disconnect_client(client)
+    durations['total'] = time.monotonic() - started
+    if metrics_file:
+        write_run_metrics(metrics_file, durations, counts, payload_bytes(discovery_configs))
+
+    print(f"✅ Discovery configurations: {format_summary(counts)}")
+    if counts['failed']:
+        print(f"❌ {counts['failed']} discovery configurations were not confirmed by the broker")
         sys.exit(1)
-    
-    print("✨ MQTT Auto Discovery setup complete!")
+    print("🎉 Home Assistant should now auto-discover your Bartl Heat Pump devices!")
+    print(f"✨ MQTT Auto Discovery setup complete after {time.monotonic() - started:.1f} s")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Debounced, coalesced write path for the Modbus to MQTT bridge
+
+Dragging a Home Assistant number slider sends a burst of set commands, one
+per step. Commands are collected per register address and the last value
+wins. A register is written once no new command arrived for the debounce
+window, or max_delay after its first pending command at the latest.
+Registers with a value_map (select and switch entities) send discrete
+commands and are written right away. Due writes to adjacent addresses go
+out as one write multiple registers request, and the bridge confirms each
+request with one read-back.
+
+Configuration (modbus4mqtt YAML):
+    writes:
+      debounce: 0.3                     # seconds without a new command
+      max_delay: 1.0                    # seconds after the first command at the latest
+
+The latency from the last command of a write to the read-back confirming
+it is recorded per write, stats() reports its median and 99th percentile. It
+includes the debounce window, superseded commands are only counted.
+"""
+
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from modbus_tcp import MAX_WRITE_REGISTERS
+
+DEFAULT_DEBOUNCE = 0.3
+DEFAULT_MAX_DELAY = 1.0
+# Latency samples kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of unsorted samples"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PendingWrite:
+    """The latest command for one register address"""
+
+    __slots__ = ('register', 'payload', 'words', 'first_received', 'last_received', 'debounce')
+
+    def __init__(self, register: Any, payload: str, words: List[int], received: float, debounce: float):
+        self.register = register
+        self.payload = payload
+        self.words = words
+        self.first_received = received
+        self.last_received = received
+        self.debounce = debounce
+
+    def due_at(self, max_delay: float) -> float:
+        return min(self.last_received + self.debounce, self.first_received + max_delay)
+
+
+class WriteBatch:
+    """Pending writes to consecutive addresses, sent as one request"""
+
+    def __init__(self, table: str, start: int):
+        self.table = table
+        self.start = start
+        self.words: List[int] = []
+        self.writes: List[PendingWrite] = []
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.words)
+
+    def add(self, write: PendingWrite):
+        self.words.extend(write.words)
+        self.writes.append(write)
+
+
+class WriteCoalescer:
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE, max_delay: float = DEFAULT_MAX_DELAY,
+                 max_registers: int = MAX_WRITE_REGISTERS):
+        self.debounce = debounce
+        self.max_delay = max(max_delay, debounce)
+        self.max_registers = max_registers
+        # (table, address) -> latest command
+        self._pending: Dict[Tuple[str, int], PendingWrite] = {}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.commands = 0
+        self.superseded = 0
+        self.requests = 0
+        self.registers_written = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, register: Any, payload: str, words: List[int], received: float):
+        """Queue a command, replacing a pending command for the same address"""
+        self.commands += 1
+        key = (register.table, register.address)
+        pending = self._pending.get(key)
+        if pending is None:
+            debounce = 0.0 if register.value_map else self.debounce
+            self._pending[key] = PendingWrite(register, payload, words, received, debounce)
+            return
+        self.superseded += 1
+        pending.register = register
+        pending.payload = payload
+        pending.words = words
+        pending.last_received = received
+
+    def due_at(self) -> Optional[float]:
+        """Time at which the pending commands should be written, None if there are none"""
+        if not self._pending:
+            return None
+        return min(pending.due_at(self.max_delay) for pending in self._pending.values())
+
+    def take(self, now: float) -> List[WriteBatch]:
+        """Remove the commands due at now and group adjacent addresses into batches"""
+        due = sorted(key for key, pending in self._pending.items() if pending.due_at(self.max_delay) <= now)
+        batches: List[WriteBatch] = []
+        for table, address in due:
+            pending = self._pending.pop((table, address))
+            batch = batches[-1] if batches else None
+            if (batch is None or batch.table != table or batch.end != address
+                    or len(batch.words) + len(pending.words) > self.max_registers):
+                batch = WriteBatch(table, address)
+                batches.append(batch)
+            batch.add(pending)
+        return batches
+
+    def record_latency(self, seconds: float):
+        """Record the time from a command to its confirmed state"""
+        self._latencies.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the write counters and the command to confirmation latency in ms"""
+        latencies = list(self._latencies)
+        return {
+            'commands': self.commands,
+            'superseded': self.superseded,
+            'requests': self.requests,
+            'registers': self.registers_written,
+            'failures': self.failures,
+            'pending': len(self._pending),
+            'latency_p50_ms': round(1000 * percentile(latencies, 0.5), 1) if latencies else None,
+            'latency_p99_ms': round(1000 * percentile(latencies, 0.99), 1) if latencies else None,
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import struct
+
+import pytest
+
+from bartl_simulator import BartlSimulator
+from modbus_tcp import AsyncModbusTcpClient, ModbusError, RequestPacer, SERVER_DEVICE_BUSY
+
+CONFIG = {'registers': [
+    {'pub_topic': 'heizkreis/raumtemperatur/normal', 'set_topic': 'heizkreis/raumtemperatur/normal/set',
+     'address': 4, 'scale': 0.1},
+    {'pub_topic': 'status/heizkreis/betriebsart', 'set_topic': 'status/heizkreis/betriebsart/set', 'address': 7,
+     'value_map': {'Auto': 1, 'Party': 5}},
+    {'pub_topic': 'waermepumpe/betriebsstunden', 'address': 10, 'type': 'uint32'},
+    {'pub_topic': 'puffer/temperatur', 'address': 20, 'scale': 0.1},
+]}
+
+
+def read_pdu(address, count, function=0x03):
+    return struct.pack('>BHH', function, address, count)
+
+
+def words_of(response):
+    return list(struct.unpack(f'>{response[1] // 2}H', response[2:]))
+
+
+def test_values_come_from_the_register_map():
+    simulator = BartlSimulator(CONFIG)
+    words = words_of(simulator.process(read_pdu(4, 4), 0.0))
+    # Writable temperatures start at 20.0, selects at their first state
+    assert words == [200, 0, 0, 1]
+    assert simulator.stats()['registers_read'] == 4
+
+
+def test_same_seed_gives_the_same_values():
+    first, second = BartlSimulator(CONFIG, seed=3), BartlSimulator(CONFIG, seed=3)
+    assert first.process(read_pdu(10, 12), 42.0) == second.process(read_pdu(10, 12), 42.0)
+
+
+def test_counters_increase_and_temperatures_drift():
+    simulator = BartlSimulator(CONFIG)
+    hours = [words_of(simulator.process(read_pdu(10, 2), t)) for t in (0.0, 3600.0)]
+    assert (hours[1][0] << 16 | hours[1][1]) - (hours[0][0] << 16 | hours[0][1]) == 60
+    temperature = words_of(simulator.process(read_pdu(20, 1), 0.0))[0] / 10
+    assert 30.0 <= temperature <= 40.0
+
+
+def test_written_values_are_kept():
+    simulator = BartlSimulator(CONFIG)
+    assert simulator.process(struct.pack('>BHH', 0x06, 4, 215), 0.0) == struct.pack('>BHH', 0x06, 4, 215)
+    simulator.process(struct.pack('>BHHBHH', 0x10, 6, 2, 4, 9, 5), 0.0)
+    assert words_of(simulator.process(read_pdu(4, 4), 1.0)) == [215, 0, 9, 5]
+    assert simulator.stats()['registers_written'] == 3
+
+
+def test_limits_are_answered_with_exceptions():
+    simulator = BartlSimulator(CONFIG, max_registers=8, strict_addresses=True)
+    assert simulator.process(read_pdu(0, 9), 0.0) == bytes([0x83, 0x03])
+    assert simulator.process(read_pdu(0, 2), 0.0) == bytes([0x83, 0x02])
+    assert simulator.process(read_pdu(20, 1, function=0x04), 0.0) == bytes([0x84, 0x02])
+    assert simulator.process(bytes([0x2B, 0, 0, 0, 0]), 0.0) == bytes([0xAB, 0x01])
+    assert simulator.stats()['exceptions'] == 4
+
+
+def run_against(simulator, requests):
+    async def scenario():
+        port = await simulator.start('127.0.0.1', 0)
+        client = AsyncModbusTcpClient('127.0.0.1', port, timeout=2.0, pacer=RequestPacer(max_gap=0.0))
+        try:
+            return await requests(client)
+        finally:
+            await client.close()
+            await simulator.stop()
+
+    return asyncio.run(scenario())
+
+
+def test_requests_too_close_together_get_busy():
+    simulator = BartlSimulator(CONFIG, busy_gap=10.0)
+
+    async def requests(client):
+        await client.read_registers(4, 1)
+        with pytest.raises(ModbusError) as error:
+            await client.read_registers(4, 1)
+        return error.value.code
+
+    assert run_against(simulator, requests) == SERVER_DEVICE_BUSY
+
+
+def test_bursts_are_recorded_after_a_pause():
+    simulator = BartlSimulator(CONFIG, burst_gap=0.05)
+
+    async def requests(client):
+        for _ in range(2):
+            for _ in range(3):
+                await client.read_registers(4, 1)
+            await asyncio.sleep(0.1)
+
+    run_against(simulator, requests)
+    assert len(simulator.burst_starts) == 2
+    assert simulator.stats()['requests'] == 6
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from benchmark_poll_cycle import bridge_config, load_map, percentile, print_comparison, synthetic_config
+
+
+def options(**overrides):
+    return SimpleNamespace(**dict(dict(scan_batching=None, with_filter=False, with_snapshots=False,
+                                       pipeline_depth=1), **overrides))
+
+
+def test_synthetic_map_has_the_requested_size_and_unique_addresses():
+    config = synthetic_config(500)
+    addresses = [entry['address'] for entry in config['registers']]
+    assert len(addresses) == 500
+    assert len(set(addresses)) == 500
+    assert synthetic_config(500) == config
+    assert load_map('synthetic-20') == synthetic_config(20)
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([1.0, 2.0], 99) == 1.99
+
+
+def test_bridge_config_measures_the_raw_pipeline_by_default():
+    config = dict(synthetic_config(5), publish_filter={'heartbeat': 60})
+    raw = bridge_config(config, 5020, options(pipeline_depth=4, with_snapshots=True))
+    assert (raw['ip'], raw['port']) == ('127.0.0.1', 5020)
+    assert 'publish_filter' not in raw
+    assert all(entry['pub_only_on_change'] is False for entry in raw['registers'])
+    assert raw['pacing'] == {'pipeline_depth': 4}
+    assert raw['snapshots'] is True
+    assert bridge_config(config, 5020, options(with_filter=True))['publish_filter'] == {'heartbeat': 60}
+
+
+def test_comparison_reports_relative_changes(capsys):
+    def result(p50, rate):
+        return {'cycle_latency_ms': {'p50': p50, 'p99': p50}, 'registers_per_s': rate,
+                'mqtt_messages_per_s': rate, 'cpu_ms_per_cycle': 10.0}
+
+    print_comparison({'results': {'Bartl-WP': result(40.0, 2500.0), 'new': result(1.0, 1.0)}},
+                     {'results': {'Bartl-WP': result(50.0, 2000.0)}})
+    output = capsys.readouterr().out
+    assert 'Bartl-WP: p50 latency -20.0%, p99 latency -20.0%, registers/s +25.0%' in output
+    assert 'new:' not in output
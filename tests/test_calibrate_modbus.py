@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import calibrate_modbus
+from bartl_simulator import BartlSimulator
+from calibrate_modbus import calibrate, format_pacing, percentile, write_pacing
+from modbus_tcp import SERVER_DEVICE_BUSY
+
+CONFIG = {'registers': [{'pub_topic': f"puffer/wert_{address}", 'address': address} for address in range(10)]}
+
+
+@pytest.fixture(autouse=True)
+def no_recovery_pause(monkeypatch):
+    monkeypatch.setattr(calibrate_modbus, 'RECOVERY_PAUSE', 0.0)
+
+
+def run_calibration(simulator, probe_gap=0.01, max_span=8):
+    async def scenario():
+        port = await simulator.start('127.0.0.1', 0)
+        try:
+            return await calibrate(CONFIG, '127.0.0.1', port, 1, max_gap=4, max_span=max_span, rounds=2,
+                                   probe_gap=probe_gap, max_error_rate=0.0, timeout=1.0)
+        finally:
+            await simulator.stop()
+
+    return asyncio.run(scenario())
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([], 0.5) is None
+    assert percentile([3.0, 1.0, 2.0, 4.0], 0.5) == 3.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 0.95) == 4.0
+
+
+def test_quick_device_gets_the_largest_span_and_no_gap(capsys):
+    calibration = run_calibration(BartlSimulator(CONFIG))
+    assert calibration['span_size'] == 8
+    assert calibration['request_gap'] == 0.0
+    assert calibration['busy'] is False
+    assert list(calibration['sizes']) == [1, 2, 4, 8]
+
+
+def test_busy_answers_pick_a_gap_and_are_reported(capsys):
+    # Busy for 4 ms after each request
+    calibration = run_calibration(BartlSimulator(CONFIG, busy_gap=0.004))
+    assert calibration['request_gap'] >= 0.005
+    # The busy probes are not kept as candidates but still count
+    assert all(SERVER_DEVICE_BUSY not in result['exceptions'] for result in calibration['gaps'].values())
+    assert calibration['busy'] is True
+
+
+def test_span_probing_stops_at_the_device_limit(capsys):
+    calibration = run_calibration(BartlSimulator(CONFIG, max_registers=4))
+    assert list(calibration['sizes']) == [1, 2, 4]
+    assert calibration['span_size'] == 4
+
+
+def test_pacing_section_replaces_the_previous_one():
+    calibration = {'request_gap': 0.005, 'latency': 0.012}
+    text = 'ip: 10.0.0.1\npacing:\n  request_gap: 0.1\nregisters:\n- address: 1\n'
+    updated = write_pacing(text, format_pacing(calibration, 'sim'))
+    assert updated.count('pacing:') == 1
+    assert '  request_gap: 0.005\n  max_request_gap: 1\n  latency: 0.012\nregisters:' in updated
+    assert updated.startswith('ip: 10.0.0.1\n# Calibrated by calibrate_modbus.py against sim')
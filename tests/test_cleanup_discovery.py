@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from cleanup_discovery import RetainedCollector, confirm_removed, stream_remove
+from mqtt_publisher import FlowControlledPublisher, connect_client, disconnect_client
+from mqtt_standin import MqttBrokerStandin
+
+DISCOVERY = {f"homeassistant/sensor/bartl_wp_{index}/config": b'{"name":"x"}' for index in range(50)}
+OTHER = {'homeassistant/sensor/other_device/config': b'{"name":"y"}', 'bartl_wp/puffer/temperatur': b'35.2'}
+
+
+@pytest.fixture
+def broker():
+    """MQTT broker stand-in on its own event loop thread"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    standin = MqttBrokerStandin()
+    port = asyncio.run_coroutine_threadsafe(standin.start('127.0.0.1', 0), loop).result(5)
+    standin.retained.update(DISCOVERY)
+    standin.retained.update(OTHER)
+    yield standin, port
+    asyncio.run_coroutine_threadsafe(standin.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def message(topic, payload=b'x', retain=True):
+    return SimpleNamespace(topic=topic, payload=payload, retain=retain)
+
+
+def test_collector_only_counts_retained_configs():
+    collector = RetainedCollector(None, ['homeassistant/#'], accept=lambda topic: 'bartl_wp' in topic)
+    collector._on_message(None, None, message('homeassistant/sensor/bartl_wp_1/config'))
+    collector._on_message(None, None, message('homeassistant/sensor/bartl_wp_1/config'))
+    # The echo of our own deletion and live messages do not count
+    collector._on_message(None, None, message('homeassistant/sensor/bartl_wp_2/config', payload=b''))
+    collector._on_message(None, None, message('homeassistant/sensor/bartl_wp_3/config', retain=False))
+    collector._on_message(None, None, message('homeassistant/sensor/other_device/config'))
+    assert collector.topics == ['homeassistant/sensor/bartl_wp_1/config']
+
+
+def test_stream_remove_deletes_matching_retained_topics(broker):
+    standin, port = broker
+    client = connect_client('127.0.0.1', port)
+    try:
+        publisher = FlowControlledPublisher(client)
+        accept = lambda topic: '/bartl_wp_' in topic
+        removed, report = stream_remove(client, publisher, ['homeassistant/#'], accept)
+        remaining = confirm_removed(client, publisher, ['homeassistant/#'], accept)
+    finally:
+        disconnect_client(client)
+    assert sorted(removed) == sorted(DISCOVERY)
+    assert report.confirmed == len(DISCOVERY) and report.failed == []
+    assert remaining == []
+    assert set(standin.retained) == set(OTHER)
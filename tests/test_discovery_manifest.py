@@ -0,0 +1,96 @@
+import json
+from types import SimpleNamespace
+
+from discovery_manifest import build_manifest, diff_manifest, encode_payload, load_manifest, publish_incremental
+
+BROKER = 'mqtt.local:1883'
+
+
+class RecordingPublisher:
+    """Stands in for FlowControlledPublisher, fails the given topics"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.messages = []
+
+    def publish_all(self, messages, retain=True):
+        messages = list(messages)
+        self.messages += messages
+        failed = [topic for topic, _ in messages if topic in self.failing]
+        return SimpleNamespace(messages=len(messages), confirmed=len(messages) - len(failed), failed=failed)
+
+
+def configs(**names):
+    return {f"homeassistant/sensor/{name}/config": {'name': name, 'unit': unit} for name, unit in names.items()}
+
+
+def test_diff_sorts_topics_by_state():
+    previous = {'a': '1', 'b': '2', 'c': '3'}
+    current = {'a': '1', 'b': '9', 'd': '4'}
+    diff = diff_manifest(previous, current)
+    assert diff.added == ['d']
+    assert diff.changed == ['b']
+    assert diff.removed == ['c']
+    assert diff.unchanged == ['a']
+
+
+def test_manifest_hashes_the_published_payload():
+    first = build_manifest({'t': {'b': 1, 'a': 2}})
+    assert first == build_manifest({'t': {'b': 1, 'a': 2}})
+    assert first != build_manifest({'t': {'b': 1, 'a': 3}})
+    assert encode_payload({'name': 'Temperatur'}) == '{"name":"Temperatur"}'
+
+
+def test_first_run_publishes_everything_and_records_it(tmp_path):
+    manifest_file = tmp_path / 'manifest.json'
+    publisher = RecordingPublisher()
+    counts = publish_incremental(publisher, configs(vorlauf='°C', ruecklauf='°C'), BROKER, str(manifest_file))
+    assert counts['added'] == 2 and counts['failed'] == 0
+    assert len(publisher.messages) == 2
+    assert set(load_manifest(str(manifest_file), BROKER)) == set(configs(vorlauf='°C', ruecklauf='°C'))
+
+
+def test_unchanged_set_publishes_nothing(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.json')
+    discovery_configs = configs(vorlauf='°C')
+    publish_incremental(RecordingPublisher(), discovery_configs, BROKER, manifest_file)
+    publisher = RecordingPublisher()
+    counts = publish_incremental(publisher, discovery_configs, BROKER, manifest_file)
+    assert publisher.messages == []
+    assert counts['unchanged'] == 1
+
+
+def test_removals_are_cleared_first(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.json')
+    publish_incremental(RecordingPublisher(), configs(vorlauf='°C', alt='°C'), BROKER, manifest_file)
+    publisher = RecordingPublisher()
+    counts = publish_incremental(publisher, configs(vorlauf='K', neu='kW'), BROKER, manifest_file)
+    assert publisher.messages[0] == ('homeassistant/sensor/alt/config', '')
+    assert (counts['added'], counts['changed'], counts['removed']) == (1, 1, 1)
+    assert 'homeassistant/sensor/alt/config' not in load_manifest(manifest_file, BROKER)
+
+
+def test_failed_topics_are_retried_next_run(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.json')
+    failing = 'homeassistant/sensor/ruecklauf/config'
+    counts = publish_incremental(RecordingPublisher([failing]), configs(vorlauf='°C', ruecklauf='°C'),
+                                 BROKER, manifest_file)
+    assert counts['failed'] == 1
+    assert failing not in load_manifest(manifest_file, BROKER)
+    publisher = RecordingPublisher()
+    publish_incremental(publisher, configs(vorlauf='°C', ruecklauf='°C'), BROKER, manifest_file)
+    assert [topic for topic, _ in publisher.messages] == [failing]
+
+
+def test_manifest_of_another_broker_is_ignored(tmp_path):
+    manifest_file = tmp_path / 'manifest.json'
+    manifest_file.write_text(json.dumps({'version': 1, 'broker': 'other:1883', 'topics': {'t': 'x'}}))
+    assert load_manifest(str(manifest_file), BROKER) == {}
+
+
+def test_force_publishes_everything_again(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.json')
+    publish_incremental(RecordingPublisher(), configs(vorlauf='°C'), BROKER, manifest_file)
+    publisher = RecordingPublisher()
+    publish_incremental(publisher, configs(vorlauf='°C'), BROKER, manifest_file, force=True)
+    assert len(publisher.messages) == 1
@@ -0,0 +1,71 @@
+import importlib.util
+
+import pytest
+
+from generate_ha_discovery import HADiscoveryGenerator, KeywordClassifier
+
+ROLES = {
+    'unit': {'temperatur': '°C', 'leistung': 'kW', 'druck': 'bar'},
+    'icon': {'puffer': 'mdi:storage-tank', 'temperatur': 'mdi:thermometer', 'wasser': 'mdi:water'},
+}
+
+
+def test_topics_are_split_into_lower_case_tokens():
+    assert KeywordClassifier.tokenize('Puffer/Temperatur_oben 2.soll-wert') == (
+        'puffer', 'temperatur', 'oben', '2', 'soll', 'wert')
+
+
+def test_every_role_is_reported():
+    classifier = KeywordClassifier(ROLES)
+    assert classifier.classify(('heizkreis', 'status')) == {'unit': None, 'icon': None}
+
+
+def test_first_keyword_in_rule_order_wins_per_role():
+    classifier = KeywordClassifier(ROLES)
+    result = classifier.classify(KeywordClassifier.tokenize('puffer/temperatur/oben'))
+    assert result == {'unit': '°C', 'icon': 'mdi:storage-tank'}
+
+
+def test_keywords_match_inside_compound_words():
+    classifier = KeywordClassifier(ROLES)
+    assert classifier.classify(('vorlauftemperatur',))['unit'] == '°C'
+    assert classifier.classify(('warmwasser',))['icon'] == 'mdi:water'
+
+
+def test_keywords_only_match_whole_tokens_or_compound_ends():
+    classifier = KeywordClassifier(ROLES)
+    # A compound part is matched at the start or the end of a token, never in the middle
+    assert classifier.classify(('ausdruckswert',))['unit'] is None
+    assert classifier.classify(('druck',))['unit'] == 'bar'
+
+
+def test_publishing_without_paho_reports_it(monkeypatch, capsys):
+    monkeypatch.setattr(importlib.util, 'find_spec', lambda name: None)
+    assert HADiscoveryGenerator('bartl_wp').publish_discovery_configs({}, 'localhost') is False
+    assert 'paho-mqtt not installed' in capsys.readouterr().out
+
+
+def test_select_templates_map_values_both_ways():
+    sandbox = pytest.importorskip('jinja2.sandbox')
+    env = sandbox.ImmutableSandboxedEnvironment()
+    register = {'pub_topic': 'heizkreis/betriebsart', 'set_topic': 'heizkreis/betriebsart/set',
+                'address': 7, 'value_map': {'AUS': 0, 'Auto': 1, 'Party': 5}}
+    config = HADiscoveryGenerator('bartl_wp').create_select_config(register, {})
+    assert config['options'] == ['AUS', 'Auto', 'Party']
+    value_template = env.from_string(config['value_template'])
+    command_template = env.from_string(config['command_template'])
+    assert [value_template.render(value=raw) for raw in ('0', '5', '9')] == ['AUS', 'Party', '9']
+    assert [command_template.render(value=state) for state in ('Auto', 'Party', 'Urlaub')] == ['1', '5', 'Urlaub']
+
+
+def test_benchmark_lookup_templates_render_like_the_chains():
+    sandbox = pytest.importorskip('jinja2.sandbox')
+    from benchmark_discovery import chain_templates, lookup_templates
+    env = sandbox.ImmutableSandboxedEnvironment()
+    value_map = {'AUS': 0, 'AKTIV': 1, 'AN': 1}
+    chain, lookup = chain_templates(value_map), lookup_templates(value_map)
+    for raw in ('0', '1', '2'):
+        assert env.from_string(chain[0]).render(value=raw) == env.from_string(lookup[0]).render(value=raw)
+    for state in ('AUS', 'AN', 'x'):
+        assert env.from_string(chain[1]).render(value=state) == env.from_string(lookup[1]).render(value=state)
+    assert len(lookup[0]) + len(lookup[1]) < len(chain[0]) + len(chain[1])
@@ -0,0 +1,29 @@
+from generate_telegraf_config import render_config, string_topic_filters
+
+REGISTERS = [
+    {'pub_topic': 'heizkreis/vorlauf', 'address': 1, 'scale': 0.1},
+    {'pub_topic': 'heizkreis/betriebsart', 'set_topic': 'heizkreis/betriebsart/set', 'address': 7,
+     'value_map': {'Auto': 1, 'Party': 5}},
+    {'pub_topic': 'status/verdichter', 'address': 20},
+]
+
+
+def test_string_topics_cover_status_and_value_map_registers():
+    assert string_topic_filters('bartl_wp', REGISTERS) == ['bartl_wp/status/*', 'bartl_wp/heizkreis/betriebsart']
+
+
+def test_text_registers_get_their_own_field():
+    config = render_config('bartl_wp', REGISTERS)
+    rename = config.index('[[processors.rename]]')
+    converter = config.index('[[processors.converter]]')
+    assert rename < converter
+    assert 'field = "value"\n    dest = "text"' in config[rename:converter]
+    assert '"bartl_wp/heizkreis/betriebsart"' in config[rename:converter]
+    assert 'string = ["text"]' in config[converter:]
+    assert 'order = 1' in config[rename:converter] and 'order = 2' in config[converter:]
+
+
+def test_numeric_only_map_has_no_text_field():
+    config = render_config('bartl_wp', REGISTERS[:1])
+    assert 'processors.rename' not in config
+    assert 'processors.converter' not in config
@@ -0,0 +1,102 @@
+import asyncio
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from influx_sink import InfluxLineSink, encode_field_value, escape_key
+
+
+@pytest.fixture
+def influx():
+    """InfluxDB write API stand-in, answers with the next status of .statuses"""
+    server = HTTPServer(('127.0.0.1', 0), None)
+    server.requests = []
+    server.statuses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            server.requests.append((self.path, dict(self.headers), gzip.decompress(body).decode('utf-8')))
+            self.send_response(server.statuses.pop(0) if server.statuses else 204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server.RequestHandlerClass = Handler
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_sink(server, **options):
+    return InfluxLineSink(f"http://127.0.0.1:{server.server_port}/", 'secret', 'home', 'bartl', **options)
+
+
+def test_keys_and_strings_are_escaped():
+    assert escape_key('temperatur/vorlauf,soll=wert a\\b') == 'temperatur/vorlauf\\,soll\\=wert\\ a\\\\b'
+    assert encode_field_value('Tag "Eco"\\') == '"Tag \\"Eco\\"\\\\"'
+    # Integers go out as float so the field type never changes
+    assert encode_field_value(35) == '35.0'
+    assert encode_field_value(21.5) == '21.5'
+
+
+def test_fields_of_a_poll_cycle_become_one_point(influx):
+    sink = make_sink(influx)
+    sink.add('heizkreis', 'temperatur/vorlauf', 35.2, 1718000000.0)
+    sink.add('heizkreis', 'betriebsart', 'Tag', 1718000000.0)
+    sink.add('heizkreis', 'temperatur/vorlauf', 35.4, 1718000005.0)
+    sink.add('heizkreis', 'leistung', float('nan'), 1718000005.0)
+    asyncio.run(sink.flush())
+
+    [(path, headers, body)] = influx.requests
+    url = urlsplit(path)
+    assert url.path == '/api/v2/write'
+    assert parse_qs(url.query) == {'org': ['home'], 'bucket': ['bartl'], 'precision': ['ms']}
+    assert headers['Authorization'] == 'Token secret'
+    assert headers['Content-Encoding'] == 'gzip'
+    assert body == ('heizkreis temperatur/vorlauf=35.2,betriebsart="Tag" 1718000000000\n'
+                    'heizkreis temperatur/vorlauf=35.4 1718000005000\n')
+    assert sink.stats() == {'points': 2, 'requests': 1, 'bytes': sink.bytes_sent, 'failures': 0,
+                            'dropped': 0, 'buffered': 0}
+
+
+def test_an_empty_buffer_sends_nothing(influx):
+    asyncio.run(make_sink(influx).flush())
+    assert influx.requests == []
+
+
+def test_failed_writes_are_sent_again_with_the_next_flush(influx):
+    sink = make_sink(influx)
+    influx.statuses = [503]
+    sink.add('puffer', 'temperatur', 50.0, 1.0)
+    asyncio.run(sink.flush())
+    assert sink.stats()['buffered'] == 1 and sink.failures == 1
+    sink.add('puffer', 'temperatur', 51.0, 2.0)
+    asyncio.run(sink.flush())
+    assert influx.requests[-1][2] == 'puffer temperatur=50.0 1000\npuffer temperatur=51.0 2000\n'
+    assert sink.points_written == 2 and sink.stats()['buffered'] == 0
+
+
+def test_rejected_line_protocol_is_dropped(influx):
+    sink = make_sink(influx)
+    influx.statuses = [400]
+    sink.add('puffer', 'temperatur', 50.0, 1.0)
+    asyncio.run(sink.flush())
+    assert sink.dropped == 1 and sink.stats()['buffered'] == 0
+
+
+def test_unreachable_server_keeps_the_newest_lines():
+    sink = InfluxLineSink('http://127.0.0.1:1', max_lines=2)
+    for second in range(3):
+        sink.add('puffer', 'temperatur', 50.0 + second, second)
+        asyncio.run(sink.flush())
+    assert sink.failures == 3
+    assert sink.dropped == 1
+    assert sink._lines == ['puffer temperatur=51.0 1000', 'puffer temperatur=52.0 2000']
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry, MetricsServer, write_textfile
+
+
+def make_registry():
+    registry = MetricsRegistry()
+    errors = registry.counter('bridge_read_errors_total', 'Failed reads', ('span', 'error'))
+    errors.inc(2, 'holding:0-31', 'timeout')
+    errors.inc(1, 'holding:0-31', 'timeout')
+    registry.gauge('bridge_queue_depth', 'Queued reads').set_function(lambda: 3)
+    cycles = registry.histogram('bridge_cycle_seconds', 'Poll cycle', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 7.0):
+        cycles.observe(value)
+    return registry
+
+
+def test_text_format_0_0_4():
+    assert make_registry().render() == (
+        '# HELP bridge_read_errors_total Failed reads\n'
+        '# TYPE bridge_read_errors_total counter\n'
+        'bridge_read_errors_total{span="holding:0-31",error="timeout"} 3\n'
+        '# HELP bridge_queue_depth Queued reads\n'
+        '# TYPE bridge_queue_depth gauge\n'
+        'bridge_queue_depth 3\n'
+        '# HELP bridge_cycle_seconds Poll cycle\n'
+        '# TYPE bridge_cycle_seconds histogram\n'
+        'bridge_cycle_seconds_bucket{le="0.1"} 2\n'
+        'bridge_cycle_seconds_bucket{le="1"} 3\n'
+        'bridge_cycle_seconds_bucket{le="+Inf"} 4\n'
+        'bridge_cycle_seconds_sum 7.65\n'
+        'bridge_cycle_seconds_count 4\n')
+
+
+def test_openmetrics_names_counter_families_without_total_and_ends_with_eof():
+    text = make_registry().render(openmetrics=True)
+    assert '# TYPE bridge_read_errors counter\n' in text
+    assert 'bridge_read_errors_total{span="holding:0-31",error="timeout"} 3\n' in text
+    assert text.endswith('# EOF\n')
+
+
+def test_label_values_are_escaped_and_empty_metrics_skipped():
+    registry = MetricsRegistry()
+    registry.summary('unused_seconds', 'Never observed')
+    registry.gauge('info', 'Info', ('path',)).set(1, 'C:\\data\n"x"')
+    assert registry.render() == '# HELP info Info\n# TYPE info gauge\ninfo{path="C:\\\\data\\n\\"x\\""} 1\n'
+
+
+def test_names_are_registered_once():
+    registry = MetricsRegistry()
+    registry.gauge('depth', 'Depth')
+    with pytest.raises(ValueError):
+        registry.counter('depth', 'Depth again')
+
+
+def test_textfile_is_written_with_its_directory(tmp_path):
+    path = tmp_path / 'metrics' / 'discovery.prom'
+    write_textfile(make_registry(), str(path))
+    assert path.read_text(encoding='utf-8') == make_registry().render()
+    assert [entry.name for entry in path.parent.iterdir()] == ['discovery.prom']
+
+
+async def get(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def test_server_answers_in_the_format_the_scraper_asks_for():
+    async def scenario():
+        server = MetricsServer(make_registry())
+        port = await server.start('127.0.0.1', 0)
+        try:
+            text = await get(port, b'GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n')
+            openmetrics = await get(port, b'GET /metrics HTTP/1.1\r\nAccept: application/openmetrics-text\r\n\r\n')
+            missing = await get(port, b'GET /other HTTP/1.1\r\n\r\n')
+        finally:
+            await server.stop()
+        return text, openmetrics, missing
+
+    text, openmetrics, missing = asyncio.run(scenario())
+    head, _, body = text.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 200 OK') and metrics.TEXT_CONTENT_TYPE.encode() in head
+    assert body.decode('utf-8') == make_registry().render()
+    assert metrics.OPENMETRICS_CONTENT_TYPE.encode() in openmetrics and openmetrics.endswith(b'# EOF\n')
+    assert missing.startswith(b'HTTP/1.1 404 Not Found')
+
+
+def test_server_drops_clients_that_never_finish_their_request(monkeypatch):
+    monkeypatch.setattr(metrics, 'REQUEST_TIMEOUT', 0.05)
+
+    async def scenario():
+        server = MetricsServer(MetricsRegistry())
+        port = await server.start('127.0.0.1', 0)
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.1\r\n')
+            response = await asyncio.wait_for(reader.read(), 1.0)
+            writer.close()
+        finally:
+            await server.stop()
+        return response
+
+    assert asyncio.run(scenario()) == b''
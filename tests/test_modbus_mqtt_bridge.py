@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from bartl_simulator import BartlSimulator
+from modbus_mqtt_bridge import ModbusMqttBridge, ReadSpan, Register, build_read_plan, load_registers
+from modbus_tcp import POLL_LANE
+
+CONFIG = {
+    'ip': '127.0.0.1',
+    'update_rate': 5,
+    'update_rates': {'puffer/*': 60},
+    'registers': [
+        {'pub_topic': 'heizkreis/raumtemperatur/normal', 'set_topic': 'heizkreis/raumtemperatur/normal/set',
+         'address': 4, 'scale': 0.1},
+        {'pub_topic': 'heizkreis/raumtemperatur/absenkung', 'set_topic': 'heizkreis/raumtemperatur/absenkung/set',
+         'address': 5, 'scale': 0.1},
+        {'pub_topic': 'heizkreis/betriebsart', 'set_topic': 'heizkreis/betriebsart/set', 'address': 7,
+         'value_map': {'Auto': 1, 'Party': 5}},
+        {'pub_topic': 'puffer/temperatur', 'address': 20, 'scale': 0.1},
+    ],
+}
+
+
+class RecordingClient:
+    """paho client stand-in for the publish paths"""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, retain=False):
+        self.published.append((topic, payload))
+
+    def payloads(self, topic):
+        return [json.loads(payload) for published, payload in self.published if published == topic]
+
+
+def make_bridge(config=CONFIG, **options):
+    bridge = ModbusMqttBridge(dict(config, **options), '127.0.0.1', topic_prefix='bartl_wp')
+    bridge.mqtt = RecordingClient()
+    return bridge
+
+
+def test_register_round_trip():
+    scaled = Register({'pub_topic': 'a/b', 'address': 1, 'scale': 0.1})
+    assert scaled.encode('21.5') == [215]
+    assert scaled.format(scaled.decode([215])) == '21.5'
+    mapped = Register({'pub_topic': 'a/c', 'address': 2, 'value_map': {'Auto': 1, 'Party': 5}})
+    assert mapped.encode('Party') == [5]
+    assert mapped.encode('5') == [5]
+    assert mapped.format(mapped.decode([1])) == 'Auto'
+    with pytest.raises(ValueError):
+        mapped.encode('Urlaub')
+    signed = Register({'pub_topic': 'a/d', 'address': 3, 'type': 'int32', 'word_order': 'lowhigh'})
+    assert signed.encode('-2') == [0xFFFE, 0xFFFF]
+    assert signed.decode([0xFFFE, 0xFFFF]) == -2
+
+
+def test_read_plan_covers_every_register():
+    registers = load_registers(CONFIG)
+    plan = build_read_plan(registers, dict(CONFIG, scan_batching=10))
+    assert sum(len(span.registers) for span in plan) == len(registers)
+    assert all(span.contains(register) for span in plan for register in span.registers)
+
+
+def test_malformed_response_counts_as_a_failed_read():
+    bridge = make_bridge()
+
+    async def malformed(address, count, table, lane):
+        raise ValueError(f"Expected {2 * count} bytes, got 2")
+
+    async def scenario():
+        bridge.loop = asyncio.get_running_loop()
+        bridge.modbus.read_registers = malformed
+        return await bridge.read_span(ReadSpan('holding', 4, 4), POLL_LANE)
+
+    assert asyncio.run(scenario()) is None
+    assert bridge.read_errors.samples() == [('_total', ('holding:4-7', 'exception'), 1.0)]
+
+
+def test_bridge_exits_with_an_error_when_a_task_stops(caplog):
+    bridge = ModbusMqttBridge(dict(CONFIG, port=1), '127.0.0.1', 1, topic_prefix='bartl_wp')
+
+    async def broken_poll_loop():
+        raise RuntimeError('poll failed')
+
+    bridge.poll_loop = broken_poll_loop
+    with caplog.at_level(logging.ERROR):
+        assert asyncio.run(bridge.run()) == 1
+    assert 'The poll loop stopped, exiting' in caplog.text
+
+
+def test_snapshots_keep_slow_tier_values_with_their_read_time():
+    bridge = make_bridge(snapshots=True)
+
+    async def scenario():
+        bridge.loop = asyncio.get_running_loop()
+        for timestamp, rates in ((1000.0, (5.0, 60.0)), (1005.0, (5.0,))):
+            for span in bridge.scheduler.plan(rates):
+                bridge.publish_span(span, [5] * span.count, timestamp)
+            bridge.publish_snapshots(timestamp)
+
+    asyncio.run(scenario())
+    first, second = bridge.mqtt.payloads('bartl_wp/snapshot')
+    assert 'read_at' not in first
+    assert second['timestamp'] == 1005.0
+    assert second['values']['puffer'] == {'temperatur': 0.5}
+    assert second['values']['heizkreis']['betriebsart'] == 'Party'
+    assert second['read_at'] == {'puffer': {'temperatur': 1000.0}}
+    # The puffer group was not read again, its own snapshot is not repeated
+    assert len(bridge.mqtt.payloads('bartl_wp/snapshot/puffer')) == 1
+    assert len(bridge.mqtt.payloads('bartl_wp/snapshot/heizkreis')) == 2
+
+
+def test_shared_addresses_are_read_at_the_fastest_rate():
+    config = dict(CONFIG, address_offset=100, registers=CONFIG['registers'] + [
+        {'pub_topic': 'puffer/temperatur_raw', 'address': 20},
+        {'pub_topic': 'status/puffer', 'address': 20, 'update_rate': 10}])
+    bridge = make_bridge(config)
+    [(key, group)] = bridge.shared_addresses.items()
+    assert key == ('holding', 120)
+    assert [register.pub_topic for register in group] == [
+        'puffer/temperatur', 'puffer/temperatur_raw', 'status/puffer']
+    assert {register.update_rate for register in group} == {10}
+    # The 60 s tier of puffer/* has nothing left to read
+    assert set(bridge.scheduler.tiers) == {5, 10}
+    [span] = bridge.scheduler.plan((10,))
+    assert (span.start, span.count, len(span.registers)) == (120, 1, 3)
+
+
+async def write_through_simulator(bridge, simulator, commands):
+    """Send set commands through the coalescer and write them to the simulator"""
+    bridge.loop = asyncio.get_running_loop()
+    bridge.queue = bridge.queue or asyncio.Queue()
+    port = await simulator.start('127.0.0.1', 0)
+    bridge.modbus.port = port
+    try:
+        for topic, payload in commands:
+            register = bridge.set_topics[f"bartl_wp/{topic}"]
+            bridge.writes.add(register, payload, register.encode(payload), 0.0)
+        for batch in bridge.writes.take(10.0):
+            await bridge.write(batch)
+    finally:
+        await bridge.modbus.close()
+        await simulator.stop()
+    queued = []
+    while not bridge.queue.empty():
+        span, words, timestamp = bridge.queue.get_nowait()
+        queued.append((span.start, words, timestamp))
+    return queued
+
+
+def test_write_is_confirmed_when_the_read_back_matches():
+    bridge = make_bridge()
+    simulator = BartlSimulator(CONFIG)
+    queued = asyncio.run(write_through_simulator(bridge, simulator, [
+        ('heizkreis/raumtemperatur/normal/set', '21.5'), ('heizkreis/raumtemperatur/absenkung/set', '18')]))
+    assert queued == [(4, [215, 180], None)]
+    assert bridge.writes.requests == 1
+    assert bridge.writes.registers_written == 2
+    assert bridge.writes.failures == 0
+    # One confirmation latency per confirmed register
+    assert bridge.confirmation_latency.samples()[-1] == ('_count', (), 2)
+
+
+def test_write_the_controller_clamps_is_a_failure(caplog):
+    bridge = make_bridge()
+    simulator = BartlSimulator(CONFIG)
+    store = simulator.write
+    simulator.write = lambda address, values: store(address, [min(value, 250) for value in values])
+    with caplog.at_level(logging.WARNING):
+        queued = asyncio.run(write_through_simulator(bridge, simulator, [
+            ('heizkreis/raumtemperatur/normal/set', '30'), ('heizkreis/raumtemperatur/absenkung/set', '18')]))
+    # The kept value is still published, only the matching write is confirmed
+    assert queued == [(4, [250, 180], None)]
+    assert bridge.writes.failures == 1
+    assert bridge.writes.requests == 0
+    assert bridge.confirmation_latency.samples()[-1] == ('_count', (), 1)
+    assert "Wrote '30' to heizkreis/raumtemperatur/normal/set, the controller kept '25.0'" in caplog.text
+
+
+def test_failed_read_back_confirms_nothing():
+    bridge = make_bridge()
+    simulator = BartlSimulator(CONFIG)
+
+    async def failing_read(span, lane):
+        return None
+
+    bridge.read_span = failing_read
+    queued = asyncio.run(write_through_simulator(bridge, simulator, [('heizkreis/betriebsart/set', 'Party')]))
+    assert queued == []
+    assert bridge.writes.failures == 1
+    assert bridge.writes.stats()['latency_p50_ms'] is None
+
+
+def test_bridge_exits_with_an_error_when_a_task_stops(caplog):
+    bridge = ModbusMqttBridge(dict(CONFIG, port=1), '127.0.0.1', 1, topic_prefix='bartl_wp')
+
+    async def broken_poll_loop():
+        raise RuntimeError('poll failed')
+
+    bridge.poll_loop = broken_poll_loop
+    with caplog.at_level(logging.ERROR):
+        assert asyncio.run(bridge.run()) == 1
+    assert 'The poll loop stopped, exiting' in caplog.text
+
+
+def test_a_poll_queued_before_the_write_confirms_nothing():
+    bridge = make_bridge()
+    simulator = BartlSimulator(CONFIG)
+    [span] = [span for span in build_read_plan(bridge.registers, CONFIG) if span.start == 4]
+
+    async def scenario():
+        bridge.loop = asyncio.get_running_loop()
+        bridge.queue = asyncio.Queue()
+        # Read before the write went out, still the old value
+        bridge.queue_words(span, [200, 180], 1000.0)
+        queued = await write_through_simulator(bridge, simulator, [('heizkreis/raumtemperatur/normal/set', '21.5')])
+        confirmed = bridge.confirmation_latency.samples()[-1]
+        bridge.publish_span(span, queued[0][1], queued[0][2])
+        return queued, confirmed
+
+    queued, confirmed = asyncio.run(scenario())
+    assert queued == [(4, [200, 180], 1000.0), (4, [215], None)]
+    # Confirmed by the read-back, publishing the stale poll adds nothing
+    assert confirmed == ('_count', (), 1)
+    assert bridge.confirmation_latency.samples()[-1] == ('_count', (), 1)
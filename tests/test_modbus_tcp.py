@@ -0,0 +1,260 @@
+import asyncio
+import struct
+
+import pytest
+
+from bartl_simulator import BartlSimulator
+from modbus_tcp import (LATENCY_HOLD, MBAP_HEADER, MIN_BACKOFF_GAP, POLL_LANE, WRITE_LANE,
+                        AsyncModbusTcpClient, LaneLock, ModbusError, RequestPacer)
+
+CONFIG = {'registers': [{'pub_topic': f"puffer/wert_{address}", 'address': address} for address in range(10)]}
+
+
+async def serve(handler):
+    """Start a Modbus server whose responses come from handler(pdu), return it and the client"""
+
+    async def handle_client(reader, writer):
+        try:
+            while True:
+                transaction_id, _, length, unit = MBAP_HEADER.unpack(await reader.readexactly(MBAP_HEADER.size))
+                response = handler(await reader.readexactly(length - 1))
+                writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response)
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    server = await asyncio.start_server(handle_client, '127.0.0.1', 0)
+    client = AsyncModbusTcpClient('127.0.0.1', server.sockets[0].getsockname()[1], timeout=2.0)
+    return server, client
+
+
+async def shut_down(server, client):
+    await client.close()
+    server.close()
+    await server.wait_closed()
+
+
+class Memory:
+    """Holding registers of a fake device"""
+
+    def __init__(self):
+        self.words = [0] * 100
+
+    def __call__(self, pdu):
+        function, address, count = struct.unpack('>BHH', pdu[:5])
+        if function == 0x03:
+            return struct.pack(f'>BB{count}H', function, 2 * count, *self.words[address:address + count])
+        if function == 0x06:
+            self.words[address] = count
+            return pdu
+        if function == 0x10:
+            self.words[address:address + count] = struct.unpack(f'>{count}H', pdu[6:6 + 2 * count])
+            return pdu[:5]
+        return struct.pack('>BB', function | 0x80, 0x01)
+
+
+def test_write_and_read_back():
+    memory = Memory()
+
+    async def scenario():
+        server, client = await serve(memory)
+        try:
+            await client.write_register(4, 215)
+            await client.write_registers(10, [1, 0xFFFF])
+            return await client.read_registers(4, 8)
+        finally:
+            await shut_down(server, client)
+
+    assert asyncio.run(scenario()) == [215, 0, 0, 0, 0, 0, 1, 0xFFFF]
+
+
+def test_exception_response_raises_modbus_error():
+    async def scenario():
+        server, client = await serve(Memory())
+        try:
+            with pytest.raises(ModbusError) as error:
+                await client.read_registers(0, 1, table='input')
+            return error.value
+        finally:
+            await shut_down(server, client)
+
+    error = asyncio.run(scenario())
+    assert (error.function, error.code) == (0x04, 0x01)
+
+
+def test_request_size_is_checked_before_sending():
+    client = AsyncModbusTcpClient('127.0.0.1')
+    with pytest.raises(ValueError):
+        asyncio.run(client.read_registers(0, 126))
+    with pytest.raises(ValueError):
+        asyncio.run(client.write_registers(0, []))
+
+
+def test_malformed_response_length_is_a_value_error():
+    async def scenario():
+        server, client = await serve(lambda pdu: struct.pack('>BBH', pdu[0], 2, 0))
+        try:
+            with pytest.raises(ValueError):
+                await client.read_registers(0, 4)
+        finally:
+            await shut_down(server, client)
+
+    asyncio.run(scenario())
+
+
+async def take_turns(lock: LaneLock, lanes):
+    """Queue one request per lane behind a held slot and return the order they got it"""
+    order = []
+
+    async def request(name, lane):
+        await lock.acquire(lane)
+        order.append(name)
+        await asyncio.sleep(0)
+        lock.release()
+
+    await lock.acquire(WRITE_LANE)
+    tasks = []
+    for name, lane in lanes:
+        tasks.append(asyncio.get_running_loop().create_task(request(name, lane)))
+        await asyncio.sleep(0)
+    lock.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_writes_go_before_waiting_polls():
+    lock = LaneLock(max_burst=8)
+    order = asyncio.run(take_turns(lock, [('p1', POLL_LANE), ('w1', WRITE_LANE), ('w2', WRITE_LANE)]))
+    assert order == ['w1', 'w2', 'p1']
+    assert lock.stats() == {'preempted': 2, 'forced_polls': 0}
+
+
+def test_a_poll_goes_next_after_max_burst_writes():
+    lock = LaneLock(max_burst=2)
+    lanes = [('p1', POLL_LANE), ('p2', POLL_LANE)] + [(f"w{index}", WRITE_LANE) for index in range(1, 6)]
+    order = asyncio.run(take_turns(lock, lanes))
+    assert order == ['w1', 'w2', 'p1', 'w3', 'w4', 'p2', 'w5']
+    assert lock.forced == 2
+
+
+def test_exclusive_holder_blocks_other_tasks():
+    async def scenario():
+        lock = LaneLock()
+        await lock.acquire(WRITE_LANE, exclusive=True)
+        waiter = asyncio.get_running_loop().create_task(lock.acquire(POLL_LANE))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        lock.release(exclusive=True)
+        await asyncio.wait_for(waiter, 1.0)
+        assert lock.owner is None
+
+    asyncio.run(scenario())
+
+
+def test_pacer_backs_off_on_failures_up_to_max_gap():
+    pacer = RequestPacer(gap=0.0, max_gap=0.05)
+    pacer.failure(0.0)
+    assert pacer.gap == MIN_BACKOFF_GAP
+    for _ in range(5):
+        pacer.failure(0.0)
+    assert pacer.gap == 0.05
+    assert pacer.error_backoffs == 6
+
+
+def test_pacer_recovers_to_the_calibrated_gap():
+    pacer = RequestPacer(gap=0.002, max_gap=1.0, latency=0.01)
+    pacer.failure(0.0)
+    for now in range(200):
+        pacer.success(0.01, float(now))
+    assert pacer.gap == 0.002
+    assert pacer.latency_backoffs == 0
+
+
+def test_pacer_backs_off_when_latency_rises():
+    pacer = RequestPacer(gap=0.0, max_gap=1.0, latency=0.01)
+    for now in range(LATENCY_HOLD + 10):
+        pacer.success(0.1, float(now))
+    assert pacer.latency_backoffs >= 1
+    assert pacer.gap > 0.0
+
+
+def test_fixed_gap_never_moves():
+    pacer = RequestPacer(gap=0.02, max_gap=0.02)
+    pacer.failure(0.0)
+    assert pacer.gap == 0.02
+
+
+async def serve_in_reverse(reader, writer):
+    """Answer two pipelined reads in reverse order, each register holds its address"""
+    requests = []
+    for _ in range(2):
+        transaction_id, _, length, unit = MBAP_HEADER.unpack(await reader.readexactly(MBAP_HEADER.size))
+        requests.append((transaction_id, unit, await reader.readexactly(length - 1)))
+    for transaction_id, unit, pdu in reversed(requests):
+        function, address, count = struct.unpack('>BHH', pdu)
+        response = struct.pack(f'>BB{count}H', function, 2 * count, *range(address, address + count))
+        writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response)
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+def test_responses_are_matched_by_transaction_id():
+    async def scenario():
+        server = await asyncio.start_server(serve_in_reverse, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = AsyncModbusTcpClient('127.0.0.1', port, timeout=2.0, pipeline_depth=2)
+        try:
+            first, second = await asyncio.gather(client.read_registers(100, 2), client.read_registers(200, 3))
+        finally:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+        assert first == [100, 101]
+        assert second == [200, 201, 202]
+        assert client.pipeline_stats()['most_in_flight'] == 2
+        assert client.depth == 2
+
+    asyncio.run(scenario())
+
+
+def test_reject_pipelining_drops_to_one_request():
+    client = AsyncModbusTcpClient('127.0.0.1', pipeline_depth=4)
+    client._reject_pipelining()
+    client._reject_pipelining()
+    assert client.depth == 1
+    assert client.pipeline_fallbacks == 1
+
+
+def test_busy_answer_to_a_pipelined_request_stops_pipelining():
+    async def scenario():
+        simulator = BartlSimulator(CONFIG, latency=0.01, max_in_flight=1)
+        port = await simulator.start('127.0.0.1', 0)
+        client = AsyncModbusTcpClient('127.0.0.1', port, timeout=2.0, pipeline_depth=2,
+                                      pacer=RequestPacer(max_gap=0.0))
+        try:
+            results = await asyncio.gather(client.read_registers(0, 2), client.read_registers(4, 2),
+                                           return_exceptions=True)
+        finally:
+            await client.close()
+            await simulator.stop()
+        assert any(isinstance(result, ModbusError) for result in results)
+        assert client.depth == 1
+        assert client.pipeline_stats()['fallbacks'] == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('response', [b'', b'\x83', b'\x04\x04\x00\x01\x00\x02'])
+def test_short_or_foreign_response_is_a_value_error(response):
+    async def scenario():
+        server, client = await serve(lambda pdu: response)
+        try:
+            with pytest.raises(ValueError):
+                await client.read_registers(0, 2)
+            with pytest.raises(ValueError):
+                await client.write_register(0, 1)
+        finally:
+            await shut_down(server, client)
+        assert client.pacer.error_backoffs == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+from mqtt_publisher import FlowControlledPublisher
+
+
+class FakeClient:
+    """paho client stand-in, acks are given by ack(mid, attempt) and mids by next_mid()"""
+
+    def __init__(self, ack=lambda mid, attempt: True, mids=None):
+        self.ack = ack
+        self.mids = mids or itertools.count(1)
+        self.on_publish = None
+        self.sent = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        mid = next(self.mids)
+        attempt = sum(1 for sent_topic, _ in self.sent if sent_topic == topic)
+        self.sent.append((topic, mid))
+        if self.ack(mid, attempt):
+            # paho may call on_publish before publish() returns the mid
+            self.on_publish(self, None, mid)
+        return SimpleNamespace(mid=mid, rc=0)
+
+
+def test_all_messages_are_confirmed():
+    client = FakeClient()
+    report = FlowControlledPublisher(client, window=4).publish_all((f"t/{index}", 'x') for index in range(10))
+    assert (report.messages, report.confirmed, report.failed, report.retries) == (10, 10, [], 0)
+
+
+def test_unacknowledged_message_is_retried_then_given_up():
+    client = FakeClient(ack=lambda mid, attempt: False)
+    publisher = FlowControlledPublisher(client, ack_timeout=0.02, retries=2)
+    report = publisher.publish_all([('t/lost', 'x')])
+    assert report.failed == ['t/lost']
+    assert report.retries == 2
+    assert len(client.sent) == 3
+
+
+def test_late_ack_of_an_expired_message_does_not_confirm_another():
+    client = FakeClient(ack=lambda mid, attempt: False, mids=itertools.repeat(1))
+    publisher = FlowControlledPublisher(client, ack_timeout=0.02, retries=0)
+    publisher.publish_all([('t/slow', 'x')])
+    # The ack of the timed out message arrives before its mid is used again
+    client.on_publish(client, None, 1)
+    report = publisher.publish_all([('t/next', 'x')])
+    assert report.confirmed == 0
+    assert report.failed == ['t/next']
+
+
+def test_ack_for_a_reused_mid_confirms_the_new_message():
+    # paho hands out the mid of the expired first attempt again for the retry
+    client = FakeClient(ack=lambda mid, attempt: False, mids=itertools.repeat(1))
+    original = client.publish
+
+    def publish_and_ack_retry(topic, *args, **kwargs):
+        info = original(topic, *args, **kwargs)
+        if len(client.sent) > 1:
+            threading.Timer(0.005, client.on_publish, (client, None, info.mid)).start()
+        return info
+
+    client.publish = publish_and_ack_retry
+    publisher = FlowControlledPublisher(client, ack_timeout=0.05, retries=1)
+    report = publisher.publish_all([('t/retried', 'x')])
+    assert report.confirmed == 1
+    assert report.failed == []
+
+
+def test_ack_from_the_network_thread_releases_the_window():
+    client = FakeClient(ack=lambda mid, attempt: False)
+    original = client.publish
+
+    def publish_and_ack_later(*args, **kwargs):
+        info = original(*args, **kwargs)
+        threading.Timer(0.01, client.on_publish, (client, None, info.mid)).start()
+        return info
+
+    client.publish = publish_and_ack_later
+    report = FlowControlledPublisher(client, window=1, ack_timeout=1.0).publish_all(
+        (f"t/{index}", 'x') for index in range(3))
+    assert report.confirmed == 3
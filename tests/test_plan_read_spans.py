@@ -0,0 +1,48 @@
+import pytest
+
+from plan_read_spans import count_batched_requests, plan_config, plan_spans, write_optimized_config
+
+
+def test_adjacent_addresses_share_a_span():
+    assert plan_spans([3, 1, 2, 2, 7, 8]) == [(1, 3), (7, 2)]
+
+
+def test_gap_within_max_gap_is_read_along():
+    assert plan_spans([1, 4, 10], max_gap=2) == [(1, 4), (10, 1)]
+    assert plan_spans([1, 4, 10], max_gap=5) == [(1, 10)]
+
+
+def test_span_never_exceeds_max_span():
+    spans = plan_spans(list(range(300)), max_span=125)
+    assert spans == [(0, 125), (125, 125), (250, 50)]
+
+
+def test_no_addresses_no_spans():
+    assert plan_spans([]) == []
+
+
+def test_max_span_must_be_positive():
+    with pytest.raises(ValueError):
+        plan_spans([1], max_span=0)
+
+
+def test_batched_requests_count_aligned_windows():
+    assert count_batched_requests([0, 1, 99, 100, 250], 100) == 3
+    assert count_batched_requests([0, 1, 99, 100, 250], 1) == 5
+
+
+def test_config_plan_counts_requests_before_and_after():
+    config = {'scan_batching': 1, 'registers': [
+        {'pub_topic': 'a', 'address': 1}, {'pub_topic': 'b', 'address': 2},
+        {'pub_topic': 'c', 'address': 3, 'type': 'uint32'}, {'pub_topic': 'd', 'address': 40, 'table': 'input'}]}
+    plan = plan_config(config, max_gap=0, max_span=125)
+    assert plan['read_spans'] == {'holding': [(1, 4)], 'input': [(40, 1)]}
+    assert plan['requests_before'] == 5
+    assert plan['requests_spans'] == 2
+
+
+def test_optimized_config_keeps_the_register_comments():
+    text = "ip: 1.2.3.4\nscan_batching: 1\nread_spans:\n  holding: [[0, 2]]\nregisters:\n  # Puffer\n  - address: 1\n"
+    plan = {'scan_batching': 4, 'read_spans': {'holding': [(1, 4)]}}
+    assert write_optimized_config(text, plan) == (
+        "ip: 1.2.3.4\nscan_batching: 4\nread_spans:\n  holding: [[1, 4]]\nregisters:\n  # Puffer\n  - address: 1\n")
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+from poll_scheduler import PollScheduler, resolve_update_rate
+
+
+def make_scheduler():
+    registers = [SimpleNamespace(name=name, update_rate=rate)
+                 for name, rate in (('fast', 5.0), ('other', 5.0), ('slow', 60.0))]
+    built = []
+
+    def plan_builder(registers):
+        built.append(registers)
+        return [register.name for register in registers]
+
+    return PollScheduler(registers, plan_builder), built
+
+
+def test_every_tier_is_due_at_start():
+    scheduler, _ = make_scheduler()
+    scheduler.start(100.0)
+    assert scheduler.due(100.0) == (5.0, 60.0)
+    assert scheduler.next_wakeup() == 100.0
+
+
+def test_advance_keeps_tiers_on_their_grid():
+    scheduler, _ = make_scheduler()
+    scheduler.start(0.0)
+    scheduler.advance((5.0, 60.0), 0.5)
+    assert scheduler.next_wakeup() == 5.0
+    assert scheduler.due(5.0) == (5.0,)
+    for now in range(5, 60, 5):
+        scheduler.advance((5.0,), now + 0.5)
+    assert scheduler.due(60.0) == (5.0, 60.0)
+
+
+def test_due_tolerates_a_slightly_early_wakeup():
+    scheduler, _ = make_scheduler()
+    scheduler.start(0.0)
+    scheduler.advance((5.0, 60.0), 0.1)
+    assert scheduler.due(4.97) == (5.0,)
+    assert scheduler.due(4.9) == ()
+
+
+def test_advance_skips_missed_slots_after_an_overrun():
+    scheduler, _ = make_scheduler()
+    scheduler.start(0.0)
+    scheduler.advance((5.0, 60.0), 12.0)
+    assert scheduler.next_due == {5.0: 15.0, 60.0: 60.0}
+
+
+def test_plans_are_built_once_per_tier_combination():
+    scheduler, built = make_scheduler()
+    assert scheduler.plan((5.0,)) == ['fast', 'other']
+    assert scheduler.plan((5.0,)) == ['fast', 'other']
+    assert scheduler.plan((5.0, 60.0)) == ['fast', 'other', 'slow']
+    assert len(built) == 2
+
+
+def test_update_rate_precedence():
+    patterns = {'puffer/*': 300, 'puffer/temperatur': 60}
+    assert resolve_update_rate({'pub_topic': 'puffer/temperatur', 'update_rate': 10}, patterns, 5) == 10.0
+    assert resolve_update_rate({'pub_topic': 'puffer/temperatur'}, patterns, 5) == 300.0
+    assert resolve_update_rate({'pub_topic': 'heizkreis/vorlauf'}, patterns, 5) == 5.0
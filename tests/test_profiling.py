@@ -0,0 +1,68 @@
+import tracemalloc
+
+import pytest
+
+import profiling
+from profiling import NO_PROFILER, StageProfiler, report_profile
+
+
+def test_disabled_profiler_records_nothing():
+    with NO_PROFILER.stage('load'):
+        pass
+    assert not NO_PROFILER
+    assert NO_PROFILER.stages == {} and NO_PROFILER.allocated() == 0
+
+
+@pytest.mark.parametrize('has_reset_peak', [True, False])
+def test_stages_record_allocations_and_their_own_peak(monkeypatch, has_reset_peak):
+    if not has_reset_peak:
+        # Python 3.8
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    profiler = StageProfiler(enabled=True)
+    profiler.start()
+    with profiler.stage('build'):
+        temporary = bytearray(1 << 20)
+        del temporary
+        held = bytearray(64 << 10)
+    with profiler.stage('output'):
+        pass
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
+    build, output = profiler.stages['build'], profiler.stages['output']
+    assert build.calls == 1 and build.seconds > 0
+    assert (64 << 10) <= build.allocated < (1 << 20) <= build.peak
+    # The peak of an earlier stage does not carry over
+    assert output.peak < (64 << 10)
+    del held
+
+
+def test_repeated_stages_are_aggregated():
+    profiler = StageProfiler(enabled=True)
+    profiler.record('build/sensor', 0.002, 100, 300)
+    profiler.record('build/sensor', 0.004, 50, 200)
+    stats = profiler.stages['build/sensor']
+    assert (stats.calls, stats.seconds, stats.allocated, stats.peak) == (2, 0.006, 150, 300)
+    assert profiler.summary().splitlines()[1].split() == ['build/sensor', '2', '6.00', '3000.0', '0.1', '0.3']
+
+
+def test_reports_are_written_to_the_output_dir(tmp_path, capsys):
+    profiler = StageProfiler(output_dir=str(tmp_path / 'profile'))
+    profiler.start()
+    with profiler.stage('load'):
+        sorted(range(1000), key=str)
+    report_profile(profiler, 'generate_ha_discovery')
+    names = sorted(path.name for path in (tmp_path / 'profile').iterdir())
+    assert names == ['generate_ha_discovery.prof', 'generate_ha_discovery.pstats.txt',
+                     'generate_ha_discovery.tracemalloc.txt']
+    output = capsys.readouterr().out
+    assert 'load' in output and 'tracemalloc and cProfile' in output
+
+
+def test_fallback_keeps_the_traceback_limit(monkeypatch):
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    tracemalloc.start(5)
+    try:
+        profiling.reset_peak()
+        assert tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() == 5
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from publish_filter import NO_DEADBAND, PublishFilter, parse_deadband, resolve_deadband
+
+
+def register(deadband=NO_DEADBAND, pub_only_on_change=True):
+    return SimpleNamespace(pub_topic='puffer/temperatur', deadband=deadband, pub_only_on_change=pub_only_on_change)
+
+
+def test_unchanged_value_is_suppressed():
+    publish_filter = PublishFilter()
+    assert publish_filter.should_publish(register(), '21.5', 0.0)
+    assert not publish_filter.should_publish(register(), '21.5', 1.0)
+    assert publish_filter.should_publish(register(), '21.6', 2.0)
+    assert publish_filter.stats() == {'published': 2, 'suppressed': 1, 'heartbeats': 0, 'suppressed_percent': 33}
+
+
+def test_absolute_deadband_ignores_float_noise():
+    publish_filter = PublishFilter()
+    reg = register(parse_deadband(0.1))
+    assert publish_filter.should_publish(reg, '21.5', 0.0)
+    # 21.6 - 21.5 is slightly above 0.1 in floating point
+    assert not publish_filter.should_publish(reg, '21.6', 1.0)
+    assert publish_filter.should_publish(reg, '21.7', 2.0)
+
+
+def test_relative_deadband():
+    publish_filter = PublishFilter()
+    reg = register(parse_deadband('2%'))
+    assert publish_filter.should_publish(reg, '100', 0.0)
+    assert not publish_filter.should_publish(reg, '101.5', 1.0)
+    assert publish_filter.should_publish(reg, '102.5', 2.0)
+
+
+def test_text_values_compare_as_strings():
+    publish_filter = PublishFilter()
+    reg = register(parse_deadband(1))
+    assert publish_filter.should_publish(reg, 'Auto', 0.0)
+    assert not publish_filter.should_publish(reg, 'Auto', 1.0)
+    assert publish_filter.should_publish(reg, 'Party', 2.0)
+
+
+def test_unfiltered_register_follows_pub_only_on_change():
+    publish_filter = PublishFilter()
+    reg = register(None, pub_only_on_change=False)
+    assert publish_filter.should_publish(reg, '1', 0.0)
+    assert publish_filter.should_publish(reg, '1', 1.0)
+
+
+def test_heartbeat_republishes_unchanged_values():
+    publish_filter = PublishFilter(heartbeat=60.0)
+    assert publish_filter.should_publish(register(), '1', 0.0)
+    assert not publish_filter.should_publish(register(), '1', 59.0)
+    assert publish_filter.should_publish(register(), '1', 60.0)
+    assert publish_filter.heartbeats == 1
+
+
+def test_invalidate_forces_the_next_publish():
+    publish_filter = PublishFilter()
+    publish_filter.should_publish(register(), '1', 0.0)
+    publish_filter.invalidate('puffer/temperatur')
+    assert publish_filter.should_publish(register(), '1', 1.0)
+
+
+def test_deadband_resolution():
+    filter_config = {'deadbands': {'puffer/*': '5%'}}
+    assert resolve_deadband({'pub_topic': 'puffer/temperatur', 'deadband': 0.5}, filter_config) == (0.5, 0.0)
+    assert resolve_deadband({'pub_topic': 'puffer/temperatur'}, filter_config) == (0.0, 0.05)
+    assert resolve_deadband({'pub_topic': 'heizkreis/vorlauf'}, filter_config) == NO_DEADBAND
+    assert resolve_deadband({'pub_topic': 'heizkreis/vorlauf'}, None) is None
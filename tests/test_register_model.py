@@ -0,0 +1,127 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from register_model import MAX_CACHE_ENTRIES, RegisterRecord, duplicate_addresses, load_register_map
+
+CONFIG = """\
+ip: 192.168.1.211
+update_rate: 5
+registers:
+  - pub_topic: puffer/temperatur
+    address: 10
+    scale: 0.1
+    description: Puffer oben
+  - pub_topic: status/heizkreis/betriebsart
+    set_topic: status/heizkreis/betriebsart/set
+    address: 7
+    value_map:
+      Auto: 1
+      Party: 5
+  - pub_topic: status/heizkreis/betriebsart_text
+    address: 7
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / 'Bartl-WP.yml'
+    path.write_text(CONFIG, encoding='utf-8')
+    return path
+
+
+def test_record_behaves_like_the_entry_dict():
+    entry = {'pub_topic': 'puffer/temperatur', 'address': 10, 'scale': 0.1, 'description': 'Puffer oben'}
+    record = RegisterRecord(entry)
+    assert dict(record) == entry
+    assert record['scale'] == 0.1
+    assert record['description'] == 'Puffer oben'
+    assert record.get('set_topic') is None
+    assert 'set_topic' not in record
+    assert len(record) == 4
+    with pytest.raises(KeyError):
+        record['value_map']
+
+
+def test_record_is_read_only():
+    record = RegisterRecord({'pub_topic': 'puffer/temperatur'})
+    with pytest.raises(TypeError):
+        record['address'] = 1
+
+
+def test_uncached_load_parses_the_file(config_file):
+    register_map = load_register_map(str(config_file), cache_dir=None)
+    assert register_map.settings == {'ip': '192.168.1.211', 'update_rate': 5}
+    assert [register['address'] for register in register_map.registers] == [10, 7, 7]
+    assert register_map.as_config()['registers'] is register_map.registers
+
+
+def test_cache_is_plain_json_and_round_trips(config_file, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    parsed = load_register_map(str(config_file), cache_dir)
+    [entry] = cache_dir.glob('*.json')
+    data = json.loads(entry.read_text(encoding='utf-8'))
+    assert data['digest'] == parsed.digest
+    assert data['registers'][1]['value_map'] == {'Auto': 1, 'Party': 5}
+
+    cached = load_register_map(str(config_file), cache_dir)
+    assert cached is not parsed
+    assert all(isinstance(register, RegisterRecord) for register in cached.registers)
+    assert [dict(register) for register in cached.registers] == [dict(register) for register in parsed.registers]
+    assert cached.settings == parsed.settings
+
+
+def test_edited_file_gets_a_new_entry(config_file, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    load_register_map(str(config_file), cache_dir)
+    config_file.write_text(CONFIG.replace('address: 10', 'address: 11'), encoding='utf-8')
+    assert load_register_map(str(config_file), cache_dir).registers[0]['address'] == 11
+    assert len(list(cache_dir.glob('*.json'))) == 2
+
+
+def test_broken_cache_entry_is_rebuilt(config_file, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    load_register_map(str(config_file), cache_dir)
+    [entry] = cache_dir.glob('*.json')
+    entry.write_text('{"version": 2, "digest": "x"', encoding='utf-8')
+    assert len(load_register_map(str(config_file), cache_dir).registers) == 3
+    assert json.loads(entry.read_text(encoding='utf-8'))['registers']
+
+
+def test_old_pickle_entries_are_removed_and_cache_is_bounded(config_file, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    (cache_dir / 'old.v1.pickle').write_bytes(pickle.dumps({'registers': []}))
+    for index in range(MAX_CACHE_ENTRIES + 3):
+        (cache_dir / f"{index}.v2.json").write_text('{}', encoding='utf-8')
+    load_register_map(str(config_file), cache_dir)
+    assert not list(cache_dir.glob('*.pickle'))
+    assert len(list(cache_dir.glob('*.json'))) == MAX_CACHE_ENTRIES
+
+
+def test_config_json_cannot_represent_is_not_cached(tmp_path):
+    config_file = tmp_path / 'dated.yml'
+    config_file.write_text("installed: 2024-05-01\nregisters:\n  - pub_topic: a\n    address: 1\n", encoding='utf-8')
+    cache_dir = tmp_path / 'cache'
+    register_map = load_register_map(str(config_file), cache_dir)
+    assert str(register_map.settings['installed']) == '2024-05-01'
+    assert not list(cache_dir.glob('*.json'))
+
+
+def test_duplicate_addresses_keep_config_order():
+    registers = [RegisterRecord({'pub_topic': topic, 'address': address})
+                 for topic, address in (('a', 7), ('b', 8), ('c', 7))]
+    registers.append(RegisterRecord({'pub_topic': 'd', 'address': 7, 'table': 'input'}))
+    duplicates = duplicate_addresses(registers)
+    assert list(duplicates) == [('holding', 7)]
+    assert [register['pub_topic'] for register in duplicates[('holding', 7)]] == ['a', 'c']
+
+
+def test_benchmark_restores_the_cache_setting(monkeypatch, tmp_path):
+    from benchmark_discovery import benchmark_map
+    monkeypatch.setenv('REGISTER_MODEL_CACHE', str(tmp_path))
+    result = benchmark_map('Bartl-WP', 1, 'bartl_wp')
+    assert result['registers'] > 0
+    assert os.environ['REGISTER_MODEL_CACHE'] == str(tmp_path)
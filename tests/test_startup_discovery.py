@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from startup_discovery import wait_for_first_message
+
+
+class FakeClient:
+    """Delivers the given messages as soon as the client subscribes"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.on_message = None
+        self.subscribed = None
+        self.unsubscribed = None
+
+    def subscribe(self, topics):
+        self.subscribed = topics
+        for topic, retain in self.messages:
+            self.on_message(self, None, SimpleNamespace(topic=topic, retain=retain))
+
+    def unsubscribe(self, topics):
+        self.unsubscribed = topics
+
+
+def test_first_live_message_is_returned():
+    client = FakeClient([('bartl_wp/puffer/temperatur', False), ('bartl_wp/heizkreis/vorlauf', False)])
+    assert wait_for_first_message(client, ['bartl_wp/#'], 1.0) == 'bartl_wp/puffer/temperatur'
+    assert client.subscribed == [('bartl_wp/#', 0)]
+    assert client.unsubscribed == ['bartl_wp/#']
+    assert client.on_message is None
+
+
+def test_retained_messages_and_commands_do_not_count():
+    client = FakeClient([('bartl_wp/puffer/temperatur', True), ('bartl_wp/status/betriebsart/set', False),
+                         ('bartl_wp/heizkreis/vorlauf', False)])
+    assert wait_for_first_message(client, ['bartl_wp/#'], 1.0) == 'bartl_wp/heizkreis/vorlauf'
+
+
+def test_timeout_without_a_live_message():
+    client = FakeClient([('bartl_wp/puffer/temperatur', True)])
+    assert wait_for_first_message(client, ['bartl_wp/#'], 0.01) is None
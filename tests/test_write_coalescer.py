@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from write_coalescer import WriteCoalescer
+
+
+def register(address, table='holding', value_map=None):
+    return SimpleNamespace(table=table, address=address, value_map=value_map)
+
+
+def test_nothing_is_taken_before_the_debounce():
+    coalescer = WriteCoalescer(debounce=0.3, max_delay=1.0)
+    coalescer.add(register(4), '21.5', [215], 0.0)
+    assert coalescer.due_at() == 0.3
+    assert coalescer.take(0.2) == []
+    assert len(coalescer) == 1
+
+
+def test_latest_command_per_address_wins():
+    coalescer = WriteCoalescer(debounce=0.3, max_delay=1.0)
+    for index, received in enumerate((0.0, 0.1, 0.2)):
+        coalescer.add(register(4), f"21.{index}", [210 + index], received)
+    [batch] = coalescer.take(0.5)
+    assert batch.words == [212]
+    assert [write.payload for write in batch.writes] == ['21.2']
+    assert coalescer.superseded == 2
+
+
+def test_max_delay_bounds_a_continuous_drag():
+    coalescer = WriteCoalescer(debounce=0.3, max_delay=1.0)
+    for step in range(12):
+        coalescer.add(register(4), str(step), [step], step * 0.1)
+    assert coalescer.due_at() == 1.0
+    assert len(coalescer.take(1.0)) == 1
+
+
+def test_value_map_registers_are_not_debounced():
+    coalescer = WriteCoalescer(debounce=0.3)
+    coalescer.add(register(7, value_map={'Auto': 1}), 'Auto', [1], 0.0)
+    assert coalescer.due_at() == 0.0
+
+
+def test_adjacent_addresses_are_batched():
+    coalescer = WriteCoalescer(debounce=0.0)
+    for address in (6, 4, 5, 9):
+        coalescer.add(register(address), str(address), [address], 0.0)
+    coalescer.add(register(5, table='input'), 'x', [0], 0.0)
+    batches = coalescer.take(0.0)
+    assert [(batch.table, batch.start, batch.words) for batch in batches] == [
+        ('holding', 4, [4, 5, 6]), ('holding', 9, [9]), ('input', 5, [0])]
+    assert len(coalescer) == 0
+
+
+def test_batches_respect_max_registers():
+    coalescer = WriteCoalescer(debounce=0.0, max_registers=4)
+    for address in range(0, 6, 2):
+        coalescer.add(register(address), str(address), [address, address + 1], 0.0)
+    assert [batch.words for batch in coalescer.take(0.0)] == [[0, 1, 2, 3], [4, 5]]